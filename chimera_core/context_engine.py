@@ -1,216 +1,406 @@
-# FILE: chimera_core/context_engine.py (MODIFICADO PARA USAR GPT-3.5
-
-import os
-import json
-from typing import Dict, Any, List
-
-from .memory.redis_manager import RedisManager
-from .memory.sqlite_manager import SQLiteManager
-from .memory.chroma_manager import ChromaManager
-from .memory.neo4j_manager import Neo4jManager
-from .plugins.plugin_manager import PluginManager
-from .providers.api_manager import ApiManager
-from .utils.logger import logger
-
-class ContextEngine:
-    def __init__(self, api_manager: ApiManager):
-        logger.info("Inicializando el Motor de Contexto y sus gestores...")
-        self.api_manager = api_manager
-        self.redis_manager = RedisManager()
-        self.sqlite_manager = SQLiteManager()
-        self.chroma_manager = ChromaManager()
-        self.plugin_manager = PluginManager()
-        try:
-            self.neo4j_manager = Neo4jManager(
-                uri=os.getenv("NEO4J_URI"), user=os.getenv("NEO4J_USER"), password=os.getenv("NEO4J_PASSWORD")
-            )
-        except Exception as e:
-            logger.exception("Error al inicializar Neo4jManager.")
-            self.neo4j_manager = None
-        
-        logger.info("Motor de Contexto listo.")
-
-    def check_all_connections(self):
-        logger.info("Verificando todas las conexiones de las bases de datos...")
-        self.redis_manager.check_connection()
-        self.sqlite_manager.check_connection()
-        self.chroma_manager.check_connection()
-        if self.neo4j_manager:
-            self.neo4j_manager.check_connection()
-        logger.info("Verificación de conexiones completada.")
-
-    def _extract_entities_with_gpt(self, user_prompt: str, trace_id: str) -> List[str]:
-        log_extra = {'trace_id': trace_id}
-        logger.debug("Extrayendo entidades con GPT-3.5.", extra=log_extra)
-        
-        provider = self.api_manager.get_provider("openai", model="gpt-3.5-turbo", trace_id=trace_id)
-        if not provider:
-            logger.error("No se pudo obtener el proveedor de OpenAI para la extracción de entidades.", extra=log_extra)
-            return []
-
-        extraction_prompt = f"""
-        Analiza el siguiente texto y extrae los conceptos y entidades más importantes.
-        Enfócate en la intención principal de la pregunta.
-        Devuelve el resultado como una lista JSON de strings.
-        Por ejemplo, para "Que campos de la Inteligencia artifical quedan por explorar?", una buena extracción sería ["campos", "explorar", "inteligencia artificial"].
-        Si no encuentras ninguna entidad relevante, devuelve una lista JSON vacía: [].
-        Texto: "{user_prompt}"
-        Entidades (SOLO el JSON):
-        """
-
-        try:
-            response = provider.generate_response(prompt=extraction_prompt, history=[], tools=[])
-            entities_json = response.content.strip()
-
-            # Log the raw response for debugging
-            logger.debug(f"Respuesta cruda de GPT-3.5 para extracción de entidades: '{entities_json}'", extra=log_extra)
-
-            if not entities_json or not entities_json.startswith('['):
-                logger.warning("La respuesta de GPT-3.5 no es un JSON válido o está vacía.", extra=log_extra)
-                return []
-
-            entities = json.loads(entities_json)
-            if isinstance(entities, list) and all(isinstance(e, str) for e in entities):
-                logger.info(f"Entidades extraídas con GPT-3.5: {entities}", extra=log_extra)
-                return entities
-            else:
-                logger.warning(f"La respuesta de GPT-3.5 para extracción de entidades no es una lista de strings: {entities_json}", extra=log_extra)
-                return []
-        except json.JSONDecodeError:
-            logger.exception(f"Error de decodificación JSON al extraer entidades con GPT-3.5. Respuesta recibida: '{entities_json}'", extra=log_extra)
-            return []
-        except Exception as e:
-            logger.exception("Ocurrió un error inesperado al extraer entidades con GPT-3.5.", extra=log_extra)
-            return []
-
-    def _synthesize_context_with_gpt(self, combined_snippets: List[str], trace_id: str) -> str:
-        log_extra = {'trace_id': trace_id}
-        if not combined_snippets:
-            return ""
-
-        text_to_summarize = "\n".join(combined_snippets)
-        
-        provider = self.api_manager.get_provider("openai", model="gpt-3.5-turbo", trace_id=trace_id)
-        if not provider:
-            logger.error("No se pudo obtener el proveedor de OpenAI para la síntesis de contexto.", extra=log_extra)
-            return ""
-
-        summarization_prompt = f"""
-        Resume los siguientes fragmentos de información en un párrafo conciso y coherente. 
-        Este resumen se usará como contexto para un asistente de IA.
-        Fragmentos:
-        {text_to_summarize}
-        Resumen:
-        """
-
-        try:
-            response = provider.generate_response(prompt=summarization_prompt, history=[], tools=[], temperature=0.3, max_tokens=300)
-            synthesized_context = response.content.strip()
-            logger.info("Contexto sintetizado con GPT-3.5.", extra=log_extra)
-            return synthesized_context
-        except Exception as e:
-            logger.exception("Error durante la síntesis de contexto con GPT-3.5.", extra=log_extra)
-            return ""
-
-    def build_augmented_prompt(self, session_id: str, user_prompt: str, personality_directives: Dict[str, Any], trace_id: str) -> Dict[str, Any]:
-        log_extra = {'trace_id': trace_id}
-        relevant_context_snippets = []
-
-        # --- PASO 0: Recuperar Resumen de Memoria a Medio Plazo (SQLite) ---
-        summary = self.sqlite_manager.get_summary(session_id, trace_id)
-        if summary and summary[0]:
-            summary_text = summary[0]
-            logger.info(f"\n--- PASO 0: RESUMEN DE MEMORIA A MEDIO PLAZO RECUPERADO ---\n{summary_text}", extra=log_extra)
-            relevant_context_snippets.append(summary_text)
-
-        # --- PASO 1: Extracción de Entidades con GPT-3.5 ---
-        entity_names = self._extract_entities_with_gpt(user_prompt, trace_id)
-        logger.info(f"\n--- PASO 1: ENTIDADES EXTRAÍDAS ---\n{json.dumps(entity_names, indent=2, ensure_ascii=False)}", extra=log_extra)
-
-        # --- PASO 2 & 3: Búsqueda Condicional en Memoria a Largo Plazo ---
-        if entity_names:
-            logger.info("Entidades relevantes encontradas. Consultando memoria a largo plazo...", extra=log_extra)
-            # --- Búsqueda en ChromaDB ---
-            logger.debug(f"Iniciando búsqueda en ChromaDB por entidades: {entity_names}", extra=log_extra)
-            for entity_name in entity_names:
-                search_query = f"¿Qué información relevante hay sobre {entity_name}?"
-                similar_memories = self.chroma_manager.search_similar(query_text=search_query, n_results=5, filter_by_session=session_id, trace_id=trace_id)
-                if similar_memories and similar_memories.get('documents') and similar_memories['documents'][0]:
-                    chroma_results = similar_memories['documents'][0]
-                    log_message = f"\n--- PASO 2.1: CONTENIDO RECUPERADO DE CHROMADB (para '{entity_name}') ---"
-                    for i, doc in enumerate(chroma_results):
-                        log_message += f"\n[DOC {i+1}]: {doc}"
-                    logger.info(log_message, extra=log_extra)
-                    truncated_results = [doc[:300] + "..." if len(doc) > 300 else doc for doc in chroma_results]
-                    relevant_context_snippets.extend(truncated_results)
-            
-            # --- Búsqueda en Neo4j ---
-            if self.neo4j_manager:
-                structural_info_parts = []
-                for entity_name in entity_names:
-                    related_concepts = self.neo4j_manager.get_related_entities(entity_name, session_id, limit=5, trace_id=trace_id)
-                    if related_concepts:
-                        info = f"Sobre el concepto '{entity_name}', el sistema también conoce estos temas relacionados: {', '.join(related_concepts)}."
-                        structural_info_parts.append(info)
-                
-                if structural_info_parts:
-                    full_structural_info = " ".join(structural_info_parts)
-                    logger.info(f"\n--- PASO 3: CONTENIDO RECUPERADO DE NEO4J ---\n{full_structural_info}", extra=log_extra)
-                    relevant_context_snippets.append(full_structural_info)
-        else:
-            logger.info("No se encontraron entidades relevantes. Omitiendo consulta a memoria a largo plazo.", extra=log_extra)
-        
-        final_context = ""
-        unique_snippets = list(dict.fromkeys(relevant_context_snippets))
-        
-        if unique_snippets:
-            log_message = "\n--- PASO 4: DOSSIER DE FRAGMENTOS PARA RESUMIR ---"
-            for i, snippet in enumerate(unique_snippets):
-                log_message += f"\n[SNIPPET {i+1}]: {snippet}"
-            logger.info(log_message, extra=log_extra)
-
-            synthesized_context = self._synthesize_context_with_gpt(unique_snippets, trace_id)
-            if synthesized_context:
-                final_context = f"--- CONTEXTO DE MEMORIA A LARGO-MEDIO PLAZO ---\n{synthesized_context}"
-                logger.info(f"\n--- PASO 5: CONTEXTO FINAL SINTETIZADO ---\n{final_context}", extra=log_extra)
-
-        personality_instruction = self._translate_directives_to_prompt(personality_directives)
-        tools = self.plugin_manager.get_all_tools()
-        conversational_history = self.redis_manager.get_recent_turns(session_id, num_turns=10, trace_id=trace_id)
-
-        system_prompt_parts = [
-            "Eres Quimera, un asistente de IA avanzado.",
-            personality_instruction,
-            final_context,
-            "Responde de manera útil y coherente..."
-        ]
-        
-        final_system_prompt = "\n".join(filter(None, system_prompt_parts))
-        log_message = "\n--- PASO 6: PROMPT DE SISTEMA FINAL ENSAMBLADO ---"
-        for part in final_system_prompt.split('\n'):
-            log_message += f"\n{part}"
-        logger.info(log_message, extra=log_extra)
-
-        return {"system_prompt": final_system_prompt, "history": conversational_history, "tools": tools, "entities": entity_names}
-
-    def _translate_directives_to_prompt(self, directives: dict) -> str:
-        intent = directives.get('intent')
-        if intent == 'pregunta conceptual o técnica': return "El usuario ha hecho una pregunta técnica. Sé preciso y detallado en tu respuesta."
-        if intent == 'broma o comentario humorístico': return "El usuario está de humor para bromas. Responde de una manera ligera y divertida."
-        return ""
-    
-    def save_turn(self, session_id: str, user_prompt: str, assistant_response: str, user_turn_id: str, assistant_turn_id: str, trace_id: str, user_entities: List[str]):
-        log_extra = {'trace_id': trace_id}
-        logger.debug("Guardando turno en las capas de memoria.", extra=log_extra)
-        self.redis_manager.add_turn(session_id, {"role": "user", "content": user_prompt}, trace_id)
-        self.redis_manager.add_turn(session_id, {"role": "assistant", "content": assistant_response}, trace_id)
-        
-        self.chroma_manager.add_entry(session_id, assistant_response, assistant_turn_id, {"role": "assistant"}, trace_id)
-        
-        if self.neo4j_manager:
-            assistant_entities = self._extract_entities_with_gpt(assistant_response, trace_id)
-            user_entities_dict = [{"text": entity, "label": "MISC"} for entity in user_entities]
-            assistant_entities_dict = [{"text": entity, "label": "MISC"} for entity in assistant_entities]
-
-            self.neo4j_manager.add_message_and_entities(session_id, user_turn_id, "user", user_prompt, user_entities_dict, trace_id)
-            self.neo4j_manager.add_message_and_entities(session_id, assistant_turn_id, "assistant", assistant_response, assistant_entities_dict, trace_id)
+# FILE: chimera_core/context_engine.py (MODIFICADO PARA USAR GPT-3.5
+
+import os
+import re
+import asyncio
+import logging
+from string import Template
+from typing import Dict, Any, List
+
+import orjson
+import spacy
+
+from .memory.redis_manager import RedisManager
+from .memory.sqlite_manager import SQLiteManager
+from .memory.chroma_manager import ChromaManager
+from .memory.neo4j_manager import Neo4jManager
+from .memory.response_cache import ResponseCache
+from .plugins.plugin_manager import PluginManager
+from .providers.api_manager import ApiManager
+from .utils.cache import LRUCache, hash_text
+from .utils.logger import logger
+
+# Tamaño máximo de las cachés de extracción de entidades y de síntesis de contexto.
+ENTITY_CACHE_SIZE = 4096
+SYNTHESIS_CACHE_SIZE = 1024
+# Sesiones cuyo último contexto recuperado de memoria se conserva en caché.
+CONTEXT_CACHE_SIZE = 1024
+# Por debajo de este tamaño (~400 tokens) los fragmentos se pasan tal cual: resumirlos
+# con GPT-3.5 cuesta más latencia de la que ahorra en el prompt final.
+SYNTHESIS_MIN_CHARS = 1500
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+# Extractor de entidades: "spacy" (NER local, sin red) o "gpt" (GPT-3.5).
+ENTITY_EXTRACTOR = os.getenv("ENTITY_EXTRACTOR", "spacy").lower()
+SPACY_MODEL = os.getenv("SPACY_MODEL", "es_core_news_sm")
+
+# Plantillas de los prompts auxiliares: la parte estática se construye una sola vez
+# al importar el módulo y en cada petición solo se interpola el campo variable.
+EXTRACTION_TEMPLATE = Template("""
+        Analiza el siguiente texto y extrae los conceptos y entidades más importantes.
+        Enfócate en la intención principal de la pregunta.
+        Devuelve el resultado como una lista JSON de strings.
+        Por ejemplo, para "Que campos de la Inteligencia artifical quedan por explorar?", una buena extracción sería ["campos", "explorar", "inteligencia artificial"].
+        Si no encuentras ninguna entidad relevante, devuelve una lista JSON vacía: [].
+        Texto: "$prompt"
+        Entidades (SOLO el JSON):
+        """)
+
+SUMMARY_TEMPLATE = Template("""
+        Resume los siguientes fragmentos de información en un párrafo conciso y coherente. 
+        Este resumen se usará como contexto para un asistente de IA.
+        Fragmentos:
+        $snippets
+        Resumen:
+        """)
+
+# Prompt de sistema fijo. Se mantiene idéntico byte a byte entre peticiones para que los
+# proveedores con caché de prefijos (p. ej. OpenAI) reutilicen sus tokens; todo lo que cambia
+# por petición (directivas de personalidad y memoria recuperada) va en un mensaje aparte.
+STATIC_SYSTEM_PROMPT = "Eres Quimera, un asistente de IA avanzado.\nResponde de manera útil y coherente..."
+
+class ContextEngine:
+    def __init__(self, api_manager: ApiManager):
+        logger.info("Inicializando el Motor de Contexto y sus gestores...")
+        self.api_manager = api_manager
+        self.redis_manager = RedisManager()
+        self.sqlite_manager = SQLiteManager()
+        self.chroma_manager = ChromaManager()
+        self.plugin_manager = PluginManager()
+        # Caché semántica de respuestas del LLM: reutiliza Redis y el modelo de embeddings de ChromaDB.
+        self.response_cache = ResponseCache(self.redis_manager.client, self.chroma_manager.embedding_function)
+        # El conjunto de herramientas es estático tras el arranque: se calcula una vez
+        # y solo se regenera con una recarga explícita de plugins (reload_tools).
+        self._cached_tools = self.plugin_manager.get_all_tools()
+        # Cachés de las llamadas auxiliares a GPT-3.5, indexadas por hash del texto de entrada.
+        self._entity_cache = LRUCache(maxsize=ENTITY_CACHE_SIZE)
+        self._synthesis_cache = LRUCache(maxsize=SYNTHESIS_CACHE_SIZE)
+        # Último contexto recuperado por sesión: {session_id: ((hash_del_prompt, nº_de_turnos), contexto)}.
+        # Si el mismo prompt se repite sin que se haya guardado ningún turno nuevo, la memoria
+        # no ha cambiado y se evitan las lecturas de SQLite, ChromaDB y Neo4j.
+        self._context_cache = LRUCache(maxsize=CONTEXT_CACHE_SIZE)
+        # Entidades ya extraídas dentro de una misma petición: {trace_id: {hash_del_texto: entidades}}.
+        # Evita repetir la extracción entre build_augmented_prompt y save_turn; el orquestador
+        # libera la entrada al terminar la petición.
+        self._request_cache: Dict[str, Dict[str, List[str]]] = {}
+        self._nlp = None
+        if ENTITY_EXTRACTOR == "spacy":
+            try:
+                self._nlp = spacy.load(SPACY_MODEL, disable=["lemmatizer"])
+                logger.info(f"Extractor de entidades local (spaCy '{SPACY_MODEL}') cargado.")
+            except Exception:
+                logger.exception(f"Error al cargar el modelo de spaCy '{SPACY_MODEL}'. Se usará GPT-3.5 para la extracción de entidades.")
+        try:
+            self.neo4j_manager = Neo4jManager(
+                uri=os.getenv("NEO4J_URI"), user=os.getenv("NEO4J_USER"), password=os.getenv("NEO4J_PASSWORD")
+            )
+        except Exception as e:
+            logger.exception("Error al inicializar Neo4jManager.")
+            self.neo4j_manager = None
+        
+        logger.info("Motor de Contexto listo.")
+
+    async def check_all_connections(self):
+        logger.info("Verificando todas las conexiones de las bases de datos...")
+        self.redis_manager.check_connection()
+        self.sqlite_manager.check_connection()
+        self.chroma_manager.check_connection()
+        if self.neo4j_manager:
+            # Neo4j es opcional: si no responde al arrancar, se continúa sin memoria de grafo.
+            try:
+                await self.neo4j_manager.initialize()
+            except Exception:
+                logger.exception("No se pudo conectar con Neo4j. Se continuará sin memoria de grafo.")
+                await self.neo4j_manager.close()
+                self.neo4j_manager = None
+        logger.info("Verificación de conexiones completada.")
+
+    async def close(self):
+        """Vuelca las escrituras pendientes y cierra las conexiones asíncronas."""
+        if self.neo4j_manager:
+            await self.neo4j_manager.close()
+
+    def _extract_entities(self, text: str, trace_id: str) -> List[str]:
+        """Extrae entidades con spaCy si está disponible y, si no, con GPT-3.5."""
+        request_entities = self._request_cache.setdefault(trace_id, {})
+        text_hash = hash_text(text)
+        if text_hash in request_entities:
+            logger.debug("Entidades recuperadas de la caché de la petición.", extra={'trace_id': trace_id})
+            return list(request_entities[text_hash])
+
+        if self._nlp is not None:
+            entities = self._extract_entities_with_spacy(text, trace_id)
+        else:
+            entities = self._extract_entities_with_gpt(text, trace_id)
+        request_entities[text_hash] = list(entities)
+        return entities
+
+    def reload_tools(self) -> List[Any]:
+        """Recarga los plugins y regenera la lista de herramientas cacheada."""
+        self.plugin_manager.reload_plugins()
+        self._cached_tools = self.plugin_manager.get_all_tools()
+        logger.info(f"Herramientas recargadas: {len(self._cached_tools)} disponibles.")
+        return self._cached_tools
+
+    def invalidate_context_cache(self, session_id: str = None):
+        """Descarta el contexto cacheado de una sesión, o el de todas si no se indica ninguna."""
+        if session_id is None:
+            self._context_cache.clear()
+        else:
+            self._context_cache.pop(session_id)
+
+    def release_request_cache(self, trace_id: str):
+        """Libera las entidades cacheadas para una petición ya finalizada."""
+        self._request_cache.pop(trace_id, None)
+
+    def _extract_entities_with_spacy(self, text: str, trace_id: str) -> List[str]:
+        log_extra = {'trace_id': trace_id}
+        try:
+            doc = self._nlp(text)
+            candidates = [ent.text for ent in doc.ents]
+            for chunk in doc.noun_chunks:
+                # Eliminamos determinantes y pronombres ("la inteligencia artificial" -> "inteligencia artificial")
+                words = [token.text for token in chunk if token.pos_ not in ("DET", "PRON") and not token.is_stop]
+                if words:
+                    candidates.append(" ".join(words))
+            entities = list(dict.fromkeys(c.strip().lower() for c in candidates if c.strip()))
+            logger.info("Entidades extraídas con spaCy: %s", entities, extra=log_extra)
+            return entities
+        except Exception:
+            logger.exception("Ocurrió un error inesperado al extraer entidades con spaCy.", extra=log_extra)
+            return []
+
+    def _extract_entities_with_gpt(self, user_prompt: str, trace_id: str) -> List[str]:
+        log_extra = {'trace_id': trace_id}
+        prompt_hash = hash_text(user_prompt)
+        cached_entities = self._entity_cache.get(prompt_hash)
+        if cached_entities is not None:
+            logger.debug("Entidades recuperadas de la caché.", extra=log_extra)
+            return list(cached_entities)
+
+        logger.debug("Extrayendo entidades con GPT-3.5.", extra=log_extra)
+        
+        provider = self.api_manager.get_provider("openai", model="gpt-3.5-turbo", trace_id=trace_id)
+        if not provider:
+            logger.error("No se pudo obtener el proveedor de OpenAI para la extracción de entidades.", extra=log_extra)
+            return []
+
+        extraction_prompt = EXTRACTION_TEMPLATE.substitute(prompt=user_prompt)
+
+        try:
+            response = provider.generate_response(prompt=extraction_prompt, history=[], tools=[])
+            entities_json = response.content.strip()
+
+            # Log the raw response for debugging
+            logger.debug("Respuesta cruda de GPT-3.5 para extracción de entidades: '%s'", entities_json, extra=log_extra)
+
+            if not entities_json or not entities_json.startswith('['):
+                logger.warning("La respuesta de GPT-3.5 no es un JSON válido o está vacía.", extra=log_extra)
+                return []
+
+            entities = orjson.loads(entities_json)
+            if isinstance(entities, list) and all(isinstance(e, str) for e in entities):
+                logger.info("Entidades extraídas con GPT-3.5: %s", entities, extra=log_extra)
+                # Solo se cachean respuestas válidas para no retener entradas envenenadas.
+                self._entity_cache.set(prompt_hash, list(entities))
+                return entities
+            else:
+                logger.warning("La respuesta de GPT-3.5 para extracción de entidades no es una lista de strings: %s", entities_json, extra=log_extra)
+                return []
+        except orjson.JSONDecodeError:
+            logger.exception("Error de decodificación JSON al extraer entidades con GPT-3.5. Respuesta recibida: '%s'", entities_json, extra=log_extra)
+            return []
+        except Exception as e:
+            logger.exception("Ocurrió un error inesperado al extraer entidades con GPT-3.5.", extra=log_extra)
+            return []
+
+    def _synthesize_context_with_gpt(self, combined_snippets: List[str], trace_id: str) -> str:
+        log_extra = {'trace_id': trace_id}
+        if not combined_snippets:
+            return ""
+
+        if sum(len(snippet) for snippet in combined_snippets) <= SYNTHESIS_MIN_CHARS:
+            logger.info("Fragmentos lo bastante cortos: se omite la síntesis con GPT-3.5.", extra=log_extra)
+            return "\n".join(combined_snippets)
+
+        snippets_hash = hash_text("\n".join(sorted(combined_snippets)))
+        cached_context = self._synthesis_cache.get(snippets_hash)
+        if cached_context is not None:
+            logger.info("Contexto sintetizado recuperado de la caché.", extra=log_extra)
+            return cached_context
+
+        provider = self.api_manager.get_provider("openai", model="gpt-3.5-turbo", trace_id=trace_id)
+        if not provider:
+            logger.error("No se pudo obtener el proveedor de OpenAI para la síntesis de contexto.", extra=log_extra)
+            return ""
+
+        summarization_prompt = SUMMARY_TEMPLATE.substitute(snippets="\n".join(combined_snippets))
+
+        try:
+            response = provider.generate_response(prompt=summarization_prompt, history=[], tools=[], temperature=0.3, max_tokens=300)
+            synthesized_context = response.content.strip()
+            logger.info("Contexto sintetizado con GPT-3.5.", extra=log_extra)
+            if synthesized_context:
+                self._synthesis_cache.set(snippets_hash, synthesized_context)
+            return synthesized_context
+        except Exception as e:
+            logger.exception("Error durante la síntesis de contexto con GPT-3.5.", extra=log_extra)
+            return ""
+
+    def _search_chroma_snippets(self, entity_names: List[str], session_id: str, trace_id: str) -> List[str]:
+        log_extra = {'trace_id': trace_id}
+        logger.debug("Iniciando búsqueda en ChromaDB por entidades: %s", entity_names, extra=log_extra)
+        snippets = []
+        # Hashes de los documentos completos ya vistos (normalizados en espacios y mayúsculas),
+        # para descartar duplicados entre entidades antes de truncar.
+        seen_hashes = set()
+        log_info_enabled = logger.isEnabledFor(logging.INFO)
+        search_queries = [f"¿Qué información relevante hay sobre {entity_name}?" for entity_name in entity_names]
+        similar_memories = self.chroma_manager.search_similar_batch(query_texts=search_queries, n_results=5, filter_by_session=session_id, trace_id=trace_id)
+        documents_per_query = (similar_memories or {}).get('documents') or []
+        for entity_name, chroma_results in zip(entity_names, documents_per_query):
+            if chroma_results:
+                if log_info_enabled:
+                    log_lines = [f"\n--- PASO 2.1: CONTENIDO RECUPERADO DE CHROMADB (para '{entity_name}') ---"]
+                    log_lines.extend(f"[DOC {i+1}]: {doc}" for i, doc in enumerate(chroma_results))
+                    logger.info("\n".join(log_lines), extra=log_extra)
+                for doc in chroma_results:
+                    doc_hash = hash_text(_WHITESPACE_RE.sub(" ", doc).strip().lower())
+                    if doc_hash in seen_hashes:
+                        continue
+                    seen_hashes.add(doc_hash)
+                    snippets.append(doc[:300] + "..." if len(doc) > 300 else doc)
+        return snippets
+
+    async def _search_neo4j_info(self, entity_names: List[str], session_id: str, trace_id: str) -> str:
+        log_extra = {'trace_id': trace_id}
+        if not self.neo4j_manager:
+            return ""
+        structural_info_parts = []
+        related_by_entity = await self.neo4j_manager.get_related_entities_batch(entity_names, session_id, limit=5, trace_id=trace_id)
+        for entity_name, related_concepts in related_by_entity.items():
+            if related_concepts:
+                info = f"Sobre el concepto '{entity_name}', el sistema también conoce estos temas relacionados: {', '.join(related_concepts)}."
+                structural_info_parts.append(info)
+
+        if not structural_info_parts:
+            return ""
+        full_structural_info = " ".join(structural_info_parts)
+        logger.info("\n--- PASO 3: CONTENIDO RECUPERADO DE NEO4J ---\n%s", full_structural_info, extra=log_extra)
+        return full_structural_info
+
+    async def _retrieve_memory_context(self, session_id: str, user_prompt: str, trace_id: str) -> Dict[str, Any]:
+        """Consulta las cuatro memorias y devuelve el contexto sintetizado, el historial y las entidades."""
+        log_extra = {'trace_id': trace_id}
+        relevant_context_snippets = []
+
+        # --- PASO 0 & 1: Resumen (SQLite), Entidades e Historial (Redis) en paralelo ---
+        # Las tres consultas son independientes entre sí, así que se solapan en hilos
+        # para que la latencia total sea la de la más lenta y no la suma de todas.
+        summary, entity_names, conversational_history = await asyncio.gather(
+            asyncio.to_thread(self.sqlite_manager.get_summary, session_id, trace_id),
+            asyncio.to_thread(self._extract_entities, user_prompt, trace_id),
+            asyncio.to_thread(self.redis_manager.get_recent_turns, session_id, 10, trace_id)
+        )
+
+        if summary and summary[0]:
+            summary_text = summary[0]
+            logger.info("\n--- PASO 0: RESUMEN DE MEMORIA A MEDIO PLAZO RECUPERADO ---\n%s", summary_text, extra=log_extra)
+            relevant_context_snippets.append(summary_text)
+
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("\n--- PASO 1: ENTIDADES EXTRAÍDAS ---\n%s", orjson.dumps(entity_names, option=orjson.OPT_INDENT_2).decode(), extra=log_extra)
+
+        # --- PASO 2 & 3: Búsqueda Condicional en Memoria a Largo Plazo (ChromaDB y Neo4j en paralelo) ---
+        if entity_names:
+            logger.info("Entidades relevantes encontradas. Consultando memoria a largo plazo...", extra=log_extra)
+            chroma_snippets, structural_info = await asyncio.gather(
+                asyncio.to_thread(self._search_chroma_snippets, entity_names, session_id, trace_id),
+                self._search_neo4j_info(entity_names, session_id, trace_id)
+            )
+            relevant_context_snippets.extend(chroma_snippets)
+            if structural_info:
+                relevant_context_snippets.append(structural_info)
+        else:
+            logger.info("No se encontraron entidades relevantes. Omitiendo consulta a memoria a largo plazo.", extra=log_extra)
+        
+        final_context = ""
+        unique_snippets = list(dict.fromkeys(relevant_context_snippets))
+        
+        if unique_snippets:
+            if logger.isEnabledFor(logging.INFO):
+                log_lines = ["\n--- PASO 4: DOSSIER DE FRAGMENTOS PARA RESUMIR ---"]
+                log_lines.extend(f"[SNIPPET {i+1}]: {snippet}" for i, snippet in enumerate(unique_snippets))
+                logger.info("\n".join(log_lines), extra=log_extra)
+
+            synthesized_context = await asyncio.to_thread(self._synthesize_context_with_gpt, unique_snippets, trace_id)
+            if synthesized_context:
+                final_context = f"--- CONTEXTO DE MEMORIA A LARGO-MEDIO PLAZO ---\n{synthesized_context}"
+                logger.info("\n--- PASO 5: CONTEXTO FINAL SINTETIZADO ---\n%s", final_context, extra=log_extra)
+
+        return {"context": final_context, "history": conversational_history, "entities": entity_names}
+
+    async def build_augmented_prompt(self, session_id: str, user_prompt: str, personality_directives: Dict[str, Any], trace_id: str) -> Dict[str, Any]:
+        log_extra = {'trace_id': trace_id}
+
+        # El contexto recuperado solo depende del prompt y del estado de la memoria de la sesión:
+        # el id de la última entrada del stream cambia con cada guardado (aunque el tamaño se
+        # mantenga por `MAXLEN ~`) y el número de turnos, con cada poda tras un resumen.
+        turn_count, last_entry_id = await asyncio.to_thread(self.redis_manager.get_stream_state, session_id, trace_id)
+        cache_key = (hash_text(user_prompt), turn_count, last_entry_id)
+        cached = self._context_cache.get(session_id)
+        if cached is not None and cached[0] == cache_key:
+            logger.info("Contexto de memoria recuperado de la caché de la sesión.", extra=log_extra)
+            memory_context = cached[1]
+        else:
+            memory_context = await self._retrieve_memory_context(session_id, user_prompt, trace_id)
+            self._context_cache.set(session_id, (cache_key, memory_context))
+
+        final_context = memory_context["context"]
+        conversational_history = list(memory_context["history"])
+        entity_names = list(memory_context["entities"])
+
+        personality_instruction = self._translate_directives_to_prompt(personality_directives)
+        tools = self._cached_tools
+
+        dynamic_context = "\n".join(filter(None, (personality_instruction, final_context)))
+        # El bloque completo solo se vuelca en DEBUG; en INFO basta con su huella y tamaño.
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("\n--- PASO 6: CONTEXTO DINÁMICO ENSAMBLADO ---\n%s", dynamic_context, extra=log_extra)
+        elif logger.isEnabledFor(logging.INFO):
+            logger.info("--- PASO 6: CONTEXTO DINÁMICO ENSAMBLADO --- (hash: %s, %d caracteres)", hash_text(dynamic_context), len(dynamic_context), extra=log_extra)
+
+        return {
+            "system_prompt": STATIC_SYSTEM_PROMPT, "dynamic_context": dynamic_context,
+            "history": conversational_history, "tools": tools, "entities": entity_names,
+            "turn_count": turn_count
+        }
+
+    def _translate_directives_to_prompt(self, directives: dict) -> str:
+        intent = directives.get('intent')
+        if intent == 'pregunta conceptual o técnica': return "El usuario ha hecho una pregunta técnica. Sé preciso y detallado en tu respuesta."
+        if intent == 'broma o comentario humorístico': return "El usuario está de humor para bromas. Responde de una manera ligera y divertida."
+        return ""
+    
+    async def save_turn(self, session_id: str, user_prompt: str, assistant_response: str, user_turn_id: str, assistant_turn_id: str, trace_id: str, user_entities: List[str]):
+        log_extra = {'trace_id': trace_id}
+        logger.debug("Guardando turno en las capas de memoria.", extra=log_extra)
+        await asyncio.to_thread(
+            self.redis_manager.add_turns, session_id,
+            [{"role": "user", "content": user_prompt}, {"role": "assistant", "content": assistant_response}],
+            trace_id=trace_id
+        )
+        
+        await asyncio.to_thread(self.chroma_manager.add_entry, session_id, assistant_response, assistant_turn_id, {"role": "assistant"}, trace_id)
+        
+        if self.neo4j_manager:
+            assistant_entities = await asyncio.to_thread(self._extract_entities, assistant_response, trace_id)
+            user_entities_dict = [{"text": entity, "label": "MISC"} for entity in user_entities]
+            assistant_entities_dict = [{"text": entity, "label": "MISC"} for entity in assistant_entities]
+
+            await self.neo4j_manager.add_message_and_entities(session_id, user_turn_id, "user", user_prompt, user_entities_dict, trace_id)
+            await self.neo4j_manager.add_message_and_entities(session_id, assistant_turn_id, "assistant", assistant_response, assistant_entities_dict, trace_id)
+
+        # La memoria de la sesión ha cambiado: el contexto cacheado ya no es válido.
+        self.invalidate_context_cache(session_id)
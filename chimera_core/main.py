@@ -4,13 +4,18 @@ from dotenv import load_dotenv
 load_dotenv()
 
 from fastapi import FastAPI, HTTPException, BackgroundTasks 
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from fastapi.middleware.gzip import GZipMiddleware
 from pydantic import BaseModel, RootModel
 import uvicorn
 import uuid
-from typing import List, Dict
+import os
+import asyncio
+from typing import List, Dict, Optional
 
 # Importamos el cerebro del sistema
 from .orchestrator import Orchestrator, LLMSettings
+from .plugins.confirmation_broker import confirmation_broker
 
 # --- Modelos de Datos (Pydantic) ---
 # Definen la estructura de los datos para las peticiones y respuestas de la API.
@@ -19,6 +24,11 @@ from .orchestrator import Orchestrator, LLMSettings
 class ProviderModels(RootModel):
     root: Dict[str, List[str]]
 
+class SettingsBootstrap(BaseModel):
+    """Todo lo que necesita la configuración de la UI, en una sola respuesta."""
+    providers: Dict[str, List[str]]
+    current_settings: LLMSettings
+
 
 
 class UserRequest(BaseModel):
@@ -26,6 +36,7 @@ class UserRequest(BaseModel):
     session_id: str
     prompt: str
     llm_settings: LLMSettings # Añadido para incluir la configuración del LLM
+    trace_id: Optional[str] = None # Lo fija el cliente para consultar las confirmaciones de esta petición
 
 class ChimeraResponse(BaseModel):
     """Modelo para la respuesta de Quimera."""
@@ -45,13 +56,34 @@ class ResetMemoryRequest(BaseModel):
     """Modelo para la petición de reseteo de una memoria."""
     memory_type: str
 
+class ConfirmationDecision(BaseModel):
+    """Modelo para aceptar o rechazar una acción pendiente de confirmación."""
+    approved: bool
+
 
 # --- Inicialización de la Aplicación FastAPI ---
 app = FastAPI(
     title="Chimera Core API",
     description="El Córtex del Proyecto Quimera. Gestiona la lógica, memoria y proveedores de LLM.",
-    version="1.0.0"
+    version="1.0.0",
+    # orjson serializa las respuestas bastante más rápido que el json de la stdlib.
+    default_response_class=ORJSONResponse
 )
+# Rutas que responden en streaming: el gzip de Starlette no vacía su búfer en cada fragmento,
+# así que comprimirlas agruparía los tokens en bloques grandes.
+UNCOMPRESSED_PATHS = {"/v1/chat/stream"}
+
+class JSONGZipMiddleware(GZipMiddleware):
+    """GZipMiddleware que deja pasar sin comprimir las rutas de UNCOMPRESSED_PATHS."""
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"] in UNCOMPRESSED_PATHS:
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
+
+# Las respuestas JSON de más de 1 KB se comprimen con gzip si el cliente lo acepta (Accept-Encoding).
+app.add_middleware(JSONGZipMiddleware, minimum_size=1024)
 
 # --- Instancia Global del Orquestador ---
 # Creamos una única instancia del orquestador que será utilizada por todas las peticiones.
@@ -61,7 +93,12 @@ orchestrator = Orchestrator()
 
 @app.on_event("startup")
 async def startup_event():
-    orchestrator.context_engine.check_all_connections()
+    confirmation_broker.bind_loop(asyncio.get_running_loop())
+    await orchestrator.context_engine.check_all_connections()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await orchestrator.close()
 
 
 # --- Endpoints de la API ---
@@ -90,6 +127,7 @@ async def reset_memory(request: ResetMemoryRequest):
     if request.memory_type == "chroma":
         success = orchestrator.context_engine.chroma_manager.reset_database()
         if success:
+            orchestrator.context_engine.invalidate_context_cache()
             return {"message": "La base de datos de ChromaDB ha sido reseteada exitosamente."}
         else:
             raise HTTPException(status_code=500, detail="Ocurrió un error al resetear ChromaDB.")
@@ -97,6 +135,37 @@ async def reset_memory(request: ResetMemoryRequest):
         raise HTTPException(status_code=400, detail=f"Tipo de memoria '{request.memory_type}' no soportado para reseteo.")
 
 
+@app.post("/v1/plugins/reload", tags=["Plugins"])
+async def reload_plugins():
+    """
+    Endpoint para recargar los plugins y regenerar la lista de herramientas
+    que se ofrece al LLM en cada petición.
+    """
+    try:
+        tools = orchestrator.context_engine.reload_tools()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Ocurrió un error al recargar los plugins: {e}")
+    return {"message": "Plugins recargados exitosamente.", "tools": [tool.name for tool in tools]}
+
+
+@app.get("/v1/confirmations", tags=["Plugins"])
+async def get_pending_confirmations(trace_id: Optional[str] = None):
+    """
+    Endpoint que lista las acciones de los plugins que esperan confirmación del usuario
+    (p. ej. el envío de un correo), opcionalmente filtradas por trace_id.
+    """
+    return confirmation_broker.list_pending(trace_id)
+
+@app.post("/v1/confirmations/{confirmation_id}", tags=["Plugins"])
+async def resolve_confirmation(confirmation_id: str, decision: ConfirmationDecision):
+    """
+    Endpoint para aceptar o rechazar una acción pendiente de confirmación.
+    """
+    if not confirmation_broker.resolve(confirmation_id, decision.approved):
+        raise HTTPException(status_code=404, detail=f"No hay ninguna confirmación pendiente con ID '{confirmation_id}'.")
+    return {"message": "Acción confirmada." if decision.approved else "Acción rechazada."}
+
+
 @app.get("/v1/sessions", response_model=List[SessionInfo], tags=["Sessions"])
 async def get_sessions():
     """
@@ -122,7 +191,7 @@ async def create_session(request: NewSessionRequest):
     # Crear en Neo4j
     if orchestrator.context_engine.neo4j_manager:
         try:
-            orchestrator.context_engine.neo4j_manager.create_session_in_graph(session_id, session_name)
+            await orchestrator.context_engine.neo4j_manager.create_session_in_graph(session_id, session_name)
         except Exception as e:
             # Si Neo4j falla, podríamos querer revertir la creación en SQLite (rollback)
             # Por ahora, simplemente lanzamos un error.
@@ -141,7 +210,7 @@ async def delete_session(session_id: str):
     """
     Endpoint para eliminar una sesión y todos sus datos asociados.
     """
-    success = orchestrator.delete_session_data(session_id)
+    success = await orchestrator.delete_session_data(session_id)
     if not success:
         raise HTTPException(status_code=500, detail="Ocurrió un error al eliminar los datos de la sesión.")
 
@@ -150,11 +219,22 @@ async def get_providers():
     """
     Endpoint para obtener la lista de proveedores de LLM disponibles y sus modelos.
     """
+    return _get_provider_models()
+
+def _get_provider_models() -> Dict[str, List[str]]:
     providers_data = {}
     for provider_name in orchestrator.api_manager.get_available_providers():
         providers_data[provider_name] = orchestrator.api_manager.get_provider_models(provider_name)
     return providers_data
 
+@app.get("/v1/settings/bootstrap", response_model=SettingsBootstrap, tags=["Settings"])
+async def get_settings_bootstrap():
+    """
+    Endpoint para obtener en una sola petición los proveedores con sus modelos y la configuración
+    actual del LLM (lo que devuelven /v1/providers y /v1/settings por separado).
+    """
+    return {"providers": _get_provider_models(), "current_settings": orchestrator.get_current_llm_settings()}
+
 @app.post("/v1/settings", tags=["Settings"])
 async def update_settings(settings: LLMSettings):
     """
@@ -164,7 +244,7 @@ async def update_settings(settings: LLMSettings):
         settings.provider_name,
         settings.model_name,
         settings.temperature,
-        settings.max_output_tokens
+        settings.max_tokens
     )
     return {"message": "Configuración de LLM actualizada.", "current_settings": orchestrator.get_current_llm_settings()}
 
@@ -185,7 +265,7 @@ async def handle_chat(request: UserRequest, background_tasks: BackgroundTasks):
     llamará al Orquestador para procesar la petición completa.
     """
     # Llama al orquestador para procesar la solicitud
-    result = orchestrator.handle_user_request(request.session_id, request.prompt, request.llm_settings, background_tasks)
+    result = await orchestrator.handle_user_request(request.session_id, request.prompt, request.llm_settings, background_tasks, request.trace_id)
 
     # Construye la respuesta final
     if "error" in result:
@@ -201,15 +281,34 @@ async def handle_chat(request: UserRequest, background_tasks: BackgroundTasks):
     
     return response
 
+@app.post("/v1/chat/stream", tags=["Conversation"])
+async def handle_chat_stream(request: UserRequest, background_tasks: BackgroundTasks):
+    """
+    Variante en streaming de /v1/chat: devuelve el texto de la respuesta final en fragmentos
+    (text/plain) a medida que lo genera el LLM. El guardado del turno y el resumen se ejecutan
+    como tareas de fondo cuando el stream termina.
+    """
+    return StreamingResponse(
+        orchestrator.stream_user_request(request.session_id, request.prompt, request.llm_settings, background_tasks, request.trace_id),
+        media_type="text/plain; charset=utf-8"
+    )
+
 # --- Punto de Entrada para Ejecución Directa ---
 # Esto permite ejecutar el servidor directamente con `python main.py`
 # `uvicorn.run` es la forma programática de iniciar el servidor ASGI.
+# Con loop/http en "auto", uvicorn usa uvloop y httptools si están instalados (uvloop no existe en
+# Windows) y, si no, asyncio y h11. CHIMERA_ENV=development activa la recarga automática.
 if __name__ == "__main__":
+    dev_mode = os.getenv("CHIMERA_ENV", "production").lower() == "development"
     print("Iniciando servidor FastAPI con Uvicorn...")
     uvicorn.run(
         "main:app", 
-        host="127.0.0.1", 
-        port=8000, 
-        reload=True,  # El servidor se reinicia automáticamente con los cambios en el código
+        host=os.getenv("CHIMERA_HOST", "127.0.0.1"), 
+        port=int(os.getenv("CHIMERA_PORT", "8000")), 
+        loop="auto",
+        http="auto",
+        # Cada worker carga sus propios modelos y gestores de memoria, así que por defecto es uno.
+        workers=None if dev_mode else int(os.getenv("CHIMERA_WORKERS", "1")),
+        reload=dev_mode,  # El servidor se reinicia automáticamente con los cambios en el código
         log_level="info"
     )
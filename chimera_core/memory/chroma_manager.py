@@ -1,45 +1,275 @@
 
 import chromadb
+import faiss
+import numpy as np
+import torch
+import atexit
+import threading
+from collections import deque
 from chromadb.utils import embedding_functions
 import os
 from typing import List, Dict, Any
 from ..utils.logger import logger
+from ..utils.cache import LRUCache
 
 EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+EMBEDDING_DIM = 384 # Dimensión de los vectores de all-MiniLM-L6-v2
+FAISS_HNSW_M = 32 # Número de vecinos por nodo del grafo HNSW
+RERANK_FACTOR = 4 # Candidatos INT8 por resultado que se reordenan en FP32
+WRITE_BATCH_SIZE = 50 # Escrituras acumuladas que fuerzan un volcado inmediato
+WRITE_FLUSH_INTERVAL = 0.1 # Segundos máximos que una escritura espera en el búfer
+SESSION_INDEX_CACHE_SIZE = int(os.getenv("CHROMA_SESSION_INDEX_CACHE_SIZE", 32)) # Índices FAISS de sesión en memoria
+# Los embeddings se normalizan al generarse, así que el producto interno equivale a la
+# similitud coseno y se ahorra el cálculo de normas en cada comparación.
+COLLECTION_METADATA = {"hnsw:space": "ip"}
+MIGRATION_SUFFIX = "__ip_migration" # Sufijo de la colección temporal durante la migración a producto interno
 CHROMA_PATH = os.path.join(os.path.dirname(__file__), '..', '..', 'chroma_data')
 
+class _SessionVectorIndex:
+    """
+    Índice FAISS en memoria con los vectores de una única sesión.
+
+    ChromaDB sigue siendo la capa de persistencia; este índice solo acelera las lecturas.
+    Los vectores llegan ya normalizados, por lo que el producto interno es la similitud coseno.
+
+    El grafo HNSW se recorre sobre códigos INT8 (cuantización escalar), 4 veces más compactos
+    que FP32, y los `n_results * RERANK_FACTOR` candidatos se reordenan con el producto
+    interno exacto en FP32 para no perder precisión en el resultado final.
+    """
+
+    def __init__(self, dim: int = EMBEDDING_DIM):
+        self.index = faiss.IndexHNSWSQ(dim, faiss.ScalarQuantizer.QT_8bit, FAISS_HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        # Al estar normalizados, cada componente está en [-1, 1]: entrenamos el cuantizador
+        # con ese rango fijo en lugar de depender de una muestra de la sesión.
+        self.index.train(np.stack([-np.ones(dim), np.ones(dim)]).astype(np.float32))
+        self.vectors = np.empty((0, dim), dtype=np.float32)
+        self.ids: List[str] = []
+        self.documents: List[str] = []
+        self.metadatas: List[Dict[str, Any]] = []
+
+    def add(self, embeddings, ids: List[str], documents: List[str], metadatas: List[Dict[str, Any]]):
+        if not ids:
+            return
+        vectors = np.ascontiguousarray(embeddings, dtype=np.float32)
+        self.index.add(vectors)
+        self.vectors = np.vstack([self.vectors, vectors])
+        self.ids.extend(ids)
+        self.documents.extend(documents)
+        self.metadatas.extend(metadatas)
+
+    def search(self, query_embeddings, n_results: int) -> Dict[str, List[List[Any]]]:
+        """Devuelve los resultados con la misma forma que `collection.query` de ChromaDB."""
+        results = {'ids': [], 'documents': [], 'metadatas': [], 'distances': []}
+        vectors = np.ascontiguousarray(query_embeddings, dtype=np.float32)
+        k = min(n_results, self.index.ntotal)
+        if k == 0:
+            for key in results:
+                results[key] = [[] for _ in range(len(vectors))]
+            return results
+
+        n_candidates = min(n_results * RERANK_FACTOR, self.index.ntotal)
+        _, candidates = self.index.search(vectors, n_candidates)
+        for query_vector, row_candidates in zip(vectors, candidates):
+            row_candidates = row_candidates[row_candidates != -1]
+            exact_similarities = self.vectors[row_candidates] @ query_vector
+            order = np.argsort(-exact_similarities)[:k]
+            positions = row_candidates[order]
+            similarities = exact_similarities[order]
+            results['ids'].append([self.ids[pos] for pos in positions])
+            results['documents'].append([self.documents[pos] for pos in positions])
+            results['metadatas'].append([self.metadatas[pos] for pos in positions])
+            # Misma distancia que devuelve ChromaDB con "hnsw:space": "ip"
+            results['distances'].append([float(1.0 - sim) for sim in similarities])
+        return results
+
 class ChromaManager:
     def __init__(self, path: str = CHROMA_PATH, collection_name: str = "chimera_semantic_memory"):
         self.path = path
         self.collection_name = collection_name
         self.client = None
         self.collection = None
+        self.embedding_function = None
+        # Índices FAISS por sesión, construidos bajo demanda a partir de ChromaDB. Solo se conservan
+        # los de las sesiones usadas más recientemente; uno descartado se reconstruye al volver a usarse.
+        self._session_indexes = LRUCache(maxsize=SESSION_INDEX_CACHE_SIZE)
+        self._index_lock = threading.Lock()
+        # Búfer de escrituras: se vuelcan en lote con una sola llamada a `collection.add`.
+        self._write_buffer = deque()
+        self._buffer_lock = threading.Lock()
+        self._flush_timer = None
+        atexit.register(self.flush)
+        # Inicialización anticipada: el cliente y el modelo de embeddings se cargan una sola vez
+        # al arrancar, para que la primera consulta no pague el coste del arranque en frío.
+        self._initialize()
 
-    def check_connection(self):
+    def _initialize(self):
         try:
+            device = "cuda" if torch.cuda.is_available() else "cpu"
             self.client = chromadb.PersistentClient(path=self.path)
-            self.embedding_function = embedding_functions.SentenceTransformerEmbeddingFunction(model_name=EMBEDDING_MODEL)
+            self.embedding_function = embedding_functions.SentenceTransformerEmbeddingFunction(
+                model_name=EMBEDDING_MODEL, device=device, normalize_embeddings=True
+            )
+            self._recover_interrupted_migration()
             self.collection = self.client.get_or_create_collection(
                 name=self.collection_name,
                 embedding_function=self.embedding_function,
-                metadata={"hnsw:space": "cosine"}
+                metadata=COLLECTION_METADATA
             )
-            logger.info(f"Cliente de ChromaDB inicializado. Colección '{self.collection_name}' lista en '{self.path}'.")
+            if (self.collection.metadata or {}).get("hnsw:space") != COLLECTION_METADATA["hnsw:space"]:
+                self._migrate_to_inner_product()
+            # Calentamiento: fuerza la carga de los pesos del modelo de embeddings.
+            self.embedding_function(["warmup"])
+            logger.info(f"Cliente de ChromaDB inicializado. Colección '{self.collection_name}' lista en '{self.path}' (dispositivo: {device}).")
         except Exception:
             logger.exception("Error fatal al inicializar ChromaDB. La memoria semántica no estará disponible.")
+            self.client = None
+            self.collection = None
+
+    def _recover_interrupted_migration(self):
+        """
+        Si una migración se interrumpió entre el borrado de la colección original y el renombrado
+        de la temporal (ya completa), termina el renombrado.
+        """
+        try:
+            self.client.get_collection(name=self.collection_name)
+            return
+        except Exception:
+            pass
+        try:
+            migrated = self.client.get_collection(name=f"{self.collection_name}{MIGRATION_SUFFIX}")
+        except Exception:
+            return
+        migrated.modify(name=self.collection_name)
+        logger.warning(f"Completado el renombrado de una migración interrumpida de la colección '{self.collection_name}'.")
+
+    def _migrate_to_inner_product(self):
+        """
+        Migración única de colecciones creadas con "hnsw:space": "cosine": copia los documentos,
+        en lotes de como mucho `get_max_batch_size()`, a una colección temporal con producto interno
+        (que vuelve a generar sus embeddings, ya normalizados) y solo cuando la copia está completa
+        borra la original y renombra la temporal. Si la copia falla, se sigue usando la original.
+        """
+        logger.warning(f"Migrando la colección '{self.collection_name}' a producto interno (re-embedding de documentos)...")
+        temp_name = f"{self.collection_name}{MIGRATION_SUFFIX}"
+        try:
+            # Restos de una migración anterior interrumpida antes de completarse.
+            self.client.delete_collection(name=temp_name)
+        except Exception:
+            pass
+        migrated = self.client.create_collection(
+            name=temp_name,
+            embedding_function=self.embedding_function,
+            metadata=COLLECTION_METADATA
+        )
+        try:
+            batch_size = self.client.get_max_batch_size()
+            total = self.collection.count()
+            for offset in range(0, total, batch_size):
+                batch = self.collection.get(include=["documents", "metadatas"], limit=batch_size, offset=offset)
+                if batch['ids']:
+                    migrated.add(ids=batch['ids'], documents=batch['documents'], metadatas=batch['metadatas'])
+        except Exception:
+            # La colección original sigue en uso (con distancia coseno); se reintenta en el próximo arranque.
+            logger.exception(f"Error al migrar la colección '{self.collection_name}'. Se conserva la original.")
+            self.client.delete_collection(name=temp_name)
+            return
+        self.client.delete_collection(name=self.collection_name)
+        migrated.modify(name=self.collection_name)
+        self.collection = migrated
+        logger.info(f"Migración completada: {total} documentos re-indexados.")
+
+    def check_connection(self):
+        if not self.collection:
+            self._initialize()
+        if not self.collection:
+            logger.error("Verificación de ChromaDB: colección no disponible.")
+            return
+        self.client.heartbeat()
+        logger.info("Verificación de ChromaDB: OK.")
+
+    def _get_session_index(self, session_id: str) -> _SessionVectorIndex:
+        """Devuelve el índice FAISS de la sesión, cargándolo desde ChromaDB la primera vez. Requiere `_index_lock`."""
+        session_index = self._session_indexes.get(session_id)
+        if session_index is None:
+            stored = self.collection.get(where={"session_id": session_id}, include=["embeddings", "documents", "metadatas"])
+            session_index = _SessionVectorIndex()
+            if stored['ids']:
+                session_index.add(stored['embeddings'], stored['ids'], stored['documents'], stored['metadatas'])
+            self._session_indexes.set(session_id, session_index)
+        return session_index
 
     def add_entry(self, session_id: str, text_content: str, turn_id: str, metadata: Dict[str, Any], trace_id: str = 'N/A'):
+        """
+        Encola una entrada para su escritura en ChromaDB. Las entradas se vuelcan en lote
+        cuando se acumulan `WRITE_BATCH_SIZE` o pasados `WRITE_FLUSH_INTERVAL` segundos.
+        """
         log_extra = {'trace_id': trace_id, 'data': {'session_id': session_id, 'turn_id': turn_id}}
         if not self.collection:
             logger.warning("No se pudo añadir entrada a ChromaDB: colección no disponible.", extra=log_extra)
             return
 
         metadata['session_id'] = session_id
-        try:
-            self.collection.add(documents=[text_content], metadatas=[metadata], ids=[turn_id])
-            logger.debug("Entrada añadida a la memoria semántica (ChromaDB).", extra=log_extra)
-        except Exception:
-            logger.exception(f"Error al añadir entrada a ChromaDB (ID: {turn_id}).", extra=log_extra)
+        with self._buffer_lock:
+            self._write_buffer.append((turn_id, text_content, metadata))
+            buffer_full = len(self._write_buffer) >= WRITE_BATCH_SIZE
+            if not buffer_full and self._flush_timer is None:
+                self._flush_timer = threading.Timer(WRITE_FLUSH_INTERVAL, self.flush)
+                self._flush_timer.daemon = True
+                self._flush_timer.start()
+        logger.debug("Entrada encolada para la memoria semántica (ChromaDB).", extra=log_extra)
+
+        if buffer_full:
+            self.flush()
+
+    def flush(self):
+        """
+        Escribe en ChromaDB todas las entradas pendientes con una única llamada a `collection.add`.
+
+        Todo el volcado (embeddings, `collection.add` y actualización de los índices FAISS) se hace
+        bajo `_index_lock`, el mismo que toma `_get_session_index`. Así un índice nunca se construye
+        desde ChromaDB con filas a medio volcar (que luego se añadirían otra vez) y una búsqueda
+        concurrente espera a que el lote en curso sea visible en ambos sitios.
+        """
+        with self._index_lock:
+            with self._buffer_lock:
+                if self._flush_timer is not None:
+                    self._flush_timer.cancel()
+                    self._flush_timer = None
+                pending = list(self._write_buffer)
+                self._write_buffer.clear()
+
+            if not pending or not self.collection:
+                return
+
+            ids = [turn_id for turn_id, _, _ in pending]
+            documents = [text for _, text, _ in pending]
+            metadatas = [metadata for _, _, metadata in pending]
+            try:
+                # Los embeddings se calculan en una sola pasada y se comparten entre ChromaDB y FAISS.
+                embeddings = self.embedding_function(documents)
+                self.collection.add(documents=documents, embeddings=embeddings, metadatas=metadatas, ids=ids)
+                # Los índices aún no cargados se construirán desde ChromaDB e incluirán estas entradas.
+                for i, metadata in enumerate(metadatas):
+                    session_index = self._session_indexes.get(metadata['session_id'])
+                    if session_index is not None:
+                        session_index.add(embeddings[i:i + 1], ids[i:i + 1], documents[i:i + 1], metadatas[i:i + 1])
+                logger.debug(f"Lote de {len(ids)} entradas añadido a la memoria semántica (ChromaDB).")
+            except Exception:
+                logger.exception(f"Error al añadir un lote de {len(ids)} entradas a ChromaDB.")
+
+    def _query(self, query_texts: List[str], n_results: int, filter_by_session: str = None) -> Dict[str, Any]:
+        """
+        Búsqueda común a `search_similar` y `search_similar_batch`. Las búsquedas filtradas
+        por sesión se resuelven con el índice FAISS en memoria; el resto, con ChromaDB.
+        """
+        # Volcamos las escrituras pendientes para que las búsquedas vean los últimos turnos.
+        self.flush()
+        if filter_by_session:
+            query_embeddings = self.embedding_function(query_texts)
+            with self._index_lock:
+                return self._get_session_index(filter_by_session).search(query_embeddings, n_results)
+
+        return self.collection.query(query_texts=query_texts, n_results=n_results)
 
     def search_similar(self, query_text: str, n_results: int = 5, filter_by_session: str = None, trace_id: str = 'N/A') -> List[Dict[str, Any]]:
         log_extra = {'trace_id': trace_id, 'data': {'n_results': n_results, 'filter_session': filter_by_session}}
@@ -48,16 +278,7 @@ class ChromaManager:
             return []
 
         try:
-            # CORRECCIÓN: Construir los argumentos de la consulta dinámicamente para evitar
-            # pasar un filtro `where` vacío, lo que causa un ValueError.
-            query_args = {
-                'query_texts': [query_text],
-                'n_results': n_results
-            }
-            if filter_by_session:
-                query_args['where'] = {"session_id": filter_by_session}
-
-            results = self.collection.query(**query_args)
+            results = self._query([query_text], n_results, filter_by_session)
             
             logger.debug(f"Búsqueda en ChromaDB devolvió {len(results.get('documents', [[]])[0])} resultados.", extra=log_extra)
             return results
@@ -65,13 +286,38 @@ class ChromaManager:
             logger.exception(f"Error al buscar en ChromaDB.", extra=log_extra)
             return []
 
+    def search_similar_batch(self, query_texts: List[str], n_results: int = 5, filter_by_session: str = None, trace_id: str = 'N/A') -> Dict[str, Any]:
+        """
+        Ejecuta varias búsquedas semánticas en una sola llamada.
+        Los embeddings de todas las consultas se calculan en una única pasada del modelo,
+        y el resultado contiene una lista de resultados por consulta, en el mismo orden.
+        """
+        log_extra = {'trace_id': trace_id, 'data': {'n_queries': len(query_texts), 'n_results': n_results, 'filter_session': filter_by_session}}
+        if not self.collection:
+            logger.warning("No se pudo buscar en ChromaDB: colección no disponible.", extra=log_extra)
+            return {}
+        if not query_texts:
+            return {}
+
+        try:
+            results = self._query(query_texts, n_results, filter_by_session)
+
+            logger.debug(f"Búsqueda por lotes en ChromaDB completada para {len(query_texts)} consultas.", extra=log_extra)
+            return results
+        except Exception:
+            logger.exception("Error al buscar por lotes en ChromaDB.", extra=log_extra)
+            return {}
+
     def delete_session_entries(self, session_id: str, trace_id: str = 'N/A'):
         log_extra = {'trace_id': trace_id, 'data': {'session_id': session_id}}
         if not self.collection:
             logger.warning("No se pudieron eliminar entradas de ChromaDB: colección no disponible.", extra=log_extra)
             return
+        self.flush()
         try:
             self.collection.delete(where={"session_id": session_id})
+            with self._index_lock:
+                self._session_indexes.pop(session_id, None)
             logger.info(f"Entradas de la sesión {session_id} eliminadas de ChromaDB.", extra=log_extra)
         except Exception:
             logger.exception(f"Error al eliminar entradas de ChromaDB para la sesión {session_id}.", extra=log_extra)
@@ -84,11 +330,15 @@ class ChromaManager:
             return False
         try:
             logger.warning(f"Iniciando reseteo de la base de datos ChromaDB (colección: {self.collection_name})...", extra=log_extra)
+            with self._buffer_lock:
+                self._write_buffer.clear()
             self.client.delete_collection(name=self.collection_name)
+            with self._index_lock:
+                self._session_indexes.clear()
             self.collection = self.client.get_or_create_collection(
                 name=self.collection_name,
                 embedding_function=self.embedding_function,
-                metadata={"hnsw:space": "cosine"}
+                metadata=COLLECTION_METADATA
             )
             logger.info("La base de datos de ChromaDB ha sido reseteada exitosamente.", extra=log_extra)
             return True
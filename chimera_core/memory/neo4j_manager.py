@@ -1,136 +1,243 @@
 # FILE: chimera_core/memory/neo4j_manager.py (SIMPLIFICADO)
 
 import os
-from neo4j import GraphDatabase, basic_auth
+import asyncio
+from datetime import datetime, timezone
+from neo4j import AsyncGraphDatabase, RoutingControl, basic_auth
 from typing import List, Dict, Any
 from ..utils.logger import logger
 
 NEO4J_URI = os.getenv("NEO4J_URI", "bolt://localhost:7687")
 NEO4J_USER = os.getenv("NEO4J_USER", "neo4j")
 NEO4J_PASSWORD = os.getenv("NEO4J_PASSWORD", "password")
+NEO4J_DATABASE = os.getenv("NEO4J_DATABASE", "neo4j")
+NEO4J_MAX_CONNECTION_POOL_SIZE = int(os.getenv("NEO4J_MAX_CONNECTION_POOL_SIZE", 400))
+NEO4J_CONNECTION_ACQUISITION_TIMEOUT = float(os.getenv("NEO4J_CONNECTION_ACQUISITION_TIMEOUT", 60))
+WRITE_BATCH_SIZE = 100 # Mensajes acumulados que fuerzan un volcado inmediato
+WRITE_FLUSH_INTERVAL = 0.05 # Segundos máximos que un mensaje espera en el búfer
+
+# Escritura por lotes: una sola transacción (y un solo viaje de ida y vuelta) por volcado.
+ADD_MESSAGES_QUERY = """
+UNWIND $rows AS r
+MATCH (s:Session {session_id: r.session_id})
+MERGE (m:Message {session_id: r.session_id, turn_id: r.turn_id})
+ON CREATE SET m.role = r.role, m.text = r.text, m.timestamp = datetime(r.ts)
+ON MATCH SET m.role = r.role, m.text = r.text
+MERGE (s)-[:HAS_MESSAGE]->(m)
+WITH m, r
+UNWIND r.entities AS ent
+MERGE (e:Entity {name: ent.text_lc})
+ON CREATE SET e.type = ent.label
+MERGE (m)-[:MENTIONS]->(e)
+"""
+
+# Los nombres de entidad se guardan en minúsculas y los términos de búsqueda se pasan a
+# minúsculas en Python, así que las consultas no aplican funciones sobre las propiedades
+# y pueden apoyarse en los índices.
 
 class Neo4jManager:
+    """
+    Gestor del grafo de conocimiento sobre el driver asíncrono de Neo4j.
+
+    Todas las operaciones son corrutinas que se ejecutan en el bucle de eventos de FastAPI,
+    de modo que la E/S con Neo4j se solapa con las llamadas al LLM y al resto de memorias.
+    """
+
     def __init__(self, uri, user, password):
+        # Búfer de mensajes pendientes de escribir en el grafo. Solo se toca desde el bucle
+        # de eventos, por lo que no necesita cerrojo.
+        self._write_buffer: List[Dict[str, Any]] = []
+        self._flush_handle = None
+        self._flush_tasks = set()
         try:
-            self.driver = GraphDatabase.driver(uri, auth=basic_auth(user, password))
-            self.driver.verify_connectivity()
-            logger.info("Conexión con Neo4j establecida exitosamente.")
-            self._ensure_constraints()
+            # Crear el driver no abre conexiones: la conectividad se verifica en `initialize`.
+            self.driver = AsyncGraphDatabase.driver(
+                uri, auth=basic_auth(user, password),
+                max_connection_pool_size=NEO4J_MAX_CONNECTION_POOL_SIZE,
+                connection_acquisition_timeout=NEO4J_CONNECTION_ACQUISITION_TIMEOUT
+            )
         except Exception:
-            logger.exception("Error fatal al conectar con Neo4j.")
+            logger.exception("Error fatal al crear el driver de Neo4j.")
             self.driver = None
             raise
-    
-    def check_connection(self):
+
+    async def initialize(self):
+        """Verifica la conexión y asegura las restricciones del esquema. Se llama al arrancar el servidor."""
+        await self.check_connection()
+        logger.info("Conexión con Neo4j establecida exitosamente.")
+        await self._ensure_constraints()
+
+    async def check_connection(self):
         if not self.driver:
             raise ConnectionError("El driver de Neo4j no está inicializado.")
-        self.driver.verify_connectivity()
+        await self.driver.verify_connectivity()
         logger.info("Verificación de Neo4j: OK.")
 
-    def close(self):
+    async def close(self):
+        await self.flush()
         if self.driver:
-            self.driver.close()
+            await self.driver.close()
             logger.info("Conexión con Neo4j cerrada.")
 
-    def _ensure_constraints(self):
-        if not self.driver: 
+    async def _ensure_constraints(self):
+        if not self.driver:
             return
         try:
-            with self.driver.session() as session:
-                session.run("CREATE CONSTRAINT IF NOT EXISTS FOR (s:Session) REQUIRE s.session_id IS UNIQUE")
-                session.run("CREATE CONSTRAINT IF NOT EXISTS FOR (m:Message) REQUIRE (m.session_id, m.turn_id) IS UNIQUE")
-                session.run("CREATE CONSTRAINT IF NOT EXISTS FOR (e:Entity) REQUIRE e.name IS UNIQUE")
-            logger.info("Restricciones de unicidad en Neo4j verificadas/creadas.")
+            for statement in (
+                "CREATE CONSTRAINT IF NOT EXISTS FOR (s:Session) REQUIRE s.session_id IS UNIQUE",
+                "CREATE CONSTRAINT IF NOT EXISTS FOR (m:Message) REQUIRE (m.session_id, m.turn_id) IS UNIQUE",
+                "CREATE CONSTRAINT IF NOT EXISTS FOR (e:Entity) REQUIRE e.name IS UNIQUE",
+                # Índice de texto para las búsquedas `CONTAINS` sobre el nombre de las entidades.
+                "CREATE TEXT INDEX entity_name_text IF NOT EXISTS FOR (e:Entity) ON (e.name)",
+                "CREATE INDEX msg_session IF NOT EXISTS FOR (m:Message) ON (m.session_id)",
+            ):
+                await self.driver.execute_query(statement, database_=NEO4J_DATABASE, routing_=RoutingControl.WRITE)
+            logger.info("Restricciones de unicidad e índices en Neo4j verificados/creados.")
         except Exception:
             logger.exception("Error al asegurar las restricciones en Neo4j.")
 
-    def add_message_and_entities(self, session_id: str, turn_id: str, role: str, text: str, entities: List[Dict[str, str]], trace_id: str = 'N/A'):
-        log_extra = {'trace_id': trace_id, 'data': {'session_id': session_id, 'turn_id': turn_id}}
+    async def add_message_and_entities(self, session_id: str, turn_id: str, role: str, text: str, entities: List[Dict[str, str]], trace_id: str = 'N/A'):
+        """Encola un mensaje y sus entidades; se escriben en el siguiente volcado por lotes."""
+        await self.add_messages_batch([{
+            "session_id": session_id, "turn_id": turn_id, "role": role, "text": text,
+            "entities": [{"text_lc": entity["text"].lower(), "label": entity["label"]} for entity in entities or []],
+            "ts": datetime.now(timezone.utc).isoformat()
+        }], trace_id)
+
+    async def add_messages_batch(self, records: List[Dict[str, Any]], trace_id: str = 'N/A'):
+        """
+        Encola varios mensajes ({session_id, turn_id, role, text, entities, ts}) para su escritura.
+        Cada entidad es un diccionario {text_lc, label} con el nombre ya en minúsculas.
+        Se vuelcan con una única consulta UNWIND al acumular `WRITE_BATCH_SIZE` o pasados
+        `WRITE_FLUSH_INTERVAL` segundos.
+        """
+        log_extra = {'trace_id': trace_id, 'data': {'num_messages': len(records)}}
         if not self.driver:
             logger.warning("No se pudo añadir mensaje a Neo4j: driver no disponible.", extra=log_extra)
             return
+
+        self._write_buffer.extend(records)
+        logger.debug("Mensajes encolados para el grafo (Neo4j).", extra=log_extra)
+        if len(self._write_buffer) >= WRITE_BATCH_SIZE:
+            await self.flush()
+        elif self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_later(WRITE_FLUSH_INTERVAL, self._schedule_flush)
+
+    def _schedule_flush(self):
+        """Callback del temporizador: lanza el volcado como tarea del bucle de eventos."""
+        self._flush_handle = None
+        task = asyncio.ensure_future(self.flush())
+        # Guardamos una referencia para que la tarea no sea recolectada antes de terminar.
+        self._flush_tasks.add(task)
+        task.add_done_callback(self._flush_tasks.discard)
+
+    async def flush(self):
+        """Escribe en Neo4j todos los mensajes pendientes en una única transacción."""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        pending, self._write_buffer = self._write_buffer, []
+
+        if not pending or not self.driver:
+            return
+
         try:
-            with self.driver.session() as session:
-                session.execute_write(self._create_message_and_link_entities, session_id, turn_id, role, text, entities)
+            await self.driver.execute_query(ADD_MESSAGES_QUERY, rows=pending, database_=NEO4J_DATABASE, routing_=RoutingControl.WRITE)
+            logger.debug(f"Lote de {len(pending)} mensajes añadido al grafo (Neo4j).")
         except Exception:
-            logger.exception("Error al añadir mensaje y entidades a Neo4j.", extra=log_extra)
+            logger.exception(f"Error al añadir un lote de {len(pending)} mensajes y entidades a Neo4j.")
 
-    @staticmethod
-    def _create_message_and_link_entities(tx, session_id, turn_id, role, text, entities):
-        tx.run(
-            """
-            MATCH (s:Session {session_id: $session_id})
-            MERGE (m:Message {session_id: $session_id, turn_id: $turn_id})
-            ON CREATE SET m.role = $role, m.text = $text, m.timestamp = datetime()
-            ON MATCH SET m.role = $role, m.text = $text
-            MERGE (s)-[:HAS_MESSAGE]->(m)
-            """,
-            session_id=session_id, turn_id=turn_id, role=role, text=text
-        )
-        if entities:
-            tx.run(
-                """
-                MATCH (m:Message {session_id: $session_id, turn_id: $turn_id})
-                UNWIND $entities AS ent
-                MERGE (e:Entity {name: toLower(ent.text)})
-                ON CREATE SET e.type = ent.label
-                MERGE (m)-[:MENTIONS]->(e)
-                """,
-                session_id=session_id, turn_id=turn_id, entities=entities
-            )
-
-    def get_related_entities(self, entity_name: str, session_id: str, limit: int = 10, trace_id: str = 'N/A') -> List[str]:
+    async def get_related_entities(self, entity_name: str, session_id: str, limit: int = 10, trace_id: str = 'N/A') -> List[str]:
         log_extra = {'trace_id': trace_id, 'data': {'session_id': session_id, 'entity_name': entity_name}}
         if not self.driver:
             logger.warning("No se pudieron obtener entidades relacionadas de Neo4j.", extra=log_extra)
             return []
+        # Volcamos los mensajes pendientes para que la operación vea los últimos turnos.
+        await self.flush()
         try:
-            with self.driver.session() as session:
-                query = """
-                MATCH (s:Session {session_id: $session_id})-[:HAS_MESSAGE]->(m:Message)-[:MENTIONS]->(target_entity:Entity)
-                WHERE toLower(target_entity.name) CONTAINS toLower($name)
-                WITH m, target_entity
-                MATCH (m)-[:MENTIONS]->(related_entity:Entity)
-                WHERE related_entity <> target_entity
-                RETURN related_entity.name AS related_entity, COUNT(related_entity) AS frequency
-                ORDER BY frequency DESC
-                LIMIT $limit
-                """
-                result = session.run(query, session_id=session_id, name=entity_name, limit=limit)
-                related = [record["related_entity"] for record in result]
-                logger.debug(f"Búsqueda de entidades co-mencionadas en Neo4j devolvió {len(related)} resultados.", extra=log_extra)
-                return related
+            query = """
+            MATCH (s:Session {session_id: $session_id})-[:HAS_MESSAGE]->(m:Message)-[:MENTIONS]->(target_entity:Entity)
+            WHERE target_entity.name CONTAINS $name
+            WITH m, target_entity
+            MATCH (m)-[:MENTIONS]->(related_entity:Entity)
+            WHERE related_entity <> target_entity
+            RETURN related_entity.name AS related_entity, COUNT(related_entity) AS frequency
+            ORDER BY frequency DESC
+            LIMIT $limit
+            """
+            records, _, _ = await self.driver.execute_query(
+                query, session_id=session_id, name=entity_name.lower(), limit=limit,
+                database_=NEO4J_DATABASE, routing_=RoutingControl.READ
+            )
+            related = [record["related_entity"] for record in records]
+            logger.debug(f"Búsqueda de entidades co-mencionadas en Neo4j devolvió {len(related)} resultados.", extra=log_extra)
+            return related
         except Exception:
             logger.exception("Error al obtener entidades relacionadas de Neo4j.", extra=log_extra)
             return []
 
-    def delete_session_graph(self, session_id: str, trace_id: str = 'N/A'):
+    async def get_related_entities_batch(self, entity_names: List[str], session_id: str, limit: int = 10, trace_id: str = 'N/A') -> Dict[str, List[str]]:
+        """
+        Versión por lotes de `get_related_entities`: resuelve todas las entidades con una única
+        consulta Cypher (UNWIND) y devuelve un diccionario entidad -> entidades co-mencionadas.
+        """
+        log_extra = {'trace_id': trace_id, 'data': {'session_id': session_id, 'entity_names': entity_names}}
+        if not self.driver:
+            logger.warning("No se pudieron obtener entidades relacionadas de Neo4j.", extra=log_extra)
+            return {}
+        if not entity_names:
+            return {}
+        # Volcamos los mensajes pendientes para que la operación vea los últimos turnos.
+        await self.flush()
+        try:
+            query = """
+            UNWIND $names AS entry
+            WITH entry.name AS name, entry.name_lc AS name_lc
+            MATCH (s:Session {session_id: $session_id})-[:HAS_MESSAGE]->(m:Message)-[:MENTIONS]->(target_entity:Entity)
+            WHERE target_entity.name CONTAINS name_lc
+            WITH name, m, target_entity
+            MATCH (m)-[:MENTIONS]->(related_entity:Entity)
+            WHERE related_entity <> target_entity
+            WITH name, related_entity.name AS related_entity, COUNT(*) AS frequency
+            ORDER BY frequency DESC
+            RETURN name, collect(related_entity)[..$limit] AS related_entities
+            """
+            records, _, _ = await self.driver.execute_query(
+                query, session_id=session_id, names=[{"name": name, "name_lc": name.lower()} for name in entity_names], limit=limit,
+                database_=NEO4J_DATABASE, routing_=RoutingControl.READ
+            )
+            related_by_name = {record["name"]: record["related_entities"] for record in records}
+            related = {name: related_by_name.get(name, []) for name in entity_names}
+            logger.debug(f"Búsqueda por lotes de entidades co-mencionadas en Neo4j completada para {len(entity_names)} entidades.", extra=log_extra)
+            return related
+        except Exception:
+            logger.exception("Error al obtener entidades relacionadas de Neo4j.", extra=log_extra)
+            return {}
+
+    async def delete_session_graph(self, session_id: str, trace_id: str = 'N/A'):
         log_extra = {'trace_id': trace_id, 'data': {'session_id': session_id}}
         if not self.driver:
             logger.warning("No se pudo eliminar el grafo de sesión de Neo4j.", extra=log_extra)
             return
+        # Volcamos los mensajes pendientes para que la operación vea los últimos turnos.
+        await self.flush()
         try:
-            with self.driver.session() as session:
-                session.execute_write(self._delete_session_graph_tx, session_id)
+            await self.driver.execute_query(
+                "MATCH (s:Session {session_id: $session_id}) "
+                "OPTIONAL MATCH (s)-[:HAS_MESSAGE]->(m:Message) "
+                "DETACH DELETE s, m",
+                session_id=session_id, database_=NEO4J_DATABASE, routing_=RoutingControl.WRITE
+            )
             logger.info(f"Subgrafo de la sesión {session_id} eliminado de Neo4j.", extra=log_extra)
         except Exception:
             logger.exception(f"Error al eliminar el grafo de la sesión {session_id} de Neo4j.", extra=log_extra)
 
-    @staticmethod
-    def _delete_session_graph_tx(tx, session_id):
-        tx.run(
-            "MATCH (s:Session {session_id: $session_id}) "
-            "OPTIONAL MATCH (s)-[:HAS_MESSAGE]->(m:Message) "
-            "DETACH DELETE s, m",
-            session_id=session_id
-        )
-
-    def create_session_in_graph(self, session_id: str, session_name: str):
+    async def create_session_in_graph(self, session_id: str, session_name: str):
         if not self.driver:
             return
-        with self.driver.session() as session:
-            session.run(
-                "MERGE (s:Session {session_id: $session_id}) "
-                "ON CREATE SET s.name = $session_name",
-                session_id=session_id, session_name=session_name
-            )
\ No newline at end of file
+        await self.driver.execute_query(
+            "MERGE (s:Session {session_id: $session_id}) "
+            "ON CREATE SET s.name = $session_name",
+            session_id=session_id, session_name=session_name,
+            database_=NEO4J_DATABASE, routing_=RoutingControl.WRITE
+        )
@@ -1,13 +1,35 @@
 
+import os
 import redis
-import json
-from typing import List, Dict, Any
+import orjson
+import threading
+from typing import List, Dict, Any, Optional, Tuple
 from ..utils.logger import logger
 
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", 64))
+TURN_FIELD = b"d" # Campo de cada entrada del stream que contiene el turno serializado
+
+# Pools de conexiones compartidos por todo el proceso, uno por destino (host, puerto, db).
+# Con `hiredis` instalado, redis-py usa automáticamente su parser en C. Las respuestas no se
+# decodifican: los turnos se guardan como JSON y se parsean directamente desde bytes con orjson.
+_connection_pools: Dict[Tuple[str, int, int], redis.ConnectionPool] = {}
+_connection_pools_lock = threading.Lock()
+
+def _get_connection_pool(host: str, port: int, db: int) -> redis.ConnectionPool:
+    with _connection_pools_lock:
+        pool = _connection_pools.get((host, port, db))
+        if pool is None:
+            pool = redis.ConnectionPool(
+                host=host, port=port, db=db, max_connections=REDIS_MAX_CONNECTIONS,
+                socket_keepalive=True
+            )
+            _connection_pools[(host, port, db)] = pool
+        return pool
+
 class RedisManager:
     def __init__(self, host: str = 'localhost', port: int = 6379, db: int = 0):
         try:
-            self.client = redis.Redis(host=host, port=port, db=db, decode_responses=True)
+            self.client = redis.Redis(connection_pool=_get_connection_pool(host, port, db))
         except redis.exceptions.ConnectionError as e:
             logger.exception("Error fatal al conectar con Redis. La memoria a corto plazo no estará disponible.")
             self.client = None
@@ -18,10 +40,33 @@ class RedisManager:
             raise ConnectionError("El cliente de Redis no está inicializado.")
         self.client.ping()
         logger.info("Verificación de Redis: OK.")
+        self._migrate_list_histories()
+
+    def _migrate_list_histories(self):
+        """
+        Convierte a streams los historiales guardados con el formato anterior (listas), para que
+        las sesiones existentes conserven su memoria a corto plazo.
+        """
+        try:
+            for key in self.client.scan_iter(match=self._get_session_key("*"), _type="list"):
+                raw_turns = self.client.lrange(key, 0, -1)
+                with self.client.pipeline(transaction=True) as pipe:
+                    pipe.delete(key)
+                    for raw_turn in raw_turns:
+                        pipe.xadd(key, {TURN_FIELD: raw_turn})
+                    pipe.execute()
+                logger.info(f"Historial {key.decode()} migrado de lista a stream ({len(raw_turns)} turnos).")
+        except redis.exceptions.RedisError:
+            logger.exception("Error de Redis al migrar los historiales a streams.")
         
     def _get_session_key(self, session_id: str) -> str:
         return f"session:{session_id}:short_term_memory"
 
+    @staticmethod
+    def _decode_turns(entries) -> List[Dict[str, Any]]:
+        """Deserializa las entradas (id, campos) de un stream en orden cronológico."""
+        return [orjson.loads(fields[TURN_FIELD]) for _, fields in entries]
+
     def add_turn(self, session_id: str, turn_data: Dict[str, Any], trace_id: str = 'N/A'):
         log_extra = {'trace_id': trace_id, 'data': {'session_id': session_id, 'turn_role': turn_data.get('role')}}
         if not self.client:
@@ -30,11 +75,33 @@ class RedisManager:
         
         session_key = self._get_session_key(session_id)
         try:
-            self.client.rpush(session_key, json.dumps(turn_data))
+            self.client.xadd(session_key, {TURN_FIELD: orjson.dumps(turn_data)})
             logger.debug("Turno añadido a la memoria a corto plazo (Redis).", extra=log_extra)
         except redis.exceptions.RedisError:
             logger.exception(f"Error de Redis al añadir turno para la sesión {session_id}.", extra=log_extra)
 
+    def add_turns(self, session_id: str, turns: List[Dict[str, Any]], max_len: int = None, trace_id: str = 'N/A'):
+        """
+        Añade varios turnos en un único viaje de ida y vuelta a Redis mediante un pipeline.
+        Con `max_len`, el propio XADD acota el stream de forma aproximada (`MAXLEN ~`).
+        """
+        log_extra = {'trace_id': trace_id, 'data': {'session_id': session_id, 'num_turns': len(turns), 'max_len': max_len}}
+        if not self.client:
+            logger.warning("No se pudieron añadir turnos a Redis: cliente no disponible.", extra=log_extra)
+            return
+        if not turns:
+            return
+
+        session_key = self._get_session_key(session_id)
+        try:
+            with self.client.pipeline(transaction=False) as pipe:
+                for turn in turns:
+                    pipe.xadd(session_key, {TURN_FIELD: orjson.dumps(turn)}, maxlen=max_len or None, approximate=True)
+                pipe.execute()
+            logger.debug(f"{len(turns)} turnos añadidos a la memoria a corto plazo (Redis).", extra=log_extra)
+        except redis.exceptions.RedisError:
+            logger.exception(f"Error de Redis al añadir turnos para la sesión {session_id}.", extra=log_extra)
+
     def get_recent_turns(self, session_id: str, num_turns: int = 20, trace_id: str = 'N/A') -> List[Dict[str, Any]]:
         log_extra = {'trace_id': trace_id, 'data': {'session_id': session_id, 'num_turns': num_turns}}
         if not self.client:
@@ -43,14 +110,67 @@ class RedisManager:
         
         session_key = self._get_session_key(session_id)
         try:
-            raw_turns = self.client.lrange(session_key, -num_turns, -1)
-            deserialized_turns = [json.loads(turn) for turn in raw_turns]
+            if num_turns > 0:
+                entries = self.client.xrevrange(session_key, count=num_turns)[::-1]
+            else:
+                # num_turns=0 devuelve el historial completo
+                entries = self.client.xrange(session_key)
+            deserialized_turns = self._decode_turns(entries)
             logger.debug(f"Recuperados {len(deserialized_turns)} turnos de Redis.", extra=log_extra)
             return deserialized_turns
         except redis.exceptions.RedisError:
             logger.exception(f"Error de Redis al recuperar turnos para la sesión {session_id}.", extra=log_extra)
             return []
 
+    def get_recent_turns_many(self, session_ids: List[str], num_turns: int = 20, trace_id: str = 'N/A') -> Dict[str, List[Dict[str, Any]]]:
+        """
+        Versión por lotes de `get_recent_turns`: encola un XREVRANGE por sesión en un pipeline y
+        devuelve un diccionario sesión -> turnos con un único viaje de ida y vuelta a Redis.
+        """
+        log_extra = {'trace_id': trace_id, 'data': {'num_sessions': len(session_ids), 'num_turns': num_turns}}
+        if not self.client:
+            logger.warning("No se pudieron recuperar turnos de Redis: cliente no disponible.", extra=log_extra)
+            return {}
+        if not session_ids:
+            return {}
+
+        try:
+            with self.client.pipeline(transaction=False) as pipe:
+                for session_id in session_ids:
+                    if num_turns > 0:
+                        pipe.xrevrange(self._get_session_key(session_id), count=num_turns)
+                    else:
+                        pipe.xrange(self._get_session_key(session_id))
+                results = pipe.execute()
+            turns_by_session = {
+                session_id: self._decode_turns(entries[::-1] if num_turns > 0 else entries)
+                for session_id, entries in zip(session_ids, results)
+            }
+            logger.debug(f"Recuperados los turnos de {len(turns_by_session)} sesiones de Redis.", extra=log_extra)
+            return turns_by_session
+        except redis.exceptions.RedisError:
+            logger.exception("Error de Redis al recuperar turnos de varias sesiones.", extra=log_extra)
+            return {}
+
+    def get_stream_state(self, session_id: str, trace_id: str = 'N/A') -> Tuple[int, Optional[bytes]]:
+        """
+        Devuelve (número de turnos, id de la última entrada añadida) del stream de la sesión con un
+        solo XINFO STREAM. El id cambia con cada turno guardado, aunque `MAXLEN ~` mantenga el tamaño.
+        """
+        log_extra = {'trace_id': trace_id, 'data': {'session_id': session_id}}
+        if not self.client:
+            logger.warning("No se pudo consultar el stream de Redis: cliente no disponible.", extra=log_extra)
+            return 0, None
+        try:
+            info = self.client.xinfo_stream(self._get_session_key(session_id))
+            return info["length"], info["last-generated-id"]
+        except redis.exceptions.ResponseError:
+            # La sesión todavía no tiene stream.
+            return 0, None
+        except redis.exceptions.RedisError:
+            logger.exception(f"Error de Redis al consultar el stream de la sesión {session_id}.", extra=log_extra)
+            return 0, None
+
     def delete_session_history(self, session_id: str, trace_id: str = 'N/A'):
         log_extra = {'trace_id': trace_id, 'data': {'session_id': session_id}}
         if not self.client:
@@ -72,7 +192,8 @@ class RedisManager:
         
         session_key = self._get_session_key(session_id)
         try:
-            self.client.ltrim(session_key, -max_len, -1)
+            # Poda exacta: el resumen rodante cuenta con conservar exactamente los últimos `max_len` turnos.
+            self.client.xtrim(session_key, maxlen=max_len, approximate=False)
             logger.debug(f"Historial de la sesión {session_id} podado para conservar los últimos {max_len} turnos.", extra=log_extra)
         except redis.exceptions.RedisError:
             logger.exception(f"Error de Redis al podar el historial de la sesión {session_id}.", extra=log_extra)
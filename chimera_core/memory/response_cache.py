@@ -0,0 +1,103 @@
+import os
+import redis
+import orjson
+import numpy as np
+from typing import List, Dict, Any, Optional
+from ..utils.cache import hash_text
+from ..utils.logger import logger
+
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() == "true"
+RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", 3600)) # Segundos que vive cada ámbito de la caché
+RESPONSE_CACHE_SIMILARITY = float(os.getenv("RESPONSE_CACHE_SIMILARITY", 0.97)) # Similitud coseno mínima para un acierto
+RESPONSE_CACHE_MAX_ENTRIES = 256 # Respuestas máximas guardadas por ámbito
+
+class ResponseCache:
+    """
+    Caché semántica de respuestas del LLM sobre Redis.
+
+    Cada entrada pertenece a un "ámbito": el hash del modelo y de todos los mensajes que
+    preceden al prompt del usuario (prompt de sistema, contexto dinámico e historial). Así
+    solo se reutiliza una respuesta cuando el LLM habría visto exactamente el mismo contexto.
+
+    Dentro de un ámbito se busca primero por coincidencia exacta del prompt (HGET, O(1)) y,
+    si no la hay, por similitud coseno entre embeddings normalizados (MiniLM).
+    """
+
+    def __init__(self, redis_client: Optional[redis.Redis], embedding_function=None):
+        self.client = redis_client
+        self.embedding_function = embedding_function
+
+    @property
+    def enabled(self) -> bool:
+        return RESPONSE_CACHE_ENABLED and self.client is not None
+
+    @staticmethod
+    def make_scope(model_name: str, messages: List[Dict[str, Any]]) -> str:
+        """Calcula el ámbito de la caché a partir del modelo y los mensajes previos al prompt."""
+        return hash_text(orjson.dumps([model_name, messages]).decode())
+
+    @staticmethod
+    def _get_scope_key(scope: str) -> str:
+        return f"response_cache:{scope}"
+
+    @staticmethod
+    def _get_prompt_field(user_prompt: str) -> str:
+        return hash_text(" ".join(user_prompt.split()).lower())
+
+    def _embed(self, text: str) -> np.ndarray:
+        return np.asarray(self.embedding_function([text])[0], dtype=np.float32)
+
+    def lookup(self, scope: str, user_prompt: str, trace_id: str = 'N/A') -> Optional[str]:
+        """Devuelve la respuesta cacheada para el prompt en este ámbito, o None si no hay acierto."""
+        log_extra = {'trace_id': trace_id, 'data': {'scope': scope}}
+        if not self.enabled:
+            return None
+
+        scope_key = self._get_scope_key(scope)
+        try:
+            raw_entry = self.client.hget(scope_key, self._get_prompt_field(user_prompt))
+            if raw_entry is not None:
+                logger.info("Acierto exacto en la caché de respuestas.", extra=log_extra)
+                return orjson.loads(raw_entry)["response"]
+
+            if self.embedding_function is None:
+                return None
+            entries = [entry for entry in map(orjson.loads, self.client.hvals(scope_key)) if "embedding" in entry]
+            if not entries:
+                return None
+
+            similarities = np.asarray([entry["embedding"] for entry in entries], dtype=np.float32) @ self._embed(user_prompt)
+            best = int(np.argmax(similarities))
+            if similarities[best] >= RESPONSE_CACHE_SIMILARITY:
+                logger.info(f"Acierto semántico en la caché de respuestas (similitud {similarities[best]:.3f}).", extra=log_extra)
+                return entries[best]["response"]
+            return None
+        except redis.exceptions.RedisError:
+            logger.exception("Error de Redis al consultar la caché de respuestas.", extra=log_extra)
+            return None
+        except Exception:
+            logger.exception("Error al calcular la similitud en la caché de respuestas.", extra=log_extra)
+            return None
+
+    def store(self, scope: str, user_prompt: str, response: str, trace_id: str = 'N/A'):
+        """Guarda la respuesta del LLM para el prompt en este ámbito."""
+        log_extra = {'trace_id': trace_id, 'data': {'scope': scope}}
+        if not self.enabled:
+            return
+
+        scope_key = self._get_scope_key(scope)
+        try:
+            if self.client.hlen(scope_key) >= RESPONSE_CACHE_MAX_ENTRIES:
+                return
+            entry = {"response": response}
+            if self.embedding_function is not None:
+                entry["embedding"] = self._embed(user_prompt).tolist()
+            with self.client.pipeline(transaction=False) as pipe:
+                pipe.hset(scope_key, self._get_prompt_field(user_prompt), orjson.dumps(entry))
+                pipe.expire(scope_key, RESPONSE_CACHE_TTL)
+                pipe.execute()
+            logger.debug("Respuesta guardada en la caché de respuestas.", extra=log_extra)
+        except redis.exceptions.RedisError:
+            logger.exception("Error de Redis al guardar en la caché de respuestas.", extra=log_extra)
+        except Exception:
+            logger.exception("Error al calcular el embedding para la caché de respuestas.", extra=log_extra)
@@ -1,98 +1,174 @@
 import sqlite3
 import os
+import atexit
+import queue
+import threading
+from contextlib import contextmanager
 from typing import List, Dict, Optional, Tuple
 from ..utils.logger import logger
 
 DB_FILE = os.path.join(os.path.dirname(__file__), '..', '..', 'chimera_memory.db')
+READ_POOL_SIZE = 4 # Conexiones de solo lectura disponibles para peticiones concurrentes
+# En modo WAL, synchronous=NORMAL solo sincroniza en disco en los checkpoints: ante un corte
+# de luz se puede perder la última transacción confirmada, pero la base de datos nunca se corrompe.
+CONNECTION_PRAGMAS = (
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",   # ms que una conexión espera a un cerrojo antes de fallar
+    "PRAGMA mmap_size=268435456", # 256 MB
+    "PRAGMA cache_size=-65536",   # 64 MB
+    "PRAGMA temp_store=MEMORY"
+)
+STATEMENT_CACHE_SIZE = 256 # Sentencias compiladas que cada conexión mantiene en caché
+
+# Sentencias SQL de uso frecuente. Al ser constantes, cada conexión las compila una sola vez
+# y reutiliza el programa preparado de su caché de sentencias.
+# UPSERT en lugar de REPLACE INTO: actualiza la fila existente en su sitio en vez de borrarla e
+# insertarla de nuevo, y mantiene `last_updated` como fecha de la última actualización.
+_SQL_UPDATE_SUMMARY = """
+    INSERT INTO sessions (session_id, summary, turn_count, last_updated)
+    VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+    ON CONFLICT(session_id) DO UPDATE SET
+        summary = excluded.summary,
+        turn_count = excluded.turn_count,
+        last_updated = CURRENT_TIMESTAMP
+"""
+_SQL_GET_SUMMARY = "SELECT summary, turn_count FROM sessions WHERE session_id = ?"
+_SQL_CREATE_SESSION = "INSERT INTO session_info (session_id, session_name) VALUES (?, ?)"
+_SQL_GET_ALL_SESSIONS = "SELECT session_id, session_name, created_at FROM session_info ORDER BY created_at DESC"
+_SQL_DELETE_SESSION_INFO = "DELETE FROM session_info WHERE session_id = ?"
+_SQL_DELETE_SESSION_SUMMARY = "DELETE FROM sessions WHERE session_id = ?"
 
 class SQLiteManager:
     """
     Gestiona la base de datos SQLite para la memoria a medio plazo ("El Cronista").
+
+    Mantiene una conexión de escritura y un pequeño pool de conexiones de lectura sobre una
+    base de datos en modo WAL, de forma que las lecturas concurrentes no se bloquean entre sí
+    ni esperan al escritor.
     """
 
     def __init__(self, db_path: str = DB_FILE):
         self.db_path = db_path
-        self.conn = None
+        self._write_conn: Optional[sqlite3.Connection] = None
+        self._write_lock = threading.Lock()
+        self._read_pool: "queue.Queue[sqlite3.Connection]" = queue.Queue()
+        try:
+            self._open_connections()
+        except sqlite3.Error:
+            logger.exception("Error al abrir las conexiones con la base de datos SQLite.")
+        atexit.register(self.close)
+
+    def close(self):
+        """Cierra la conexión de escritura y las del pool de lectura."""
+        with self._write_lock:
+            if self._write_conn is not None:
+                self._write_conn.close()
+                self._write_conn = None
+        while True:
+            try:
+                self._read_pool.get_nowait().close()
+            except queue.Empty:
+                break
 
     def check_connection(self):
         try:
+            if self._write_conn is None:
+                self._open_connections()
             self._create_table()
             logger.info(f"Conexión con SQLite establecida y tablas verificadas en: {self.db_path}")
         except sqlite3.Error:
             logger.exception("Error fatal al inicializar o crear tablas en SQLite.")
 
     def _get_connection(self) -> sqlite3.Connection:
-        """Establece y devuelve una conexión a la base de datos."""
+        """Establece y devuelve una nueva conexión configurada para la base de datos."""
         try:
-            conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            conn = sqlite3.connect(self.db_path, check_same_thread=False, cached_statements=STATEMENT_CACHE_SIZE)
+            for pragma in CONNECTION_PRAGMAS:
+                conn.execute(pragma)
             return conn
         except sqlite3.Error as e:
             logger.error(f"Error al conectar con la base de datos SQLite: {e}")
             raise
 
+    def _open_connections(self):
+        """Abre la conexión de escritura (activando WAL) y el pool de conexiones de lectura."""
+        write_conn = self._get_connection()
+        write_conn.execute("PRAGMA journal_mode=WAL")
+        self._write_conn = write_conn
+        for _ in range(READ_POOL_SIZE):
+            read_conn = self._get_connection()
+            read_conn.execute("PRAGMA query_only=ON")
+            self._read_pool.put(read_conn)
+
+    @contextmanager
+    def _writer(self):
+        """Presta la conexión de escritura en exclusiva."""
+        if self._write_conn is None:
+            raise sqlite3.OperationalError("La conexión de escritura de SQLite no está disponible.")
+        with self._write_lock:
+            yield self._write_conn
+
+    @contextmanager
+    def _reader(self):
+        """Presta una conexión de lectura del pool y la devuelve al terminar."""
+        if self._write_conn is None:
+            raise sqlite3.OperationalError("Las conexiones de lectura de SQLite no están disponibles.")
+        conn = self._read_pool.get()
+        try:
+            yield conn
+        finally:
+            self._read_pool.put(conn)
+
     def _create_table(self):
         """
         Crea las tablas `sessions` y `session_info` si no existen.
         """
-        conn = self._get_connection()
-        try:
-            with conn:
-                # Tabla para resúmenes (memoria a medio plazo)
-                conn.execute("""
-                    CREATE TABLE IF NOT EXISTS sessions (
-                        session_id TEXT PRIMARY KEY,
-                        summary TEXT NOT NULL,
-                        turn_count INTEGER NOT NULL,
-                        last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                    )
-                """)
-                # Tabla para información de la sesión
-                conn.execute("""
-                    CREATE TABLE IF NOT EXISTS session_info (
-                        session_id TEXT PRIMARY KEY,
-                        session_name TEXT NOT NULL,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                    )
-                """)
-        finally:
-            conn.close()
+        with self._writer() as conn, conn:
+            # Tabla para resúmenes (memoria a medio plazo)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS sessions (
+                    session_id TEXT PRIMARY KEY,
+                    summary TEXT NOT NULL,
+                    turn_count INTEGER NOT NULL,
+                    last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            # Tabla para información de la sesión
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS session_info (
+                    session_id TEXT PRIMARY KEY,
+                    session_name TEXT NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
 
     def update_summary(self, session_id: str, summary: str, turn_count: int, trace_id: str = 'N/A'):
         log_extra = {'trace_id': trace_id, 'data': {'session_id': session_id, 'turn_count': turn_count}}
-        conn = self._get_connection()
         try:
-            with conn:
-                conn.execute("""
-                    REPLACE INTO sessions (session_id, summary, turn_count)
-                    VALUES (?, ?, ?)
-                """, (session_id, summary, turn_count))
+            with self._writer() as conn, conn:
+                conn.execute(_SQL_UPDATE_SUMMARY, (session_id, summary, turn_count))
             logger.debug("Resumen de sesión actualizado en SQLite.", extra=log_extra)
         except sqlite3.Error:
             logger.exception("Error al actualizar resumen en SQLite.", extra=log_extra)
-        finally:
-            conn.close()
 
     def get_summary(self, session_id: str, trace_id: str = 'N/A') -> Optional[Tuple[str, int]]:
         log_extra = {'trace_id': trace_id, 'data': {'session_id': session_id}}
-        conn = self._get_connection()
         try:
-            cursor = conn.cursor()
-            cursor.execute("SELECT summary, turn_count FROM sessions WHERE session_id = ?", (session_id,))
-            result = cursor.fetchone()
+            with self._reader() as conn:
+                cursor = conn.cursor()
+                cursor.execute(_SQL_GET_SUMMARY, (session_id,))
+                result = cursor.fetchone()
             logger.debug(f"Búsqueda de resumen en SQLite devolvió {'un resultado' if result else 'ningún resultado'}.", extra=log_extra)
             return result
         except sqlite3.Error:
             logger.exception("Error al recuperar resumen de SQLite.", extra=log_extra)
             return None
-        finally:
-            conn.close()
 
     def create_session(self, session_id: str, session_name: str, trace_id: str = 'N/A') -> bool:
         log_extra = {'trace_id': trace_id, 'data': {'session_id': session_id, 'session_name': session_name}}
-        conn = self._get_connection()
         try:
-            with conn:
-                conn.execute("INSERT INTO session_info (session_id, session_name) VALUES (?, ?)", (session_id, session_name))
+            with self._writer() as conn, conn:
+                conn.execute(_SQL_CREATE_SESSION, (session_id, session_name))
             logger.info(f"Nueva sesión '{session_name}' creada en SQLite.", extra=log_extra)
             return True
         except sqlite3.IntegrityError:
@@ -101,37 +177,30 @@ class SQLiteManager:
         except sqlite3.Error:
             logger.exception("Error al crear sesión en SQLite.", extra=log_extra)
             return False
-        finally:
-            conn.close()
 
     def get_all_sessions(self, trace_id: str = 'N/A') -> List[Dict[str, str]]:
         log_extra = {'trace_id': trace_id}
-        conn = self._get_connection()
         try:
-            conn.row_factory = sqlite3.Row
-            cursor = conn.cursor()
-            cursor.execute("SELECT session_id, session_name, created_at FROM session_info ORDER BY created_at DESC")
-            rows = cursor.fetchall()
+            with self._reader() as conn:
+                cursor = conn.cursor()
+                cursor.row_factory = sqlite3.Row
+                cursor.execute(_SQL_GET_ALL_SESSIONS)
+                rows = cursor.fetchall()
             sessions = [dict(row) for row in rows]
             logger.debug(f"Recuperadas {len(sessions)} sesiones de SQLite.", extra=log_extra)
             return sessions
         except sqlite3.Error:
             logger.exception("Error al recuperar todas las sesiones de SQLite.", extra=log_extra)
             return []
-        finally:
-            conn.close()
 
     def delete_session(self, session_id: str, trace_id: str = 'N/A') -> bool:
         log_extra = {'trace_id': trace_id, 'data': {'session_id': session_id}}
-        conn = self._get_connection()
         try:
-            with conn:
-                conn.execute("DELETE FROM session_info WHERE session_id = ?", (session_id,))
-                conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+            with self._writer() as conn, conn:
+                conn.execute(_SQL_DELETE_SESSION_INFO, (session_id,))
+                conn.execute(_SQL_DELETE_SESSION_SUMMARY, (session_id,))
             logger.info(f"Datos de la sesión {session_id} eliminados de SQLite.", extra=log_extra)
             return True
         except sqlite3.Error:
             logger.exception(f"Error al eliminar la sesión {session_id} de SQLite.", extra=log_extra)
             return False
-        finally:
-            conn.close()
\ No newline at end of file
@@ -0,0 +1,54 @@
+from ..providers.api_manager import ApiManager
+from ..utils.logger import logger
+from .redis_manager import RedisManager
+from .sqlite_manager import SQLiteManager
+
+SUMMARY_KEEP_TURNS = 10 # Turnos recientes que se conservan sin resumir en Redis
+
+def summarize_session(redis_manager: RedisManager, sqlite_manager: SQLiteManager, api_manager: ApiManager, session_id: str, trace_id: str):
+    """
+    Resumen rodante de la memoria a medio plazo: resume los turnos más antiguos de Redis junto
+    con el resumen anterior de SQLite y poda el historial para conservar los últimos
+    `SUMMARY_KEEP_TURNS`. Lo usan tanto el orquestador como el worker de arq.
+    """
+    log_extra = {'trace_id': trace_id}
+    logger.info("Iniciando proceso de resumen rodante para la memoria a medio plazo.", extra=log_extra)
+
+    # 1. Obtener todo el historial
+    all_turns = redis_manager.get_recent_turns(session_id, num_turns=0, trace_id=trace_id) # num_turns=0 para obtener todo
+    
+    num_turns_to_summarize = len(all_turns) - SUMMARY_KEEP_TURNS
+    if num_turns_to_summarize <= 0:
+        logger.info("No hay suficientes turnos para resumir.", extra=log_extra)
+        return
+
+    # 2. Seleccionar los turnos a resumir
+    turns_to_summarize = all_turns[:num_turns_to_summarize]
+    
+    # 3. Crear el resumen
+    conversation_text = "\n".join([f"{turn['role']}: {turn['content']}" for turn in turns_to_summarize])
+    previous_summary = sqlite_manager.get_summary(session_id, trace_id)
+    previous_summary_text = f"Resumen anterior: {previous_summary[0]}" if previous_summary else "Este es el primer resumen de la conversación."
+
+    summarization_prompt = f"{previous_summary_text}\n\nBasándote en el resumen anterior y el siguiente extracto de la conversación reciente, actualiza el resumen de forma concisa, capturando solo la información o conclusiones clave en una o dos frases.\n\nConversación Reciente:\n{conversation_text}\n\nResumen actualizado y conciso:"
+
+    provider = api_manager.get_provider("openai", model="gpt-3.5-turbo", trace_id=trace_id)
+    if not provider:
+        logger.error("No se pudo obtener el proveedor de OpenAI para el resumen de medio plazo.", extra=log_extra)
+        return
+
+    try:
+        summary_response = provider.generate_response(
+            prompt=summarization_prompt, history=[], tools=[], temperature=0.2, max_tokens=250
+        )
+        summary_text = summary_response.content.strip()
+        
+        # 4. Actualizar el resumen en SQLite
+        sqlite_manager.update_summary(session_id, summary_text, len(all_turns), trace_id)
+        logger.info(f"Memoria a medio plazo (SQLite) actualizada con nuevo resumen.", extra={'trace_id': trace_id, 'data': {'summary': summary_text}})
+
+        # 5. Podar el historial de Redis
+        redis_manager.trim_history(session_id, SUMMARY_KEEP_TURNS, trace_id)
+
+    except Exception:
+        logger.exception("Ocurrió un error durante el proceso de resumen en segundo plano.", extra=log_extra)
@@ -1,27 +1,205 @@
 
 from transformers import pipeline
+import os
 import re
+import threading
+import torch
+from typing import List, Dict, Any, Optional
 from ..utils.logger import logger
 
-class PersonalityEngine:
-    def __init__(self):
+# Dispositivo de inferencia para los pipelines de Hugging Face (GPU si está disponible).
+PIPELINE_DEVICE = 0 if torch.cuda.is_available() else -1
+PIPELINE_BATCH_SIZE = 16
+# En CPU, las capas lineales de ambos modelos se cuantizan dinámicamente a INT8: los pesos
+# ocupan 4 veces menos y la inferencia, limitada por ancho de banda de memoria, se acelera.
+QUANTIZE_MODELS = os.getenv("PERSONALITY_QUANTIZE", "true").lower() in ("1", "true", "yes")
+# Para un solo prompt, el forward de intención se traza con TorchScript (una fila por etiqueta)
+# en varias longitudes fijas (INTENT_TRACE_BUCKETS) para evitar el despacho de Python.
+TRACE_INTENT_MODEL = os.getenv("PERSONALITY_JIT", "true").lower() in ("1", "true", "yes")
+
+# Etiquetas candidatas del clasificador de intención.
+INTENT_LABELS = [
+    'saludo o conversación casual',
+    'pregunta conceptual o técnica',
+    'petición de brainstorming o sugerencias',
+    'queja o frustración',
+    'broma o comentario humorístico'
+]
+# Hipótesis NLI de cada etiqueta (misma plantilla que usa por defecto el pipeline zero-shot).
+INTENT_HYPOTHESIS_TEMPLATE = "This example is {}."
+# Longitudes (tokens por par premisa/hipótesis) de los modelos trazados: se usa la menor que
+# contenga el par más largo, para no rellenar un "hola" hasta 128 tokens. Si ninguna basta,
+# se usa el modelo sin trazar.
+INTENT_TRACE_BUCKETS = (32, 64, 128)
+INTENT_CONFIDENCE_THRESHOLD = 0.50 # Umbral de confianza para intención
+NEGATIVE_SENTIMENT_THRESHOLD = 0.8 # Umbral alto para negatividad
+
+# Prefiltro barato para mensajes triviales ("hola", "gracias", "ok"...): si un prompt corto está
+# formado solo por fórmulas de cortesía, se clasifica directamente sin pasar por los modelos.
+SMALL_TALK_MAX_CHARS = 20
+SMALL_TALK_INTENT = 'saludo o conversación casual'
+_SMALL_TALK_RE = re.compile(
+    r"^[\s¡¿]*(?:(?:hola|holi|hey|buenas|buenos d[ií]as|buenas tardes|buenas noches|qu[eé] tal|saludos|"
+    r"gracias|muchas gracias|ok|okay|vale|genial|perfecto|adi[oó]s|hasta luego|chao)[\s,.!?¡¿]*)+$",
+    re.IGNORECASE
+)
+
+def _quantize_pipeline(pipe, name: str):
+    """Cuantiza a INT8 las capas lineales del modelo de un pipeline (solo en CPU)."""
+    if not QUANTIZE_MODELS or PIPELINE_DEVICE != -1:
+        return pipe
+    try:
+        pipe.model = torch.quantization.quantize_dynamic(pipe.model, {torch.nn.Linear}, dtype=torch.qint8)
+        logger.info(f"Modelo '{name}' cuantizado a INT8.")
+    except Exception:
+        logger.exception(f"No se pudo cuantizar el modelo '{name}'. Se usará en FP32.")
+    return pipe
+
+# Pipelines compartidos por todo el proceso: se cargan una sola vez (la primera instancia de
+# PersonalityEngine) y el resto de instancias reutilizan las mismas referencias.
+_PIPELINES = None
+_PIPELINES_LOCK = threading.Lock()
+
+def _get_pipelines():
+    """Devuelve (intent_classifier, sentiment_analyzer), cargándolos la primera vez."""
+    global _PIPELINES
+    with _PIPELINES_LOCK:
+        if _PIPELINES is not None:
+            return _PIPELINES
+
         logger.info("PersonalityEngine: Cargando comité de modelos de PLN...")
         # Usamos un bloque try-except para cada modelo para un arranque más robusto
         try:
-            self.intent_classifier = pipeline("zero-shot-classification", model="facebook/bart-large-mnli")
+            intent_classifier = _quantize_pipeline(
+                pipeline("zero-shot-classification", model="facebook/bart-large-mnli", device=PIPELINE_DEVICE, batch_size=PIPELINE_BATCH_SIZE),
+                "bart-large-mnli"
+            )
             logger.info("Clasificador de intención (bart-large-mnli) cargado.")
         except Exception:
             logger.exception("Error al cargar el clasificador de intención. La detección de intención no estará disponible.")
-            self.intent_classifier = None
+            intent_classifier = None
 
         try:
-            self.sentiment_analyzer = pipeline("sentiment-analysis", model="pysentimiento/robertuito-sentiment-analysis")
+            sentiment_analyzer = _quantize_pipeline(
+                pipeline("sentiment-analysis", model="pysentimiento/robertuito-sentiment-analysis", device=PIPELINE_DEVICE, batch_size=PIPELINE_BATCH_SIZE),
+                "robertuito-sentiment-analysis"
+            )
             logger.info("Analizador de sentimiento (robertuito-sentiment-analysis) cargado.")
         except Exception:
             logger.exception("Error al cargar el analizador de sentimiento. La detección de sentimiento no estará disponible.")
-            self.sentiment_analyzer = None
+            sentiment_analyzer = None
+
+        _PIPELINES = (intent_classifier, sentiment_analyzer)
+        return _PIPELINES
+
+class _IntentLogits(torch.nn.Module):
+    """Envoltorio que expone solo los logits del modelo NLI, para poder trazarlo con TorchScript."""
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids, attention_mask):
+        return self.model(input_ids=input_ids, attention_mask=attention_mask).logits
+
+class PersonalityEngine:
+    def __init__(self):
+        self.intent_classifier, self.sentiment_analyzer = _get_pipelines()
+        self._prepare_intent_hypotheses()
         logger.info("PersonalityEngine: Comité de expertos listo.")
 
+    def _prepare_intent_hypotheses(self):
+        """
+        Tokeniza una sola vez las hipótesis de las etiquetas de intención. En cada petición solo
+        se tokeniza la premisa (el prompt) y se combina con estos ids ya calculados.
+        """
+        self._hypothesis_ids = []
+        self._entailment_id = -1
+        if not self.intent_classifier:
+            return
+        tokenizer = self.intent_classifier.tokenizer
+        # Longitud máxima por par en el camino normal: la misma a la que trunca el pipeline zero-shot.
+        self._intent_max_length = min(tokenizer.model_max_length, self.intent_classifier.model.config.max_position_embeddings)
+        self._hypothesis_ids = [
+            tokenizer(INTENT_HYPOTHESIS_TEMPLATE.format(label), add_special_tokens=False)["input_ids"]
+            for label in INTENT_LABELS
+        ]
+        for label, label_id in self.intent_classifier.model.config.label2id.items():
+            if label.lower().startswith("entail"):
+                self._entailment_id = label_id
+        self._traced_intent_models = self._trace_intent_models() if TRACE_INTENT_MODEL else {}
+
+    def _trace_intent_models(self) -> Dict[int, Any]:
+        """Traza el modelo de intención para cada forma (len(INTENT_LABELS), longitud) de INTENT_TRACE_BUCKETS."""
+        model = self.intent_classifier.model
+        example_ids = self._build_intent_pairs(["hola"])
+        traced_models = {}
+        for length in INTENT_TRACE_BUCKETS:
+            try:
+                example = self._pad_intent_pairs(example_ids, length)
+                with torch.inference_mode():
+                    traced_models[length] = torch.jit.trace(
+                        _IntentLogits(model).eval(),
+                        (example["input_ids"].to(model.device), example["attention_mask"].to(model.device)),
+                        check_trace=False
+                    )
+            except Exception:
+                logger.exception(f"No se pudo trazar el modelo de intención para {length} tokens.")
+        if traced_models:
+            logger.info(f"Modelo de intención trazado con TorchScript para {sorted(traced_models)} tokens.")
+        return traced_models
+
+    def _build_intent_pairs(self, prompts: List[str]) -> List[List[int]]:
+        """
+        Construye los ids de los pares (premisa, hipótesis): len(prompts) x len(INTENT_LABELS) filas,
+        limitadas a la longitud máxima del tokenizer, como en el pipeline.
+        """
+        tokenizer = self.intent_classifier.tokenizer
+        special_tokens = tokenizer.num_special_tokens_to_add(pair=True)
+        input_ids = []
+        for prompt in prompts:
+            premise_ids = tokenizer(prompt, add_special_tokens=False)["input_ids"]
+            for hypothesis_ids in self._hypothesis_ids:
+                # Como en el pipeline, se trunca solo la premisa.
+                premise_budget = self._intent_max_length - special_tokens - len(hypothesis_ids)
+                input_ids.append(tokenizer.build_inputs_with_special_tokens(premise_ids[:premise_budget], hypothesis_ids))
+        return input_ids
+
+    def _pad_intent_pairs(self, input_ids: List[List[int]], length: Optional[int] = None) -> Dict[str, torch.Tensor]:
+        """Rellena los pares hasta `length` (forma de un modelo trazado) o, si no se indica, hasta el más largo."""
+        tokenizer = self.intent_classifier.tokenizer
+        if length is not None:
+            return tokenizer.pad({"input_ids": input_ids}, padding="max_length", max_length=length, return_tensors="pt")
+        return tokenizer.pad({"input_ids": input_ids}, padding="longest", return_tensors="pt")
+
+    def _classify_intents(self, prompts: List[str]) -> List[Dict[str, Any]]:
+        """
+        Clasificación zero-shot de intención con un único forward por lote. Equivale a llamar al
+        pipeline con multi_label=False: softmax de los logits de implicación entre etiquetas.
+        """
+        model = self.intent_classifier.model
+        input_ids = self._build_intent_pairs(prompts)
+        # Los modelos trazados solo admiten la forma de un único prompt; los lotes, y los prompts
+        # que no caben en ninguna longitud trazada, usan el modelo normal.
+        traced_length = None
+        if len(prompts) == 1:
+            longest = max(len(ids) for ids in input_ids)
+            traced_length = next((length for length in sorted(self._traced_intent_models) if length >= longest), None)
+        inputs = {name: tensor.to(model.device) for name, tensor in self._pad_intent_pairs(input_ids, traced_length).items()}
+        with torch.inference_mode():
+            if traced_length is not None:
+                logits = self._traced_intent_models[traced_length](inputs["input_ids"], inputs["attention_mask"])
+            else:
+                logits = model(**inputs).logits
+        entailment_logits = logits[:, self._entailment_id].reshape(len(prompts), len(INTENT_LABELS))
+        scores = entailment_logits.softmax(dim=-1).tolist()
+
+        results = []
+        for prompt_scores in scores:
+            ranking = sorted(zip(INTENT_LABELS, prompt_scores), key=lambda item: item[1], reverse=True)
+            results.append({'labels': [label for label, _ in ranking], 'scores': [score for _, score in ranking]})
+        return results
+
     def _analyze_structure_and_style(self, prompt: str, trace_id: str) -> dict:
         log_extra = {'trace_id': trace_id}
         logger.debug("Analizando estructura y estilo del prompt.", extra=log_extra)
@@ -36,54 +214,71 @@ class PersonalityEngine:
             logger.warning("Análisis de personalidad omitido: prompt vacío o clasificadores no disponibles.", extra=log_extra)
             return {}
 
-        final_directives = {}
-        
+        return self.batch_analyze([prompt], trace_id)[0]
+
+    def batch_analyze(self, prompts: List[str], trace_id: str = 'N/A') -> List[dict]:
+        """
+        Analiza varios prompts a la vez: cada modelo procesa el lote completo en una sola
+        llamada (tokenización y forward por lotes). Devuelve una directiva por prompt.
+        """
+        log_extra = {'trace_id': trace_id, 'data': {'num_prompts': len(prompts)}}
+        all_directives = [{} for _ in prompts]
+        if not prompts:
+            return all_directives
+
+        # --- FASE 0: PREFILTRO DE CONVERSACIÓN TRIVIAL ---
+        pending = []
+        for i, prompt in enumerate(prompts):
+            if len(prompt) < SMALL_TALK_MAX_CHARS and _SMALL_TALK_RE.match(prompt):
+                all_directives[i]['intent'] = SMALL_TALK_INTENT
+                logger.info(f"Conversación trivial detectada por el prefiltro. Directiva: '{SMALL_TALK_INTENT}'.", extra=log_extra)
+            else:
+                pending.append(i)
+        if not pending:
+            return all_directives
+
         # --- FASE 1: ANÁLISIS DE SENTIMIENTO (Prioridad Alta) ---
         if self.sentiment_analyzer:
             try:
-                sentiment_results = self.sentiment_analyzer(prompt)[0]
-                sentiment_label = sentiment_results['label']
-                sentiment_score = sentiment_results['score']
-                
-                logger.debug(f"Resultados del analizador de sentimiento: Label='{sentiment_label}', Score={sentiment_score:.2f}", extra=log_extra)
-
-                if sentiment_label == 'NEG' and sentiment_score > 0.8: # Umbral alto para negatividad
-                    final_directives['intent'] = 'queja o frustración'
-                    logger.info(f"Sentimiento negativo fuerte detectado. Directiva: '{final_directives['intent']}'.", extra=log_extra)
-                    return final_directives # Si hay negatividad fuerte, priorizamos esto
+                sentiment_results = self.sentiment_analyzer([prompts[i] for i in pending], truncation=True)
+                to_classify = []
+                for i, sentiment_result in zip(pending, sentiment_results):
+                    sentiment_label = sentiment_result['label']
+                    sentiment_score = sentiment_result['score']
+                    logger.debug(f"Resultados del analizador de sentimiento: Label='{sentiment_label}', Score={sentiment_score:.2f}", extra=log_extra)
+
+                    if sentiment_label == 'NEG' and sentiment_score > NEGATIVE_SENTIMENT_THRESHOLD:
+                        # Si hay negatividad fuerte, priorizamos esto
+                        all_directives[i]['intent'] = 'queja o frustración'
+                        logger.info(f"Sentimiento negativo fuerte detectado. Directiva: '{all_directives[i]['intent']}'.", extra=log_extra)
+                    else:
+                        to_classify.append(i)
+                pending = to_classify
             except Exception:
                 logger.exception("Error durante el análisis de sentimiento.", extra=log_extra)
 
         # --- FASE 2: ANÁLISIS DE INTENCIÓN (Si no hay sentimiento negativo fuerte) ---
-        if self.intent_classifier:
-            candidate_labels = [
-                'saludo o conversación casual',
-                'pregunta conceptual o técnica',
-                'petición de brainstorming o sugerencias',
-                'queja o frustración',
-                'broma o comentario humorístico'
-            ]
-            confidence_threshold = 0.50 # Umbral de confianza para intención
-
+        if self.intent_classifier and pending:
             try:
-                intent_results = self.intent_classifier(prompt, candidate_labels, multi_label=False)
-                
-                log_data = {
-                    'prompt': prompt,
-                    'labels': intent_results['labels'],
-                    'scores': intent_results['scores'],
-                    'threshold': confidence_threshold
-                }
-                logger.debug("Resultados del clasificador de intención Zero-Shot.", extra={'trace_id': trace_id, 'data': log_data})
-
-                top_label = intent_results['labels'][0]
-                top_score = intent_results['scores'][0]
-
-                if top_score >= confidence_threshold:
-                    final_directives['intent'] = top_label
-                    logger.info(f"Intención detectada: '{top_label}' (Confianza: {top_score:.2f})", extra=log_extra)
-                else:
-                    logger.info(f"La intención principal ('{top_label}') no superó el umbral de confianza (Score: {top_score:.2f}). No se aplicará directiva de intención.", extra=log_extra)
+                intent_results = self._classify_intents([prompts[i] for i in pending])
+
+                for i, intent_result in zip(pending, intent_results):
+                    log_data = {
+                        'prompt': prompts[i],
+                        'labels': intent_result['labels'],
+                        'scores': intent_result['scores'],
+                        'threshold': INTENT_CONFIDENCE_THRESHOLD
+                    }
+                    logger.debug("Resultados del clasificador de intención Zero-Shot.", extra={'trace_id': trace_id, 'data': log_data})
+
+                    top_label = intent_result['labels'][0]
+                    top_score = intent_result['scores'][0]
+
+                    if top_score >= INTENT_CONFIDENCE_THRESHOLD:
+                        all_directives[i]['intent'] = top_label
+                        logger.info(f"Intención detectada: '{top_label}' (Confianza: {top_score:.2f})", extra=log_extra)
+                    else:
+                        logger.info(f"La intención principal ('{top_label}') no superó el umbral de confianza (Score: {top_score:.2f}). No se aplicará directiva de intención.", extra=log_extra)
 
             except Exception:
                 logger.exception("Ocurrió un error durante la clasificación de intención.", extra=log_extra)
@@ -91,5 +286,5 @@ class PersonalityEngine:
         # --- FASE 3: ANÁLISIS ESTRUCTURAL (simplificado por ahora) ---
         # La lógica de _analyze_structure_and_style se puede añadir aquí si es necesario
 
-        logger.debug(f"Diagnóstico final de personalidad: {final_directives}", extra=log_extra)
-        return final_directives
+        logger.debug(f"Diagnóstico final de personalidad: {all_directives}", extra=log_extra)
+        return all_directives
@@ -1,8 +1,11 @@
 # FILE: chimera_core/orchestrator.py (VERSIÓN CORREGIDA)
 
+import os
 import uuid
-import json
-from typing import Dict, Any, List
+import orjson
+import asyncio
+import logging
+from typing import Dict, Any, List, Optional, Tuple, AsyncIterator
 import time
 from fastapi import BackgroundTasks
 from pydantic import BaseModel
@@ -18,10 +21,36 @@ class LLMSettings(BaseModel):
     # Podríamos añadir más campos como el contexto utilizado, herramientas ejecutadas, etc.
 
 from .context_engine import ContextEngine
+from .memory.summarizer import summarize_session, SUMMARY_KEEP_TURNS
+from .plugins.confirmation_broker import current_trace_id
 from .meta.personality_engine import PersonalityEngine
 from .providers.api_manager import ApiManager
 from .utils.logger import logger
 
+# Dónde se ejecuta el resumen rodante: "local" (tarea de fondo en este proceso) o "arq"
+# (cola en Redis consumida por un worker aparte: `arq chimera_core.worker.WorkerSettings`).
+SUMMARY_BACKEND = os.getenv("SUMMARY_BACKEND", "local").lower()
+
+def _fmt_turn(turn) -> str:
+    """Formatea un mensaje del historial para el log, truncando su contenido."""
+    role = ""
+    content = ""
+    if isinstance(turn, dict):
+        role = turn.get('role')
+        content = turn.get('content')
+    elif hasattr(turn, 'role') and hasattr(turn, 'content'):
+        role = turn.role
+        content = turn.content
+    elif hasattr(turn, 'tool_calls') and turn.tool_calls: # Handle tool calls
+        role = "tool_calls"
+        content = str(turn.tool_calls) # Convert tool_calls to string for logging
+    # Truncate content for readability in logs
+    truncated_content = (content[:200] + '...') if content and len(content) > 200 else content
+    return f"\n- ROLE: {role}\n  CONTENT: {truncated_content}"
+
+def _format_api_history(api_history: List[Any]) -> str:
+    return "".join(["\n--- API HISTORY ---", *map(_fmt_turn, api_history)])
+
 class Orchestrator:
     def __init__(self):
         logger.info("Inicializando el Orquestador...")
@@ -34,10 +63,12 @@ class Orchestrator:
             "temperature": 0.7,
             "max_tokens": 1500
         }
+        self._summary_queue = None # ArqRedis, creado al encolar el primer resumen con SUMMARY_BACKEND=arq
         logger.info("Orquestador listo.")
 
-    def handle_user_request(self, session_id: str, user_prompt: str, llm_settings: LLMSettings, background_tasks: BackgroundTasks) -> Dict[str, Any]:
-        trace_id = str(uuid.uuid4())
+    async def handle_user_request(self, session_id: str, user_prompt: str, llm_settings: LLMSettings, background_tasks: BackgroundTasks, trace_id: Optional[str] = None) -> Dict[str, Any]:
+        # El cliente puede fijar el trace_id para consultar las confirmaciones pendientes de su petición.
+        trace_id = trace_id or str(uuid.uuid4())
         log_extra = {'trace_id': trace_id}
         
         logger.info(f"Iniciando manejo de petición para la sesión {session_id}.", extra=log_extra)
@@ -51,23 +82,128 @@ class Orchestrator:
         )
         
         start_time = time.time()
-        
+        persistence_scheduled = False
+        try:
+            request = await self._prepare_request(session_id, user_prompt, trace_id)
+            if "error" in request:
+                return request
+
+            # --- FASE 3: LLAMADA A LA API Y BUCLE DE HERRAMIENTAS ---
+            if request["cached_response"] is not None:
+                final_response_text = request["cached_response"]
+            else:
+                final_response_text, cacheable = await self._generate_response(
+                    request["llm_provider"], user_prompt, request["api_history"], request["augmented_context"]["tools"], trace_id
+                )
+                self._schedule_response_cache(request["cache_scope"], cacheable, user_prompt, final_response_text, trace_id, background_tasks)
+
+            self._schedule_persistence(session_id, user_prompt, final_response_text, request["augmented_context"], trace_id, background_tasks)
+            persistence_scheduled = True
+
+            execution_time = (time.time() - start_time) * 1000
+            logger.info(f"Petición manejada exitosamente en {execution_time:.2f} ms.", extra=log_extra)
+            return {"response": final_response_text}
+        finally:
+            self._release_request_cache(persistence_scheduled, trace_id, background_tasks)
+
+    async def stream_user_request(self, session_id: str, user_prompt: str, llm_settings: LLMSettings, background_tasks: BackgroundTasks, trace_id: Optional[str] = None) -> AsyncIterator[str]:
+        """
+        Variante en streaming de `handle_user_request`: emite los fragmentos de la respuesta final
+        según los genera el LLM. El bucle de herramientas se sigue resolviendo en el servidor, y el
+        guardado y el resumen se encolan al cerrarse el stream, con la respuesta ya completa.
+        """
+        trace_id = trace_id or str(uuid.uuid4())
+        log_extra = {'trace_id': trace_id}
+
+        logger.info(f"Iniciando manejo de petición en streaming para la sesión {session_id}.", extra=log_extra)
+
+        self.update_llm_settings(
+            llm_settings.provider_name,
+            llm_settings.model_name,
+            llm_settings.temperature,
+            llm_settings.max_tokens,
+            trace_id
+        )
+
+        start_time = time.time()
+        persistence_scheduled = False
+        try:
+            request = await self._prepare_request(session_id, user_prompt, trace_id)
+            if "error" in request:
+                yield request["error"]
+                return
+
+            # --- FASE 3: LLAMADA A LA API (EN STREAMING) Y BUCLE DE HERRAMIENTAS ---
+            if request["cached_response"] is not None:
+                final_response_text = request["cached_response"]
+                yield final_response_text
+            else:
+                llm_provider = request["llm_provider"]
+                api_history = request["api_history"]
+                tools = request["augmented_context"]["tools"]
+                api_call_params = {
+                    "temperature": self.llm_config["temperature"],
+                    "max_tokens": self.llm_config["max_tokens"]
+                }
+
+                logger.info("Enviando petición inicial al LLM (streaming).", extra=log_extra)
+                used_tools = False
+                while True:
+                    # Como en handle_user_request, solo se guarda el texto de la última ronda: lo que el
+                    # modelo escriba antes de llamar a una herramienta se muestra pero no se persiste.
+                    response_parts = []
+                    response_message = None
+                    async for item in llm_provider.agenerate_response_stream(prompt=None, history=api_history, tools=tools, **api_call_params):
+                        if isinstance(item, str):
+                            response_parts.append(item)
+                            yield item
+                        else:
+                            response_message = item
+                    if not (response_message and response_message.tool_calls):
+                        break
+                    used_tools = True
+                    logger.info("Llamada a herramienta detectada por el LLM.", extra=log_extra)
+                    await self._run_tool_calls(response_message, api_history, trace_id)
+                    logger.info("Enviando resultado de la herramienta al LLM para obtener respuesta final (streaming).", extra=log_extra)
+
+                if not response_parts:
+                    response_parts.append("No se recibió respuesta del LLM.")
+                    yield response_parts[0]
+                final_response_text = "".join(response_parts)
+                self._schedule_response_cache(request["cache_scope"], bool(response_message) and not used_tools, user_prompt, final_response_text, trace_id, background_tasks)
+
+            self._schedule_persistence(session_id, user_prompt, final_response_text, request["augmented_context"], trace_id, background_tasks)
+            persistence_scheduled = True
+
+            execution_time = (time.time() - start_time) * 1000
+            logger.info(f"Petición en streaming manejada exitosamente en {execution_time:.2f} ms.", extra=log_extra)
+        finally:
+            self._release_request_cache(persistence_scheduled, trace_id, background_tasks)
+
+    async def _prepare_request(self, session_id: str, user_prompt: str, trace_id: str) -> Dict[str, Any]:
+        """
+        Fases 1 y 2 de una petición: análisis, construcción del contexto, selección del proveedor
+        y consulta a la caché semántica de respuestas. Devuelve {"error": ...} si el proveedor no existe.
+        """
+        log_extra = {'trace_id': trace_id}
+
         # --- FASE 1: ANÁLISIS Y TRIAGE ---
         # CORRECCIÓN: Pasar el trace_id a analyze_user_input
-        personality_directives = self.personality_engine.analyze_user_input(user_prompt, trace_id=trace_id)
+        personality_directives = await asyncio.to_thread(self.personality_engine.analyze_user_input, user_prompt, trace_id=trace_id)
         #memory_flags = self.context_engine._determine_memory_relevance(user_prompt)
-        
+    
         # --- FASE 2: CONSTRUCCIÓN DE CONTEXTO ---
-        augmented_context = self.context_engine.build_augmented_prompt(
+        augmented_context = await self.context_engine.build_augmented_prompt(
             session_id=session_id, user_prompt=user_prompt,
             personality_directives=personality_directives, trace_id=trace_id
         )
-        
-        system_prompt = augmented_context["system_prompt"]
-        history = augmented_context["history"]
-        tools = augmented_context["tools"]
-        entities = augmented_context["entities"]
-        api_history = [{"role": "system", "content": system_prompt}] + history
+    
+        # El prompt de sistema fijo va primero para que el prefijo se pueda cachear;
+        # el contexto propio de esta petición se añade como un segundo mensaje de sistema.
+        api_history = [{"role": "system", "content": augmented_context["system_prompt"]}]
+        if augmented_context["dynamic_context"]:
+            api_history.append({"role": "system", "content": augmented_context["dynamic_context"]})
+        api_history += augmented_context["history"]
 
         # CORRECCIÓN: Crear la instancia del proveedor una vez y pasar el trace_id
         llm_provider = self.api_manager.get_provider(
@@ -78,163 +214,178 @@ class Orchestrator:
         if not llm_provider:
             logger.error(f"Proveedor LLM '{self.llm_config['provider_name']}' no encontrado.", extra=log_extra)
             return {"error": f"Proveedor '{self.llm_config['provider_name']}' no encontrado."}
-            
-        # --- FASE 3: LLAMADA A LA API Y BUCLE DE HERRAMIENTAS ---
+
+        # Antes de llamar al LLM se consulta la caché semántica de respuestas. Su ámbito son los
+        # mensajes previos al prompt del usuario, así que se calcula antes de añadirlo al historial.
+        response_cache = self.context_engine.response_cache
+        cache_scope = response_cache.make_scope(self.llm_config['model_name'], api_history) if response_cache.enabled else None
+        cached_response = await asyncio.to_thread(response_cache.lookup, cache_scope, user_prompt, trace_id) if cache_scope else None
+
+        # El prompt va en el historial (y no como `prompt` del proveedor, que no modifica la lista
+        # recibida) para que las llamadas de seguimiento del bucle de herramientas lo incluyan.
+        api_history.append({"role": "user", "content": user_prompt})
+
+        return {
+            "augmented_context": augmented_context,
+            "api_history": api_history,
+            "llm_provider": llm_provider,
+            "cache_scope": cache_scope,
+            "cached_response": cached_response
+        }
+
+    def _schedule_response_cache(self, cache_scope: Optional[str], cacheable: bool, user_prompt: str, final_response_text: str, trace_id: str, background_tasks: BackgroundTasks):
+        # Las respuestas que dependieron de herramientas (correo, ficheros, búsquedas) no se cachean.
+        if cache_scope and cacheable:
+            background_tasks.add_task(self.context_engine.response_cache.store, cache_scope, user_prompt, final_response_text, trace_id)
+
+    def _schedule_persistence(self, session_id: str, user_prompt: str, final_response_text: str, augmented_context: Dict[str, Any], trace_id: str, background_tasks: BackgroundTasks):
+        log_extra = {'trace_id': trace_id}
+
+        # --- FASE 4: PERSISTENCIA (EN SEGUNDO PLANO) ---
+        # El guardado (incluida la extracción de entidades de la respuesta) se ejecuta después
+        # de enviar la respuesta HTTP, para no sumar su latencia a la del usuario.
+        user_turn_id = f"{session_id}_{uuid.uuid4()}"
+        assistant_turn_id = f"{session_id}_{uuid.uuid4()}"
+        background_tasks.add_task(self.context_engine.save_turn, session_id, user_prompt, final_response_text, user_turn_id, assistant_turn_id, trace_id, augmented_context["entities"])
+
+        # --- FASE 5: RESUMEN ASÍNCRONO ---
+        # Las tareas de fondo se ejecutan en orden, así que el resumen verá el turno ya guardado.
+        # Se reutiliza el número de turnos leído al construir el contexto (sin otra consulta a Redis)
+        # y se suman los dos mensajes (usuario y asistente) que save_turn aún no ha escrito.
+        turn_count = augmented_context["turn_count"] + 2
+        if turn_count > SUMMARY_KEEP_TURNS:
+            logger.info(f"Umbral de resumen alcanzado (Turno {turn_count}). Disparando tarea de fondo.", extra=log_extra)
+            if SUMMARY_BACKEND == "arq":
+                background_tasks.add_task(self._enqueue_summary, session_id, trace_id)
+            else:
+                background_tasks.add_task(self._summarize_and_update_mid_term_memory, session_id, trace_id)
+
+    def _release_request_cache(self, persistence_scheduled: bool, trace_id: str, background_tasks: BackgroundTasks):
+        # La caché de entidades de la petición se libera cuando ya no hace falta: si el guardado
+        # quedó encolado, detrás de él (las tareas de fondo se ejecutan en orden); si no, ya.
+        if persistence_scheduled:
+            background_tasks.add_task(self.context_engine.release_request_cache, trace_id)
+        else:
+            self.context_engine.release_request_cache(trace_id)
+
+    async def _generate_response(self, llm_provider: BaseProvider, user_prompt: str, api_history: List[Dict[str, Any]], tools: List[Any], trace_id: str) -> Tuple[str, bool]:
+        """
+        Llama al LLM y resuelve sus llamadas a herramientas hasta obtener la respuesta final.
+        Devuelve el texto de la respuesta y si es cacheable: no lo es si se ejecutó alguna
+        herramienta por el camino o si el LLM no devolvió respuesta.
+        """
+        log_extra = {'trace_id': trace_id}
         api_call_params = {
             "temperature": self.llm_config["temperature"],
             "max_tokens": self.llm_config["max_tokens"]
         }
 
         logger.info("Enviando petición inicial al LLM.", extra=log_extra)
-        log_message = f"Prompt inicial enviado al LLM: user_prompt='{user_prompt}'"
-        log_message += "\n--- API HISTORY ---"
-        for turn in api_history:
-            role = ""
-            content = ""
-            if isinstance(turn, dict):
-                role = turn.get('role')
-                content = turn.get('content')
-            elif hasattr(turn, 'role') and hasattr(turn, 'content'):
-                role = turn.role
-                content = turn.content
-            elif hasattr(turn, 'tool_calls') and turn.tool_calls: # Handle tool calls
-                role = "tool_calls"
-                content = str(turn.tool_calls) # Convert tool_calls to string for logging
-            
-            log_message += f"\n- ROLE: {role}"
-            # Truncate content for readability in logs
-            truncated_content = (content[:200] + '...') if content and len(content) > 200 else content
-            log_message += f"\n  CONTENT: {truncated_content}"
-        logger.debug(log_message, extra=log_extra)
-        response_message = llm_provider.generate_response(
-            prompt=user_prompt, history=api_history, tools=tools, **api_call_params
+        # El volcado del historial solo se construye si el nivel DEBUG está activo.
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Prompt inicial enviado al LLM: user_prompt='{user_prompt}'{_format_api_history(api_history)}", extra=log_extra)
+        response_message = await llm_provider.agenerate_response(
+            prompt=None, history=api_history, tools=tools, **api_call_params
         )
 
+        used_tools = False
         while response_message and response_message.tool_calls:
+            used_tools = True
             logger.info("Llamada a herramienta detectada por el LLM.", extra=log_extra)
-            api_history.append(response_message.model_dump())
-
-            for tool_call in response_message.tool_calls:
-                function_name = tool_call.function.name
-                try:
-                    arguments = json.loads(tool_call.function.arguments)
-                except json.JSONDecodeError:
-                    logger.error(f"Error al decodificar argumentos JSON para '{function_name}'.", extra=log_extra)
-                    arguments = {}
-
-                plugin_name = self.context_engine.plugin_manager.find_plugin_for_tool(function_name)
-                
-                if not plugin_name:
-                    logger.error(f"No se encontró plugin para la herramienta '{function_name}'.", extra=log_extra)
-                    continue
-
-                logger.info(f"Ejecutando herramienta: '{plugin_name}.{function_name}'.", extra={'trace_id': trace_id, 'data': arguments})
-                tool_result = self.context_engine.plugin_manager.execute_tool(
-                    plugin_name=plugin_name, tool_name=function_name, **arguments
-                )
-                logger.info(f"Resultado de la herramienta: {tool_result}", extra=log_extra)
-
-                api_history.append(
-                    {"tool_call_id": tool_call.id, "role": "tool", "name": function_name, "content": json.dumps(tool_result)}
-                )
-            
+            await self._run_tool_calls(response_message, api_history, trace_id)
+        
             logger.info("Enviando resultado de la herramienta al LLM para obtener respuesta final.", extra=log_extra)
-            log_message = f"Prompt de seguimiento enviado al LLM (después de herramienta):"
-            log_message += "\n--- API HISTORY ---\n"
-            for turn in api_history:
-                role = ""
-                content = ""
-                if isinstance(turn, dict):
-                    role = turn.get('role')
-                    content = turn.get('content')
-                elif hasattr(turn, 'role') and hasattr(turn, 'content'):
-                    role = turn.role
-                    content = turn.content
-                elif hasattr(turn, 'tool_calls') and turn.tool_calls: # Handle tool calls
-                    role = "tool_calls"
-                    content = str(turn.tool_calls) # Convert tool_calls to string for logging
-                
-                log_message += f"\n- ROLE: {role}"
-                # Truncate content for readability in logs
-                truncated_content = (content[:200] + '...') if content and len(content) > 200 else content
-                log_message += f"\n  CONTENT: {truncated_content}"
-            logger.debug(log_message, extra=log_extra)
-            response_message = llm_provider.generate_response(
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"Prompt de seguimiento enviado al LLM (después de herramienta):{_format_api_history(api_history)}", extra=log_extra)
+            response_message = await llm_provider.agenerate_response(
                 prompt=None, history=api_history, tools=tools, **api_call_params
             )
 
         final_response_text = response_message.content if response_message else "No se recibió respuesta del LLM."
+        return final_response_text, bool(response_message) and not used_tools
 
-        # --- FASE 4: PERSISTENCIA ---
-        user_turn_id = f"{session_id}_{uuid.uuid4()}"
-        assistant_turn_id = f"{session_id}_{uuid.uuid4()}"
-        self.context_engine.save_turn(session_id, user_prompt, final_response_text, user_turn_id, assistant_turn_id, trace_id, entities)
+    async def _run_tool_calls(self, response_message, api_history: List[Dict[str, Any]], trace_id: str):
+        """Añade al historial el mensaje del asistente con sus `tool_calls` y los resultados de cada herramienta."""
+        # Sin los campos nulos (refusal, audio, function_call...), que solo engordan el historial reenviado.
+        api_history.append(response_message.model_dump(exclude_none=True))
 
-        # --- FASE 5: RESUMEN ASÍNCRONO ---
-        turn_count = self.context_engine.redis_manager.client.llen(self.context_engine.redis_manager._get_session_key(session_id))
-        if turn_count > 10:
-            logger.info(f"Umbral de resumen alcanzado (Turno {turn_count}). Disparando tarea de fondo.", extra=log_extra)
-            background_tasks.add_task(self._summarize_and_update_mid_term_memory, session_id, trace_id)
-
-        execution_time = (time.time() - start_time) * 1000
-        logger.info(f"Petición manejada exitosamente en {execution_time:.2f} ms.", extra=log_extra)
-        return {"response": final_response_text}
+        # Las llamadas a herramientas de un mismo turno se ejecutan en paralelo; sus resultados
+        # se añaden al historial en el orden original.
+        tool_messages = await asyncio.gather(
+            *(self._run_tool(tool_call, trace_id) for tool_call in response_message.tool_calls)
+        )
+        api_history.extend(message for message in tool_messages if message)
 
-    # CORRECCIÓN: Modificar la firma de la función para aceptar la instancia del proveedor
-    def _summarize_and_update_mid_term_memory(self, session_id: str, trace_id: str):
-        """[TAREA EN SEGUNDO PLANO] Genera un resumen de los turnos más antiguos y los poda de Redis."""
+    async def _run_tool(self, tool_call, trace_id: str) -> Optional[Dict[str, Any]]:
+        """Ejecuta una llamada a herramienta en un hilo y devuelve el mensaje 'tool' para el historial."""
         log_extra = {'trace_id': trace_id}
-        logger.info("Iniciando proceso de resumen rodante para la memoria a medio plazo.", extra=log_extra)
-
-        # 1. Obtener todo el historial
-        all_turns = self.context_engine.redis_manager.get_recent_turns(session_id, num_turns=0, trace_id=trace_id) # num_turns=0 para obtener todo
-        
-        num_turns_to_summarize = len(all_turns) - 10
-        if num_turns_to_summarize <= 0:
-            logger.info("No hay suficientes turnos para resumir.", extra=log_extra)
-            return
+        function_name = tool_call.function.name
+        try:
+            arguments = orjson.loads(tool_call.function.arguments)
+        except orjson.JSONDecodeError:
+            logger.error(f"Error al decodificar argumentos JSON para '{function_name}'.", extra=log_extra)
+            arguments = {}
 
-        # 2. Seleccionar los turnos a resumir
-        turns_to_summarize = all_turns[:num_turns_to_summarize]
-        
-        # 3. Crear el resumen
-        conversation_text = "\n".join([f"{turn['role']}: {turn['content']}" for turn in turns_to_summarize])
-        previous_summary = self.context_engine.sqlite_manager.get_summary(session_id, trace_id)
-        previous_summary_text = f"Resumen anterior: {previous_summary[0]}" if previous_summary else "Este es el primer resumen de la conversación."
+        plugin_name = self.context_engine.plugin_manager.find_plugin_for_tool(function_name)
 
-        summarization_prompt = f"{previous_summary_text}\n\nBasándote en el resumen anterior y el siguiente extracto de la conversación reciente, actualiza el resumen de forma concisa, capturando solo la información o conclusiones clave en una o dos frases.\n\nConversación Reciente:\n{conversation_text}\n\nResumen actualizado y conciso:"
+        if not plugin_name:
+            logger.error(f"No se encontró plugin para la herramienta '{function_name}'.", extra=log_extra)
+            return None
 
-        provider = self.api_manager.get_provider("openai", model="gpt-3.5-turbo", trace_id=trace_id)
-        if not provider:
-            logger.error("No se pudo obtener el proveedor de OpenAI para el resumen de medio plazo.", extra=log_extra)
-            return
+        logger.info(f"Ejecutando herramienta: '{plugin_name}.{function_name}'.", extra={'trace_id': trace_id, 'data': arguments})
+        # `to_thread` copia el contexto actual, así el plugin ve el trace_id de esta petición.
+        current_trace_id.set(trace_id)
+        tool_result = await asyncio.to_thread(
+            self.context_engine.plugin_manager.execute_tool,
+            plugin_name=plugin_name, tool_name=function_name, **arguments
+        )
+        logger.info(f"Resultado de la herramienta: {tool_result}", extra=log_extra)
 
-        try:
-            summary_response = provider.generate_response(
-                prompt=summarization_prompt, history=[], tools=[], temperature=0.2, max_tokens=250
-            )
-            summary_text = summary_response.content.strip()
-            
-            # 4. Actualizar el resumen en SQLite
-            self.context_engine.sqlite_manager.update_summary(session_id, summary_text, len(all_turns), trace_id)
-            logger.info(f"Memoria a medio plazo (SQLite) actualizada con nuevo resumen.", extra={'trace_id': trace_id, 'data': {'summary': summary_text}})
+        return {"tool_call_id": tool_call.id, "role": "tool", "name": function_name, "content": orjson.dumps(tool_result).decode()}
 
-            # 5. Podar el historial de Redis
-            self.context_engine.redis_manager.trim_history(session_id, 10, trace_id)
+    def _summarize_and_update_mid_term_memory(self, session_id: str, trace_id: str):
+        """[TAREA EN SEGUNDO PLANO] Genera un resumen de los turnos más antiguos y los poda de Redis."""
+        summarize_session(self.context_engine.redis_manager, self.context_engine.sqlite_manager, self.api_manager, session_id, trace_id)
 
+    async def _enqueue_summary(self, session_id: str, trace_id: str):
+        """[TAREA EN SEGUNDO PLANO] Encola el resumen de la sesión para el worker de arq."""
+        log_extra = {'trace_id': trace_id}
+        try:
+            if self._summary_queue is None:
+                # arq (y la configuración del worker) solo se importan si se usa este backend.
+                from arq import create_pool
+                from .worker import ARQ_REDIS_SETTINGS
+                self._summary_queue = await create_pool(ARQ_REDIS_SETTINGS)
+            # Con un _job_id por sesión, arq descarta el trabajo si ya hay un resumen pendiente de esa sesión.
+            await self._summary_queue.enqueue_job("summarize_session_job", session_id, trace_id, _job_id=f"summary:{session_id}")
+            logger.info("Resumen de la sesión encolado para el worker.", extra=log_extra)
         except Exception:
-            logger.exception("Ocurrió un error durante el proceso de resumen en segundo plano.", extra=log_extra)
+            logger.exception("No se pudo encolar el resumen; se ejecuta en este proceso.", extra=log_extra)
+            await asyncio.to_thread(self._summarize_and_update_mid_term_memory, session_id, trace_id)
+
+    async def close(self):
+        """Cierra la cola de resúmenes y las conexiones del motor de contexto."""
+        if self._summary_queue is not None:
+            await self._summary_queue.close()
+            self._summary_queue = None
+        await self.context_engine.close()
 
-    def delete_session_data(self, session_id: str) -> bool:
+    async def delete_session_data(self, session_id: str) -> bool:
         trace_id = str(uuid.uuid4())
         log_extra = {'trace_id': trace_id}
         logger.info(f"Iniciando eliminación de datos para la sesión {session_id}.", extra=log_extra)
         try:
-            self.context_engine.sqlite_manager.delete_session(session_id, trace_id)
-            self.context_engine.redis_manager.delete_session_history(session_id, trace_id)
-            self.context_engine.chroma_manager.delete_session_entries(session_id, trace_id)
+            # Los borrados en cada capa de memoria son independientes: se lanzan a la vez y la
+            # latencia total es la del más lento.
+            deletions = [
+                asyncio.to_thread(self.context_engine.sqlite_manager.delete_session, session_id, trace_id),
+                asyncio.to_thread(self.context_engine.redis_manager.delete_session_history, session_id, trace_id),
+                asyncio.to_thread(self.context_engine.chroma_manager.delete_session_entries, session_id, trace_id)
+            ]
             if self.context_engine.neo4j_manager:
-                self.context_engine.neo4j_manager.delete_session_graph(session_id, trace_id)
+                deletions.append(self.context_engine.neo4j_manager.delete_session_graph(session_id, trace_id))
+            await asyncio.gather(*deletions)
+            self.context_engine.invalidate_context_cache(session_id)
             logger.info(f"Borrado de sesión {session_id} completado.", extra=log_extra)
             return True
         except Exception as e:
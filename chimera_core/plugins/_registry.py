@@ -0,0 +1,8 @@
+# Archivo generado por `python -m chimera_core.plugins.generate_registry`. No editar a mano.
+# (ruta del módulo, nombre de la clase) de cada plugin MCP, en orden de carga.
+
+PLUGIN_CLASSES = [
+    ("chimera_core.plugins.email_client_plugin", "EmailClientPlugin"),
+    ("chimera_core.plugins.file_system_plugin", "FileSystemPlugin"),
+    ("chimera_core.plugins.knowledge_base_plugin", "KnowledgeBasePlugin"),
+]
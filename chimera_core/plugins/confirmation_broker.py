@@ -0,0 +1,72 @@
+import asyncio
+import uuid
+import contextvars
+from typing import Dict, Any, List, Optional, Tuple
+
+from ..utils.logger import logger
+
+# trace_id de la petición en curso. `asyncio.to_thread` copia el contexto al hilo de trabajo,
+# así que los plugins (síncronos) pueden leerlo sin que se les pase explícitamente.
+current_trace_id: contextvars.ContextVar[str] = contextvars.ContextVar("current_trace_id", default="N/A")
+
+class ConfirmationBroker:
+    """
+    Canal de confirmaciones humanas para las herramientas con efectos externos.
+
+    Cada confirmación pendiente es un `asyncio.Future` en el bucle de eventos del servidor. El
+    plugin que la solicita espera su resolución sin bloquear el bucle, y un endpoint HTTP la
+    resuelve cuando el usuario acepta o rechaza la acción.
+    """
+
+    def __init__(self):
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._pending: Dict[str, Tuple[asyncio.Future, Dict[str, Any]]] = {}
+
+    def bind_loop(self, loop: asyncio.AbstractEventLoop):
+        """Asocia el broker al bucle de eventos del servidor (se llama en el arranque)."""
+        self._loop = loop
+
+    async def wait(self, confirmation_id: str, details: Dict[str, Any], timeout: float) -> bool:
+        """Registra una confirmación pendiente y espera su resolución. Expirar equivale a rechazar."""
+        future = asyncio.get_running_loop().create_future()
+        self._pending[confirmation_id] = (future, details)
+        try:
+            return await asyncio.wait_for(future, timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"La confirmación {confirmation_id} ha expirado tras {timeout}s.", extra={'trace_id': details.get('trace_id', 'N/A')})
+            return False
+        finally:
+            self._pending.pop(confirmation_id, None)
+
+    def request_confirmation(self, action: str, details: Dict[str, Any], timeout: float) -> bool:
+        """
+        Punto de entrada para los plugins, que se ejecutan en un hilo de trabajo: publica la
+        confirmación en el bucle del servidor y bloquea solo ese hilo hasta que se resuelve.
+        """
+        trace_id = current_trace_id.get()
+        if self._loop is None or not self._loop.is_running():
+            logger.warning(f"No hay bucle de eventos para confirmar '{action}'. Acción rechazada.", extra={'trace_id': trace_id})
+            return False
+
+        confirmation_id = str(uuid.uuid4())
+        payload = {"confirmation_id": confirmation_id, "trace_id": trace_id, "action": action, **details}
+        logger.info(f"Confirmación pendiente para '{action}'.", extra={'trace_id': trace_id, 'data': {'confirmation_id': confirmation_id}})
+        return asyncio.run_coroutine_threadsafe(self.wait(confirmation_id, payload, timeout), self._loop).result()
+
+    def resolve(self, confirmation_id: str, approved: bool) -> bool:
+        """Resuelve una confirmación pendiente. Devuelve False si no existe o ya se había resuelto."""
+        entry = self._pending.get(confirmation_id)
+        if entry is None or entry[0].done():
+            return False
+        entry[0].set_result(approved)
+        return True
+
+    def list_pending(self, trace_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Devuelve las confirmaciones pendientes, opcionalmente filtradas por trace_id."""
+        return [
+            details for future, details in self._pending.values()
+            if not future.done() and (trace_id is None or details["trace_id"] == trace_id)
+        ]
+
+# Instancia compartida por los plugins y los endpoints del servidor.
+confirmation_broker = ConfirmationBroker()
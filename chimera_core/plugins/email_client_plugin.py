@@ -3,9 +3,11 @@ import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 import re
-from typing import Dict, Any, List
+import threading
+from typing import Dict, Any, List, Optional
 
 from .mcp_base import MCPPlugin, ToolSignature
+from .confirmation_broker import confirmation_broker
 
 # --- Configuración de Credenciales (desde .env) ---
 SMTP_SERVER = os.getenv("SMTP_SERVER")
@@ -13,6 +15,7 @@ SMTP_PORT = int(os.getenv("SMTP_PORT", 587)) # Puerto estándar para TLS
 SMTP_USERNAME = os.getenv("SMTP_USERNAME")
 SMTP_PASSWORD = os.getenv("SMTP_PASSWORD") # O token de aplicación
 SENDER_EMAIL = os.getenv("SENDER_EMAIL")
+CONFIRMATION_TIMEOUT = float(os.getenv("EMAIL_CONFIRMATION_TIMEOUT", 60)) # Segundos que se espera la confirmación del usuario
 
 # --- Lista Blanca de Destinatarios (REGEX) ---
 # Define aquí los patrones REGEX de las direcciones de correo permitidas.
@@ -24,6 +27,9 @@ ALLOWED_RECIPIENT_PATTERNS = [
     #r"tu\.correo@gmail\.com$", # Permite tu correo personal
     #r"rasparecords@gmail\\.com$"
 ]
+# Todos los patrones se compilan una sola vez en una única expresión alternativa,
+# de modo que cada envío se valida con una sola llamada al motor de regex.
+_ALLOWED_RE = re.compile("|".join(f"(?:{pattern})" for pattern in ALLOWED_RECIPIENT_PATTERNS)) if ALLOWED_RECIPIENT_PATTERNS else None
 
 class EmailClientPlugin(MCPPlugin):
     """
@@ -31,6 +37,48 @@ class EmailClientPlugin(MCPPlugin):
     a destinatarios pre-aprobados.
     """
 
+    def __init__(self):
+        super().__init__()
+        # Conexión SMTP persistente: STARTTLS y LOGIN se hacen una vez y se reutilizan entre envíos.
+        # El lock serializa los envíos, ya que una sesión SMTP no admite comandos concurrentes.
+        self._smtp: Optional[smtplib.SMTP] = None
+        self._smtp_lock = threading.Lock()
+
+    def _connect_smtp(self) -> smtplib.SMTP:
+        server = smtplib.SMTP(SMTP_SERVER, SMTP_PORT)
+        server.starttls() # Habilitar seguridad TLS
+        server.login(SMTP_USERNAME, SMTP_PASSWORD)
+        return server
+
+    def _close_smtp(self):
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            self._smtp = None
+
+    def _get_smtp(self) -> smtplib.SMTP:
+        """Devuelve la conexión SMTP abierta si sigue viva (NOOP) o abre una nueva."""
+        if self._smtp is not None:
+            try:
+                if self._smtp.noop()[0] == 250:
+                    return self._smtp
+            except (smtplib.SMTPException, OSError):
+                pass
+            self._close_smtp()
+        self._smtp = self._connect_smtp()
+        return self._smtp
+
+    def _send_message(self, msg: MIMEMultipart):
+        with self._smtp_lock:
+            try:
+                self._get_smtp().send_message(msg)
+            except smtplib.SMTPServerDisconnected:
+                # El servidor cerró la sesión entre el NOOP y el envío: se reintenta una vez.
+                self._close_smtp()
+                self._get_smtp().send_message(msg)
+
     @property
     def name(self) -> str:
         return "email_client"
@@ -56,10 +104,9 @@ class EmailClientPlugin(MCPPlugin):
         """
         Verifica si la dirección de correo electrónico del destinatario está en la lista blanca.
         """
-        for pattern in ALLOWED_RECIPIENT_PATTERNS:
-            if re.match(pattern, recipient_email):
-                return True
-        return False
+        if _ALLOWED_RE is None:
+            return False
+        return bool(_ALLOWED_RE.match(recipient_email))
 
     def execute(self, tool_name: str, **kwargs) -> Dict[str, Any]:
         if tool_name == "send_email":
@@ -73,13 +120,15 @@ class EmailClientPlugin(MCPPlugin):
             if not self._is_recipient_allowed(to_email):
                 return {"status": "error", "error_message": f"Destinatario '{to_email}' no autorizado. No está en la lista blanca de patrones permitidos."}
 
-            # --- Mecanismo de Confirmación (Temporal en Consola) ---
-            print(f"\n--- CONFIRMACIÓN DE ENVÍO DE CORREO ---")
-            print(f"A: {to_email}")
-            print(f"Asunto: {subject}")
-            print(f"Cuerpo: {body[:100]}... (truncado)")
-            confirm = input("¿Deseas enviar este correo electrónico? (s/n): ").lower().strip()
-            if confirm != 's':
+            # --- Mecanismo de Confirmación ---
+            # La confirmación se publica en GET /v1/confirmations y se resuelve desde
+            # POST /v1/confirmations/{id}; si no llega a tiempo, el envío se cancela.
+            approved = confirmation_broker.request_confirmation(
+                action="send_email",
+                details={"to": to_email, "subject": subject, "body_preview": body[:100]},
+                timeout=CONFIRMATION_TIMEOUT
+            )
+            if not approved:
                 return {"status": "cancelled", "result": "Envío de correo cancelado por el usuario."}
             # --- Fin Mecanismo de Confirmación ---
 
@@ -90,10 +139,7 @@ class EmailClientPlugin(MCPPlugin):
                 msg['Subject'] = subject
                 msg.attach(MIMEText(body, 'plain'))
 
-                with smtplib.SMTP(SMTP_SERVER, SMTP_PORT) as server:
-                    server.starttls() # Habilitar seguridad TLS
-                    server.login(SMTP_USERNAME, SMTP_PASSWORD)
-                    server.send_message(msg)
+                self._send_message(msg)
                 
                 return {"status": "success", "result": f"Correo electrónico enviado exitosamente a {to_email}."}
             except Exception as e:
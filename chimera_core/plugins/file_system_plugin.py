@@ -1,16 +1,26 @@
 import os
-from typing import Dict, Any, List
+import functools
+from pathlib import PurePath
+from typing import Dict, Any, List, Optional
 
 from .mcp_base import MCPPlugin, ToolSignature
 
 # Por seguridad, restringimos todas las operaciones a la raíz del proyecto.
 # Esto previene que el LLM pueda acceder a archivos fuera de su directorio de trabajo.
 PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+_PROJECT_ROOT_PATH = PurePath(PROJECT_ROOT)
+# Tamaño máximo que `read_file` devuelve al LLM. Limita la memoria, los tokens y el coste
+# de la petición aunque el modelo intente leer un archivo enorme (p. ej. un log).
+READ_FILE_MAX_BYTES = 64 * 1024
 
-def _is_safe_path(path: str) -> bool:
-    """Comprueba que la ruta solicitada está dentro del directorio del proyecto."""
+@functools.lru_cache(maxsize=1024)
+def _resolve_safe(path: str) -> Optional[str]:
+    """
+    Devuelve la ruta absoluta solicitada si está dentro del directorio del proyecto, o None si no.
+    La resolución es puramente textual y PROJECT_ROOT no cambia, así que el resultado se cachea.
+    """
     requested_path = os.path.abspath(os.path.join(PROJECT_ROOT, path))
-    return os.path.commonpath([requested_path, PROJECT_ROOT]) == PROJECT_ROOT
+    return requested_path if PurePath(requested_path).is_relative_to(_PROJECT_ROOT_PATH) else None
 
 class FileSystemPlugin(MCPPlugin):
     """
@@ -41,7 +51,8 @@ class FileSystemPlugin(MCPPlugin):
                 parameters={
                     "type": "object",
                     "properties": {
-                        "path": {"type": "string", "description": "La ruta del archivo a leer."}
+                        "path": {"type": "string", "description": "La ruta del archivo a leer."},
+                        "max_bytes": {"type": "integer", "description": f"Número máximo de bytes a leer (como máximo {READ_FILE_MAX_BYTES}).", "default": READ_FILE_MAX_BYTES}
                     },
                     "required": ["path"]
                 }
@@ -51,11 +62,10 @@ class FileSystemPlugin(MCPPlugin):
     def execute(self, tool_name: str, **kwargs) -> Dict[str, Any]:
         path = kwargs.get("path", ".")
 
-        if not _is_safe_path(path):
+        full_path = _resolve_safe(path)
+        if full_path is None:
             return {"status": "error", "error_message": f"Acceso denegado. La ruta '{path}' está fuera del directorio del proyecto."}
 
-        full_path = os.path.join(PROJECT_ROOT, path)
-
         try:
             if tool_name == "list_directory":
                 if not os.path.isdir(full_path):
@@ -68,8 +78,15 @@ class FileSystemPlugin(MCPPlugin):
                 if not os.path.isfile(full_path):
                     return {"status": "error", "error_message": f"El archivo '{path}' no se encontró."}
                 
-                with open(full_path, 'r', encoding='utf-8') as f:
-                    content = f.read()
+                max_bytes = max(1, min(int(kwargs.get("max_bytes", READ_FILE_MAX_BYTES)), READ_FILE_MAX_BYTES))
+                file_size = os.path.getsize(full_path)
+                # Se lee directamente sobre un búfer preasignado del tamaño justo y se decodifica una sola vez.
+                buffer = bytearray(min(file_size, max_bytes))
+                with open(full_path, 'rb', buffering=0) as f:
+                    bytes_read = f.readinto(buffer)
+                content = buffer[:bytes_read].decode('utf-8', errors='replace')
+                if file_size > bytes_read:
+                    content += f"\n[... archivo truncado: se muestran {bytes_read} de {file_size} bytes ...]"
                 return {"status": "success", "result": content}
 
             else:
@@ -0,0 +1,48 @@
+"""
+Genera `chimera_core/plugins/_registry.py`, el registro estático de plugins.
+
+El PluginManager lee este registro al arrancar en lugar de escanear el directorio e
+inspeccionar cada módulo. Hay que volver a generarlo al añadir, renombrar o eliminar un plugin:
+
+    python -m chimera_core.plugins.generate_registry
+"""
+
+import os
+import importlib
+import inspect
+
+from .mcp_base import MCPPlugin
+
+PLUGIN_DIR = os.path.dirname(os.path.abspath(__file__))
+PLUGIN_PACKAGE = "chimera_core.plugins"
+REGISTRY_PATH = os.path.join(PLUGIN_DIR, "_registry.py")
+
+REGISTRY_HEADER = '''# Archivo generado por `python -m chimera_core.plugins.generate_registry`. No editar a mano.
+# (ruta del módulo, nombre de la clase) de cada plugin MCP, en orden de carga.
+
+PLUGIN_CLASSES = [
+'''
+
+def discover_plugin_classes():
+    """Devuelve (ruta del módulo, nombre de la clase) de cada subclase de MCPPlugin definida en los `*_plugin.py`."""
+    plugin_classes = []
+    for filename in sorted(os.listdir(PLUGIN_DIR)):
+        if filename.endswith("_plugin.py") and not filename.startswith("__"):
+            module_path = f"{PLUGIN_PACKAGE}.{filename[:-3]}"
+            module = importlib.import_module(module_path)
+            for name, cls in inspect.getmembers(module, inspect.isclass):
+                if issubclass(cls, MCPPlugin) and cls is not MCPPlugin and cls.__module__ == module_path:
+                    plugin_classes.append((module_path, name))
+    return plugin_classes
+
+def write_registry(plugin_classes):
+    lines = [REGISTRY_HEADER]
+    lines.extend(f'    ("{module_path}", "{class_name}"),\n' for module_path, class_name in plugin_classes)
+    lines.append("]\n")
+    with open(REGISTRY_PATH, "w", encoding="utf-8") as f:
+        f.write("".join(lines))
+
+if __name__ == "__main__":
+    plugin_classes = discover_plugin_classes()
+    write_registry(plugin_classes)
+    print(f"Registro de plugins generado en {REGISTRY_PATH} ({len(plugin_classes)} plugins).")
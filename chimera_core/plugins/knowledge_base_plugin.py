@@ -1,5 +1,9 @@
 import chromadb
+import threading
+import time
+import numpy as np
 from typing import Dict, Any, List
+from chromadb.api.types import Documents, EmbeddingFunction, Embeddings
 from chromadb.utils import embedding_functions
 import os
 
@@ -12,6 +16,87 @@ EMBEDDING_MODEL_NAME = "all-MiniLM-L6-v2"
 # Debe ser la misma que en el script de ingesta.
 CHROMA_DB_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'chroma_data', 'knowledge_base_db'))
 
+# Directorio con MiniLM exportado a ONNX y cuantizado a INT8. Si no se define, se usa el
+# modelo FP32 de sentence-transformers. Para generarlo:
+#   optimum-cli export onnx --model sentence-transformers/all-MiniLM-L6-v2 --task feature-extraction minilm_onnx/
+#   optimum-cli onnxruntime quantize --onnx_model minilm_onnx/ --avx512_vnni -o minilm_onnx_int8/
+ONNX_MODEL_DIR = os.getenv("KB_ONNX_MODEL_DIR")
+ONNX_MODEL_FILE = os.getenv("KB_ONNX_MODEL_FILE", "model_quantized.onnx")
+ONNX_MAX_LENGTH = 256 # Longitud máxima de secuencia de all-MiniLM-L6-v2
+
+QUERY_BATCH_WINDOW = 0.005 # Segundos que se esperan otras consultas concurrentes para agruparlas
+
+class ORTEmbeddingFunction(EmbeddingFunction):
+    """
+    Función de embedding de ChromaDB sobre un MiniLM cuantizado a INT8 con ONNX Runtime.
+
+    Reproduce la cabeza de sentence-transformers (mean pooling + normalización L2), por lo que
+    sus vectores son compatibles con los de las colecciones creadas con el modelo FP32.
+    """
+
+    def __init__(self, model_dir: str, model_file: str = ONNX_MODEL_FILE):
+        # Solo se importan si se configura KB_ONNX_MODEL_DIR: sin él, el plugin no carga ONNX Runtime.
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(os.path.join(model_dir, model_file), options, providers=["CPUExecutionProvider"])
+        self._input_names = [model_input.name for model_input in self.session.get_inputs()]
+
+    def __call__(self, input: Documents) -> Embeddings:
+        encoded = self.tokenizer(list(input), padding=True, truncation=True, max_length=ONNX_MAX_LENGTH, return_tensors="np")
+        feeds = {name: encoded[name].astype(np.int64) for name in self._input_names}
+        token_embeddings = self.session.run(None, feeds)[0]
+
+        mask = encoded["attention_mask"][..., None].astype(np.float32)
+        pooled = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+        return pooled.tolist()
+
+class _QueryBatcher:
+    """
+    Agrupa las consultas que llegan casi a la vez (p. ej. varias llamadas a la herramienta en
+    un mismo turno) en una única llamada a `collection.query`, de modo que el modelo de
+    embeddings y la búsqueda HNSW procesan todas las consultas en una sola pasada.
+
+    El primer hilo de cada lote actúa como líder: espera `QUERY_BATCH_WINDOW` segundos,
+    recoge las consultas pendientes, lanza la búsqueda y reparte los resultados.
+    """
+
+    def __init__(self, query_fn):
+        self._query_fn = query_fn
+        self._lock = threading.Lock()
+        self._pending: List[tuple] = []
+
+    def query(self, query_text: str, n_results: int) -> List[str]:
+        slot = {"done": threading.Event()}
+        with self._lock:
+            self._pending.append((query_text, n_results, slot))
+            is_leader = len(self._pending) == 1
+
+        if is_leader:
+            time.sleep(QUERY_BATCH_WINDOW)
+            with self._lock:
+                batch, self._pending = self._pending, []
+            try:
+                # Se pide el mayor n_results del lote y cada consulta se recorta al suyo.
+                results = self._query_fn([text for text, _, _ in batch], max(n for _, n, _ in batch))
+                for documents, (_, n, batch_slot) in zip(results['documents'], batch):
+                    batch_slot["result"] = documents[:n]
+            except Exception as e:
+                for _, _, batch_slot in batch:
+                    batch_slot["error"] = e
+            finally:
+                for _, _, batch_slot in batch:
+                    batch_slot["done"].set()
+
+        slot["done"].wait()
+        if "error" in slot:
+            raise slot["error"]
+        return slot["result"]
+
 class KnowledgeBasePlugin(MCPPlugin):
     """
     Un plugin que proporciona herramientas para interactuar con una base de conocimiento
@@ -20,20 +105,37 @@ class KnowledgeBasePlugin(MCPPlugin):
 
     def __init__(self):
         super().__init__()
-        # Ahora usamos un cliente persistente de ChromaDB
-        self.chroma_client = chromadb.PersistentClient(path=CHROMA_DB_PATH)
-        
-        # Crear la función de embedding, asegurando que es la misma que en la ingesta
-        embedding_function = embedding_functions.SentenceTransformerEmbeddingFunction(
-            model_name=EMBEDDING_MODEL_NAME
-        )
-        
-        # Pasar la función de embedding al obtener o crear la colección
-        self.knowledge_base = self.chroma_client.get_or_create_collection(
-            name=KNOWLEDGE_BASE_COLLECTION_NAME,
-            embedding_function=embedding_function
+        # El cliente de ChromaDB y el modelo de embedding se crean en la primera consulta:
+        # cargar el modelo es lo más costoso del arranque y muchas sesiones nunca usan esta herramienta.
+        self._knowledge_base = None
+        self._init_lock = threading.Lock()
+        self._batcher = _QueryBatcher(
+            lambda query_texts, n_results: self._get_knowledge_base().query(query_texts=query_texts, n_results=n_results)
         )
-        print(f"Plugin de Base de Conocimiento conectado a la colección '{KNOWLEDGE_BASE_COLLECTION_NAME}' con el modelo de embedding correcto y persistencia en {CHROMA_DB_PATH}.")
+
+    def _get_knowledge_base(self):
+        """Devuelve la colección de la base de conocimiento, conectándose a ella la primera vez."""
+        if self._knowledge_base is None:
+            with self._init_lock:
+                if self._knowledge_base is None:
+                    # Ahora usamos un cliente persistente de ChromaDB
+                    chroma_client = chromadb.PersistentClient(path=CHROMA_DB_PATH)
+
+                    # Crear la función de embedding, asegurando que es la misma que en la ingesta
+                    if ONNX_MODEL_DIR:
+                        embedding_function = ORTEmbeddingFunction(ONNX_MODEL_DIR)
+                    else:
+                        embedding_function = embedding_functions.SentenceTransformerEmbeddingFunction(
+                            model_name=EMBEDDING_MODEL_NAME
+                        )
+
+                    # Pasar la función de embedding al obtener o crear la colección
+                    self._knowledge_base = chroma_client.get_or_create_collection(
+                        name=KNOWLEDGE_BASE_COLLECTION_NAME,
+                        embedding_function=embedding_function
+                    )
+                    print(f"Plugin de Base de Conocimiento conectado a la colección '{KNOWLEDGE_BASE_COLLECTION_NAME}' con el modelo de embedding correcto y persistencia en {CHROMA_DB_PATH}.")
+        return self._knowledge_base
 
     @property
     def name(self) -> str:
@@ -64,12 +166,9 @@ class KnowledgeBasePlugin(MCPPlugin):
                 return {"status": "error", "error_message": "Se requiere un 'query' para buscar en la base de conocimiento."}
 
             try:
-                results = self.knowledge_base.query(
-                    query_texts=[query],
-                    n_results=n_results
-                )
+                documents = self._batcher.query(query, int(n_results))
                 # Devolvemos los documentos encontrados, que es lo que el LLM necesita.
-                return {"status": "success", "result": results['documents'][0]}
+                return {"status": "success", "result": documents}
             except Exception as e:
                 return {"status": "error", "error_message": f"Ocurrió un error al consultar la base de conocimiento: {e}"}
         else:
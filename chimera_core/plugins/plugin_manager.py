@@ -1,23 +1,72 @@
 import os
+import sys
 import importlib
 import inspect
 from typing import Dict, Any, List
 
 from .mcp_base import MCPPlugin, ToolSignature
 
+DEFAULT_PLUGIN_DIR = "chimera_core/plugins"
+
 class PluginManager:
     """
     Descubre, carga y gestiona todos los plugins MCP disponibles.
 
+    Al arrancar usa el registro generado por `generate_registry.py`; si no existe,
+    escanea el directorio de plugins.
+
     Actúa como un registro central para todas las herramientas que Quimera puede usar,
     y como el punto de entrada para ejecutar cualquier acción.
     """
 
-    def __init__(self, plugin_dir: str = "chimera_core/plugins"):
+    def __init__(self, plugin_dir: str = DEFAULT_PLUGIN_DIR):
         self.plugins: Dict[str, MCPPlugin] = {}
-        self._load_plugins(plugin_dir)
+        # Índices construidos al cargar los plugins para no regenerar las firmas en cada llamada
+        self._tool_to_plugin: Dict[str, str] = {}
+        self._all_tools_cache: List[ToolSignature] = []
+        self.plugin_dir = plugin_dir
+        if not (plugin_dir == DEFAULT_PLUGIN_DIR and self._load_registered_plugins()):
+            self._load_plugins(plugin_dir)
+
+    def reload_plugins(self):
+        """
+        Vuelve a escanear el directorio de plugins, recargando los módulos ya importados
+        para recoger cambios en sus herramientas. A diferencia del arranque, no usa el registro
+        estático, así que también detecta plugins añadidos después de generarlo.
+        """
+        self.plugins = {}
+        self._tool_to_plugin = {}
+        self._all_tools_cache = []
+        self._load_plugins(self.plugin_dir, reload_modules=True)
+
+    def _register_plugin(self, plugin_instance: MCPPlugin):
+        self.plugins[plugin_instance.name] = plugin_instance
+        for tool in plugin_instance.get_tools():
+            self._tool_to_plugin[tool.name] = plugin_instance.name
+            self._all_tools_cache.append(tool)
+        print(f"  - Plugin '{plugin_instance.name}' cargado exitosamente.")
+
+    def _load_registered_plugins(self) -> bool:
+        """
+        Carga los plugins listados en el registro estático (`_registry.py`), sin escanear el
+        directorio ni inspeccionar los módulos. Devuelve False si el registro no existe.
+        """
+        try:
+            from ._registry import PLUGIN_CLASSES
+        except ImportError:
+            return False
+
+        print("--- PluginManager: Cargando plugins desde el registro... ---")
+        for module_path, class_name in PLUGIN_CLASSES:
+            try:
+                module = importlib.import_module(module_path)
+                self._register_plugin(getattr(module, class_name)())
+            except Exception as e:
+                print(f"Error al cargar el plugin {module_path}.{class_name}: {e}")
+        print("--- Carga de plugins finalizada. ---")
+        return True
 
-    def _load_plugins(self, plugin_dir: str):
+    def _load_plugins(self, plugin_dir: str, reload_modules: bool = False):
         """
         Escanea un directorio, importa dinámicamente los módulos de plugins,
         y los registra.
@@ -28,24 +77,23 @@ class PluginManager:
                 module_name = filename[:-3]
                 module_path = f"{plugin_dir.replace('/', '.')}.{module_name}"
                 try:
-                    module = importlib.import_module(module_path)
+                    if reload_modules and module_path in sys.modules:
+                        module = importlib.reload(sys.modules[module_path])
+                    else:
+                        module = importlib.import_module(module_path)
                     for name, cls in inspect.getmembers(module, inspect.isclass):
                         if issubclass(cls, MCPPlugin) and cls is not MCPPlugin:
-                            plugin_instance = cls()
-                            self.plugins[plugin_instance.name] = plugin_instance
-                            print(f"  - Plugin '{plugin_instance.name}' cargado exitosamente.")
+                            self._register_plugin(cls())
                 except Exception as e:
                     print(f"Error al cargar el plugin {module_name}: {e}")
         print("--- Carga de plugins finalizada. ---")
 
     def get_all_tools(self) -> List[ToolSignature]:
         """
-        Recopila y devuelve las firmas de todas las herramientas de todos los plugins cargados.
+        Devuelve las firmas de todas las herramientas de todos los plugins cargados,
+        recopiladas una sola vez durante la carga.
         """
-        all_tools = []
-        for plugin in self.plugins.values():
-            all_tools.extend(plugin.get_tools())
-        return all_tools
+        return list(self._all_tools_cache)
 
     def execute_tool(self, plugin_name: str, tool_name: str, **kwargs) -> Dict[str, Any]:
         """
@@ -64,8 +112,4 @@ class PluginManager:
         """
         Encuentra el nombre del plugin que posee una herramienta específica.
         """
-        for plugin_name, plugin in self.plugins.items():
-            for tool in plugin.get_tools():
-                if tool.name == tool_name:
-                    return plugin_name
-        return None
+        return self._tool_to_plugin.get(tool_name)
@@ -1,88 +1,113 @@
 
-import pkgutil
+import os
+import time
 import importlib
-from typing import Dict, Type, Optional, List
+from typing import Dict, Type, Optional, List, Tuple
 
 from .base_provider import BaseProvider
 from ..utils.logger import logger
 
+# Registro estático de proveedores: nombre -> módulo relativo. El módulo de cada proveedor
+# (y con él su SDK) solo se importa la primera vez que se pide ese proveedor; al importarse,
+# su clase se registra sola en BaseProvider por su PROVIDER_NAME.
+# Al añadir un proveedor nuevo hay que registrar aquí su módulo con ese mismo nombre.
+PROVIDER_REGISTRY: Dict[str, str] = {
+    "openai": ".openai_provider",
+    "gemini": ".gemini_provider",
+}
+
+MODELS_CACHE_TTL = int(os.getenv("MODELS_CACHE_TTL", 300)) # Segundos que se reutiliza la lista de modelos de cada proveedor
+
 class ApiManager:
     """
     Gestiona la detección, carga y selección de los proveedores de LLM disponibles.
 
-    Actúa como una fábrica que descubre dinámicamente los proveedores (clases que
-    heredan de BaseProvider) ubicados en el mismo directorio, permitiendo que el
-    sistema sea extensible sin necesidad de modificar el código central.
+    Actúa como una fábrica sobre el registro de proveedores (clases que heredan de
+    BaseProvider en este paquete). Los módulos se cargan bajo demanda, de modo que
+    crear el gestor no importa los SDKs de proveedores que no se llegan a usar.
     """
 
     def __init__(self):
         """
-        Inicializa el gestor y carga automáticamente los proveedores disponibles.
+        Inicializa el gestor. Las clases de los proveedores se importan al pedirlas por primera vez.
         """
-        self.providers: Dict[str, Type[BaseProvider]] = {}
         self.loaded_instances: Dict[str, BaseProvider] = {}
-        self._discover_providers()
+        # Lista de modelos por proveedor: (instante de la consulta, modelos). Evita una llamada
+        # de red (`models.list()`) cada vez que la UI refresca el selector de modelos.
+        self._models_cache: Dict[str, Tuple[float, List[str]]] = {}
 
-    def _discover_providers(self):
+    def _load_provider_class(self, provider_name: str, trace_id: str = 'N/A') -> Optional[Type[BaseProvider]]:
         """
-        Descubre e importa dinámicamente todos los proveedores de LLM en este paquete.
-
-        Itera sobre todos los módulos en el directorio actual (`providers`),
-        los importa y busca clases que hereden de `BaseProvider`.
+        Devuelve la clase del proveedor, importando su módulo la primera vez que se pide.
         """
-        package = __import__(__name__.split('.')[0])
-        providers_package_path = package.providers.__path__
-        
-        logger.info("Descubriendo proveedores de LLM...")
-        for _, name, _ in pkgutil.iter_modules(providers_package_path):
-            if name not in ["base_provider", "api_manager"]:
-                try:
-                    module = importlib.import_module(f".{name}", package="chimera_core.providers")
-                    for attribute_name in dir(module):
-                        attribute = getattr(module, attribute_name)
-                        if isinstance(attribute, type) and issubclass(attribute, BaseProvider) and attribute is not BaseProvider:
-                            # Usamos el nombre del proveedor como clave (ej. "openai")
-                            provider_name = attribute().get_provider_name()
-                            self.providers[provider_name] = attribute
-                            logger.info(f"  - Proveedor encontrado: '{provider_name}'")
-                except Exception as e:
-                    logger.error(f"Error al cargar el proveedor desde {name}: {e}")
+        # Las clases ya importadas están en el registro de BaseProvider (se registran al definirse).
+        provider_class = BaseProvider.get_registered_provider(provider_name)
+        if provider_class is not None:
+            return provider_class
+        module_path = PROVIDER_REGISTRY.get(provider_name)
+        if module_path is None:
+            logger.error(f"Error: Proveedor '{provider_name}' no encontrado.", extra={'trace_id': trace_id})
+            return None
+
+        try:
+            importlib.import_module(module_path, package="chimera_core.providers")
+        except Exception as e:
+            logger.error(f"Error al cargar el proveedor desde {module_path}: {e}", extra={'trace_id': trace_id})
+            return None
+        provider_class = BaseProvider.get_registered_provider(provider_name)
+        if provider_class is None:
+            logger.error(f"El módulo {module_path} no define ningún proveedor '{provider_name}'.", extra={'trace_id': trace_id})
+            return None
+
+        logger.info("  - Proveedor cargado: '%s'", provider_name, extra={'trace_id': trace_id})
+        return provider_class
 
     def get_available_providers(self) -> List[str]:
         """
-        Devuelve una lista con los nombres de todos los proveedores descubiertos.
+        Devuelve una lista con los nombres de todos los proveedores registrados.
         """
-        return list(self.providers.keys())
+        return list(PROVIDER_REGISTRY.keys())
 
     def get_provider_models(self, provider_name: str) -> List[str]:
         """
         Devuelve una lista de modelos disponibles para un proveedor específico.
         """
-        if provider_name not in self.providers:
+        if provider_name not in PROVIDER_REGISTRY:
+            return []
+        cached = self._models_cache.get(provider_name)
+        if cached and time.monotonic() - cached[0] < MODELS_CACHE_TTL:
+            return cached[1]
+
+        provider_class = self._load_provider_class(provider_name)
+        if provider_class is None:
             return []
-        # Creamos una instancia temporal para obtener los modelos
         try:
-            temp_provider = self.providers[provider_name]()
-            return temp_provider.get_available_models()
+            models = provider_class.get_available_models()
         except Exception as e:
             logger.error(f"Error al obtener modelos para {provider_name}: {e}")
             return []
+        # Una lista vacía suele indicar un error (o falta de API key): no se cachea para reintentar.
+        if models:
+            self._models_cache[provider_name] = (time.monotonic(), models)
+        return models
 
     def get_provider(self, provider_name: str, trace_id: str = 'N/A', **kwargs) -> Optional[BaseProvider]:
-        if provider_name not in self.providers:
-            logger.error(f"Error: Proveedor '{provider_name}' no encontrado.", extra={'trace_id': trace_id})
-            return None
-
         model_name = kwargs.get("model")
         instance_key = (provider_name, model_name)
 
-        if instance_key in self.loaded_instances:
-            logger.info(f"Reutilizando instancia existente para el proveedor: '{provider_name}' con config: {kwargs}", extra={'trace_id': trace_id})
-            return self.loaded_instances[instance_key]
+        # Camino habitual (se recorre en cada petición): una sola consulta al diccionario de instancias.
+        # Sus logs de INFO usan formato %: el repr de `kwargs` solo se construye si el mensaje se emite.
+        instance = self.loaded_instances.get(instance_key)
+        if instance is not None:
+            logger.info("Reutilizando instancia existente para el proveedor: '%s' con config: %s", provider_name, kwargs, extra={'trace_id': trace_id})
+            return instance
+
+        provider_class = self._load_provider_class(provider_name, trace_id)
+        if provider_class is None:
+            return None
 
         try:
-            logger.info(f"Creando nueva instancia para el proveedor: '{provider_name}' con config: {kwargs}", extra={'trace_id': trace_id})
-            provider_class = self.providers[provider_name]
+            logger.info("Creando nueva instancia para el proveedor: '%s' con config: %s", provider_name, kwargs, extra={'trace_id': trace_id})
             instance = provider_class(**kwargs)
             self.loaded_instances[instance_key] = instance
             return instance
@@ -1,6 +1,7 @@
 
+import asyncio
 from abc import ABC, abstractmethod
-from typing import List, Dict, Any
+from typing import List, Dict, Any, AsyncIterator, ClassVar, Optional, Type
 
 class BaseProvider(ABC):
     """
@@ -12,19 +13,38 @@ class BaseProvider(ABC):
     haciendo el sistema modular y fácilmente extensible.
     """
 
-    @abstractmethod
+    # Nombre del proveedor (ej. "openai", "gemini"). Es un atributo de clase para que el
+    # ApiManager pueda registrar el proveedor sin instanciarlo (ni crear su cliente del SDK).
+    PROVIDER_NAME: ClassVar[str]
+
+    # Proveedores registrados por su PROVIDER_NAME al definir cada subclase.
+    _registry: ClassVar[Dict[str, Type["BaseProvider"]]] = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        provider_name = getattr(cls, "PROVIDER_NAME", None)
+        if provider_name:
+            BaseProvider._registry[provider_name] = cls
+
+    @staticmethod
+    def get_registered_provider(provider_name: str) -> Optional[Type["BaseProvider"]]:
+        """
+        Devuelve la clase registrada con ese nombre, o None si su módulo aún no se ha importado.
+        """
+        return BaseProvider._registry.get(provider_name)
+
     def get_provider_name(self) -> str:
         """
         Devuelve el nombre del proveedor (ej. "openai", "gemini").
         """
-        pass
+        return self.PROVIDER_NAME
 
     @abstractmethod
     def generate_response(
         self, 
         prompt: str, 
-        history: List[Dict[str, Any]] = [], 
-        tools: List[Dict[str, Any]] = [],
+        history: Optional[List[Dict[str, Any]]] = None, 
+        tools: Optional[List[Dict[str, Any]]] = None,
         **kwargs
     ) -> Dict[str, Any]:
         """
@@ -44,6 +64,40 @@ class BaseProvider(ABC):
         """
         pass
 
+    async def agenerate_response(
+        self,
+        prompt: str,
+        history: Optional[List[Dict[str, Any]]] = None,
+        tools: Optional[List[Dict[str, Any]]] = None,
+        **kwargs
+    ) -> Dict[str, Any]:
+        """
+        Versión asíncrona de `generate_response`, para llamarla desde el bucle de eventos.
+
+        Por defecto ejecuta `generate_response` en un hilo; los proveedores con un cliente
+        asíncrono nativo (ej. OpenAI) la sobrescriben para no ocupar hilos durante la espera.
+        """
+        return await asyncio.to_thread(self.generate_response, prompt, history, tools, **kwargs)
+
+    async def agenerate_response_stream(
+        self,
+        prompt: str,
+        history: Optional[List[Dict[str, Any]]] = None,
+        tools: Optional[List[Dict[str, Any]]] = None,
+        **kwargs
+    ) -> AsyncIterator[Any]:
+        """
+        Versión en streaming de `agenerate_response`.
+
+        Emite los fragmentos de texto de la respuesta (str) a medida que se generan y, como último
+        elemento, el mensaje completo, para que el Orquestador pueda resolver sus `tool_calls`.
+        Por defecto emite la respuesta entera de una vez; los proveedores con streaming nativo la sobrescriben.
+        """
+        response_message = await self.agenerate_response(prompt, history, tools, **kwargs)
+        if response_message and response_message.content:
+            yield response_message.content
+        yield response_message
+
     @abstractmethod
     def get_embedding(self, text: str) -> List[float]:
         """
@@ -60,9 +114,21 @@ class BaseProvider(ABC):
         """
         pass
 
+    def get_embeddings(self, texts: List[str], batch_size: int = 256) -> List[List[float]]:
+        """
+        Genera los embeddings de varios textos, en el mismo orden.
+
+        Por defecto llama a `get_embedding` una vez por texto; los proveedores cuya API acepta
+        lotes (ej. OpenAI) la sobrescriben para enviar hasta `batch_size` textos por petición.
+        """
+        return [self.get_embedding(text) for text in texts]
+
+    @classmethod
     @abstractmethod
-    def get_available_models(self) -> List[str]:
+    def get_available_models(cls) -> List[str]:
         """
         Devuelve una lista de los nombres de los modelos disponibles para este proveedor.
+
+        Es un método de clase: listar los modelos no requiere instanciar el proveedor.
         """
         pass
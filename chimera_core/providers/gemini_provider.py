@@ -1,23 +1,32 @@
 
 import os
+import functools
 import google.generativeai as genai
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 from .base_provider import BaseProvider
 
 # --- Inicialización del Cliente de Gemini ---
-# La clave de API se carga automáticamente desde la variable de entorno GOOGLE_API_KEY.
-try:
-    genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
-    if not os.getenv("GOOGLE_API_KEY"):
-        print("Advertencia: La variable de entorno GOOGLE_API_KEY no está configurada.")
-except Exception as e:
-    print(f"Error al configurar el cliente de Gemini: {e}")
+# La clave de API se carga desde la variable de entorno GOOGLE_API_KEY. La configuración
+# se hace una sola vez, al usar el proveedor por primera vez, y no al importar el módulo.
+@functools.lru_cache(maxsize=1)
+def _ensure_configured():
+    try:
+        genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
+        if not os.getenv("GOOGLE_API_KEY"):
+            print("Advertencia: La variable de entorno GOOGLE_API_KEY no está configurada.")
+    except Exception as e:
+        print(f"Error al configurar el cliente de Gemini: {e}")
+
+# Roles que Gemini recibe como "user" (no admite un rol "system" en el historial); el resto son "model".
+_GEMINI_USER_ROLES = frozenset(("system", "user"))
 
 class GeminiProvider(BaseProvider):
     """
     Implementación concreta del proveedor para los modelos de Google Gemini.
     """
 
+    PROVIDER_NAME = "gemini"
+
     def __init__(self, model: str = "gemini-pro"):
         """
         Inicializa el proveedor con un modelo específico de Gemini.
@@ -27,17 +36,15 @@ class GeminiProvider(BaseProvider):
         """
         if not os.getenv("GOOGLE_API_KEY"):
             raise ConnectionError("La API key de Google Gemini no está configurada.")
+        _ensure_configured()
         self.model_name = model
         self.model = genai.GenerativeModel(model)
 
-    def get_provider_name(self) -> str:
-        return "gemini"
-
     def generate_response(
         self, 
         prompt: str, 
-        history: List[Dict[str, Any]] = [], 
-        tools: List[Dict[str, Any]] = [],
+        history: Optional[List[Dict[str, Any]]] = None, 
+        tools: Optional[List[Dict[str, Any]]] = None,
         **kwargs
     ) -> Dict[str, Any]:
         """
@@ -58,13 +65,14 @@ class GeminiProvider(BaseProvider):
         # Por simplicidad, lo concatenaremos al primer mensaje del historial.
         
         # Convertir el historial al formato de Gemini
-        gemini_history = []
-        for msg in history:
-            role = "user" if msg["role"] == "system" or msg["role"] == "user" else "model"
-            gemini_history.append({"role": role, "parts": [msg["content"]]})
+        gemini_history = [
+            {"role": "user" if msg["role"] in _GEMINI_USER_ROLES else "model", "parts": [msg["content"]]}
+            for msg in history or []
+        ]
 
         # Añadir el prompt actual del usuario
-        gemini_history.append({"role": "user", "parts": [prompt]})
+        if prompt:
+            gemini_history.append({"role": "user", "parts": [prompt]})
 
         try:
             # Gemini no tiene un parámetro 'tools' directo en generate_content como OpenAI.
@@ -97,13 +105,15 @@ class GeminiProvider(BaseProvider):
             print(f"Error de la API de Gemini al crear embedding: {e}")
             return []
 
-    def get_available_models(self) -> List[str]:
+    @classmethod
+    def get_available_models(cls) -> List[str]:
         """
         Devuelve una lista de los nombres de los modelos de chat disponibles de Gemini.
         """
         if not os.getenv("GOOGLE_API_KEY"):
             return []
         try:
+            _ensure_configured()
             # Listar solo modelos de tipo "generative" (chat)
             models = [m.name for m in genai.list_models() if "generateContent" in m.supported_generation_methods]
             return sorted(models)
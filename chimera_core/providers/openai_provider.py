@@ -1,28 +1,62 @@
 
 import os
+import re
+import functools
+import httpx
 import openai
-from typing import List, Dict, Any
+from typing import List, Dict, Any, AsyncIterator, Optional, Tuple
 from .base_provider import BaseProvider
 from ..utils.logger import logger
 
 # --- Inicialización del Cliente de OpenAI ---
-# Es una buena práctica inicializar el cliente una vez por módulo.
-# La clave de API se carga automáticamente desde la variable de entorno OPENAI_API_KEY.
-try:
-    client = openai.OpenAI()
-    # Cargar la clave explícitamente si está en otra variable o para mayor claridad
-    client.api_key = os.getenv("OPENAI_API_KEY")
-    if not client.api_key:
-        logger.warning("Advertencia: La variable de entorno OPENAI_API_KEY no está configurada.")
-except Exception as e:
-    logger.error(f"Error al inicializar el cliente de OpenAI: {e}")
-    client = None
+# Los clientes se crean la primera vez que se usan (no al importar el módulo), así importar
+# el proveedor no construye clientes HTTP ni exige la API key. La clave se carga desde la
+# variable de entorno OPENAI_API_KEY.
+# Todas las instancias de OpenAIProvider (y por tanto las llamadas auxiliares a GPT-3.5)
+# comparten estos clientes HTTP con keep-alive, evitando un nuevo handshake TCP/TLS por llamada.
+# El cliente asíncrono lo usa el Orquestador desde el bucle de eventos; el síncrono, las
+# llamadas auxiliares que se ejecutan en hilos (extracción de entidades, síntesis, resúmenes).
+# Modelos de chat que se ofrecen en la UI: contienen "gpt" y "-turbo", "-4" o "-3.5", y no son "instruct".
+_CHAT_MODEL_RE = re.compile(r"^(?!.*instruct)(?=.*gpt).*(?:-turbo|-4|-3\.5)")
+
+# Saltos de línea y tabuladores -> espacios en los textos a embeber, en una sola pasada con str.translate.
+_WHITESPACE_TABLE = str.maketrans("\n\r\t", "   ")
+
+HTTP_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=60)
+HTTP_TIMEOUT = httpx.Timeout(120.0, connect=10.0)
+
+@functools.lru_cache(maxsize=1)
+def _get_client() -> Optional[openai.OpenAI]:
+    try:
+        # Cargar la clave explícitamente si está en otra variable o para mayor claridad
+        api_key = os.getenv("OPENAI_API_KEY")
+        if not api_key:
+            logger.warning("Advertencia: La variable de entorno OPENAI_API_KEY no está configurada.")
+        http_client = httpx.Client(limits=HTTP_LIMITS, timeout=HTTP_TIMEOUT)
+        return openai.OpenAI(api_key=api_key, http_client=http_client)
+    except Exception as e:
+        logger.error(f"Error al inicializar el cliente de OpenAI: {e}")
+        return None
+
+@functools.lru_cache(maxsize=1)
+def _get_async_client() -> Optional[openai.AsyncOpenAI]:
+    try:
+        async_http_client = httpx.AsyncClient(limits=HTTP_LIMITS, timeout=HTTP_TIMEOUT)
+        return openai.AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"), http_client=async_http_client)
+    except Exception as e:
+        logger.error(f"Error al inicializar el cliente asíncrono de OpenAI: {e}")
+        return None
 
 class OpenAIProvider(BaseProvider):
     """
     Implementación concreta del proveedor para los modelos de OpenAI (GPT-3.5, GPT-4, etc.).
     """
 
+    PROVIDER_NAME = "openai"
+
+    # Formato OpenAI de cada herramienta, compartido por todas las instancias: id(herramienta) -> (herramienta, payload).
+    _tool_payload_cache: Dict[int, Tuple[Any, Dict[str, Any]]] = {}
+
     def __init__(self, model: str = "gpt-4-turbo-preview"):
         """
         Inicializa el proveedor con un modelo específico de OpenAI.
@@ -30,40 +64,77 @@ class OpenAIProvider(BaseProvider):
         Args:
             model (str): El nombre del modelo a utilizar (ej. "gpt-4-turbo-preview").
         """
-        if not client:
+        if not _get_client():
             raise ConnectionError("El cliente de OpenAI no pudo ser inicializado. Revisa tu API key.")
         self.model = model
 
-    def get_provider_name(self) -> str:
-        return "openai"
+    @classmethod
+    def _get_tool_payload(cls, tool) -> Dict[str, Any]:
+        """
+        Devuelve la herramienta en el formato de la API de OpenAI, serializándola solo la primera vez.
+        La lista de herramientas es estable entre peticiones, así que no se vuelve a volcar el modelo
+        Pydantic en cada llamada. Se guarda también la herramienta para que su id no pueda reutilizarse.
+        """
+        cached = cls._tool_payload_cache.get(id(tool))
+        if cached is None or cached[0] is not tool:
+            cached = (tool, {"type": "function", "function": tool.model_dump()})
+            cls._tool_payload_cache[id(tool)] = cached
+        return cached[1]
+
+    def _build_api_args(self, prompt: str, history: Optional[List[Dict[str, Any]]], tools: Optional[List[Dict[str, Any]]], **kwargs) -> Dict[str, Any]:
+        """Prepara los argumentos de Chat Completions (común a las versiones síncrona y asíncrona)."""
+        # Copia del historial: añadir el prompt no debe modificar la lista del llamador.
+        messages = list(history) if history else []
+        if prompt:
+            messages.append({"role": "user", "content": prompt})
+
+        api_args = {
+            "model": self.model,
+            "messages": messages,
+            "temperature": kwargs.get("temperature", 0.7),
+            "max_tokens": kwargs.get("max_tokens", 1500)
+        }
+        if tools:
+            # Formatear las herramientas para la API de OpenAI
+            api_args["tools"] = [self._get_tool_payload(tool) for tool in tools]
+            api_args["tool_choice"] = "auto"
+        return api_args
 
     def generate_response(
         self, 
         prompt: str, 
-        history: List[Dict[str, Any]] = [], 
-        tools: List[Dict[str, Any]] = [],
+        history: Optional[List[Dict[str, Any]]] = None, 
+        tools: Optional[List[Dict[str, Any]]] = None,
         **kwargs
     ) -> Dict[str, Any]:
         """
         Llama a la API de Chat Completions de OpenAI, soportando el protocolo de Tool Calling.
         """
-        messages = history
-        if prompt:
-            messages.append({"role": "user", "content": prompt})
-        
         try:
-            api_args = {
-                "model": self.model,
-                "messages": messages,
-                "temperature": kwargs.get("temperature", 0.7),
-                "max_tokens": kwargs.get("max_tokens", 1500)
-            }
-            if tools:
-                # Formatear las herramientas para la API de OpenAI
-                api_args["tools"] = [{"type": "function", "function": tool.dict()} for tool in tools]
-                api_args["tool_choice"] = "auto"
-
-            response = client.chat.completions.create(**api_args)
+            response = _get_client().chat.completions.create(**self._build_api_args(prompt, history, tools, **kwargs))
+            return response.choices[0].message
+
+        except openai.APIError as e:
+            logger.error(f"Error de la API de OpenAI: {e}")
+            # Devolvemos un objeto de mensaje simulado para consistencia
+            return openai.types.chat.ChatCompletionMessage(role='assistant', content=f"Error de OpenAI: {e}")
+        except Exception as e:
+            logger.error(f"Un error inesperado ocurrió: {e}")
+            return openai.types.chat.ChatCompletionMessage(role='assistant', content=f"Error inesperado: {e}")
+
+    async def agenerate_response(
+        self,
+        prompt: str,
+        history: Optional[List[Dict[str, Any]]] = None,
+        tools: Optional[List[Dict[str, Any]]] = None,
+        **kwargs
+    ) -> Dict[str, Any]:
+        """
+        Versión asíncrona de `generate_response` sobre `AsyncOpenAI`: la espera de la respuesta
+        no bloquea el bucle de eventos.
+        """
+        try:
+            response = await _get_async_client().chat.completions.create(**self._build_api_args(prompt, history, tools, **kwargs))
             return response.choices[0].message
 
         except openai.APIError as e:
@@ -74,13 +145,64 @@ class OpenAIProvider(BaseProvider):
             logger.error(f"Un error inesperado ocurrió: {e}")
             return openai.types.chat.ChatCompletionMessage(role='assistant', content=f"Error inesperado: {e}")
 
+    async def agenerate_response_stream(
+        self,
+        prompt: str,
+        history: Optional[List[Dict[str, Any]]] = None,
+        tools: Optional[List[Dict[str, Any]]] = None,
+        **kwargs
+    ) -> AsyncIterator[Any]:
+        """
+        Versión en streaming de `agenerate_response` (`stream=True`): emite cada fragmento de texto
+        según llega y, al final, el mensaje completo reconstruido (con sus `tool_calls`, si las hay).
+        """
+        content_parts = []
+        tool_calls: Dict[int, Dict[str, str]] = {}
+        try:
+            stream = await _get_async_client().chat.completions.create(stream=True, **self._build_api_args(prompt, history, tools, **kwargs))
+            async for chunk in stream:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta
+                if delta.content:
+                    content_parts.append(delta.content)
+                    yield delta.content
+                # Las llamadas a herramientas llegan troceadas: se acumulan por su índice.
+                for tool_call_delta in delta.tool_calls or []:
+                    tool_call = tool_calls.setdefault(tool_call_delta.index, {"id": "", "name": "", "arguments": ""})
+                    if tool_call_delta.id:
+                        tool_call["id"] = tool_call_delta.id
+                    if tool_call_delta.function:
+                        tool_call["name"] += tool_call_delta.function.name or ""
+                        tool_call["arguments"] += tool_call_delta.function.arguments or ""
+
+        except openai.APIError as e:
+            logger.error(f"Error de la API de OpenAI: {e}")
+            yield f"Error de OpenAI: {e}"
+            yield openai.types.chat.ChatCompletionMessage(role='assistant', content=f"Error de OpenAI: {e}")
+            return
+        except Exception as e:
+            logger.error(f"Un error inesperado ocurrió: {e}")
+            yield f"Error inesperado: {e}"
+            yield openai.types.chat.ChatCompletionMessage(role='assistant', content=f"Error inesperado: {e}")
+            return
+
+        yield openai.types.chat.ChatCompletionMessage.model_validate({
+            "role": "assistant",
+            "content": "".join(content_parts) or None,
+            "tool_calls": [
+                {"id": tool_call["id"], "type": "function", "function": {"name": tool_call["name"], "arguments": tool_call["arguments"]}}
+                for _, tool_call in sorted(tool_calls.items())
+            ] or None
+        })
+
     def get_embedding(self, text: str, model="text-embedding-3-small") -> List[float]:
         """
         Obtiene un embedding para un texto usando los modelos de embedding de OpenAI.
         """
         try:
-            response = client.embeddings.create(
-                input=[text.replace("\n", " ")], # La API recomienda reemplazar saltos de línea
+            response = _get_client().embeddings.create(
+                input=[text.translate(_WHITESPACE_TABLE)], # La API recomienda reemplazar saltos de línea
                 model=model
             )
             return response.data[0].embedding
@@ -88,18 +210,36 @@ class OpenAIProvider(BaseProvider):
             logger.error(f"Error de la API de OpenAI al crear embedding: {e}")
             return []
 
-    def get_available_models(self) -> List[str]:
+    def get_embeddings(self, texts: List[str], batch_size: int = 256, model="text-embedding-3-small") -> List[List[float]]:
+        """
+        Obtiene los embeddings de varios textos enviando hasta `batch_size` textos por petición,
+        en lugar de una petición HTTPS por texto. Si un lote falla, sus textos quedan con [].
+        """
+        embeddings: List[List[float]] = []
+        for start in range(0, len(texts), batch_size):
+            batch = [text.translate(_WHITESPACE_TABLE) for text in texts[start:start + batch_size]] # La API recomienda reemplazar saltos de línea
+            try:
+                response = _get_client().embeddings.create(input=batch, model=model)
+                # Se ordena por `index` para devolver los embeddings en el orden de los textos.
+                embeddings.extend(item.embedding for item in sorted(response.data, key=lambda item: item.index))
+            except openai.APIError as e:
+                logger.error(f"Error de la API de OpenAI al crear embeddings en lote: {e}")
+                embeddings.extend([] for _ in batch)
+        return embeddings
+
+    @classmethod
+    def get_available_models(cls) -> List[str]:
         """
         Devuelve una lista de los nombres de los modelos de chat disponibles de OpenAI.
         """
-        if not client:
+        if not _get_client():
             return []
         try:
-            models = client.models.list()
+            models = _get_client().models.list()
             # Filtramos para incluir solo modelos de chat relevantes
             chat_models = [
                 m.id for m in models.data 
-                if "gpt" in m.id and ("-turbo" in m.id or "-4" in m.id or "-3.5" in m.id) and "instruct" not in m.id
+                if _CHAT_MODEL_RE.search(m.id)
             ]
             # Añadimos algunos modelos comunes que quizás no aparezcan en la lista completa
             common_models = ["gpt-4-turbo-preview", "gpt-3.5-turbo"]
@@ -2,19 +2,28 @@
 
 import logging
 import logging.handlers
-import os
-import json
+import copy
+import queue
+import atexit
+from pathlib import Path
+import textwrap
+import orjson
 
 # --- ESTADO GLOBAL PARA SEPARADORES ---
+# Solo lo lee y modifica el hilo del QueueListener (el filtro va en el handler de fichero), así que
+# no hay carreras entre peticiones concurrentes y los separadores siguen el orden real del fichero.
 _last_trace_id = None
 
 # --- FILTRO PARA DETECTAR NUEVAS INTERACCIONES ---
 class TraceChangeFilter(logging.Filter):
     def filter(self, record):
         global _last_trace_id
-        trace_id = getattr(record, 'trace_id', 'N/A')
-        if not hasattr(record, 'trace_id'):
-            record.trace_id = 'N/A'
+        # Una sola consulta al __dict__ del registro en lugar de hasattr + getattr.
+        trace_id = record.__dict__.get('trace_id')
+        if trace_id is None:
+            record.trace_id = trace_id = 'N/A'
+        # Los registros de una misma petición comparten el objeto str del trace_id, así que la
+        # comparación con el último se resuelve por identidad sin recorrer la cadena.
         is_new_trace = (trace_id != 'N/A' and trace_id != _last_trace_id)
         record.new_trace = is_new_trace
         if is_new_trace:
@@ -33,10 +42,10 @@ class PlainTextTraceFormatter(logging.Formatter):
 
         # 2. Añade datos extra si existen
         if hasattr(record, 'data'):
-            extra_data_str = json.dumps(record.data, indent=4, ensure_ascii=False)
-            # CORRECCIÓN: Se realiza el replace fuera del f-string para evitar el SyntaxError
-            indented_data = extra_data_str.replace('\n', '\n    ')
-            log_message += f"\n    [EXTRA DATA]\n    {indented_data}"
+            # orjson serializa en C (con sangría de 2); los tipos no serializables se vuelcan con str().
+            extra_data_str = orjson.dumps(record.data, default=str, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS).decode()
+            indented_data = textwrap.indent(extra_data_str, '    ')
+            log_message += f"\n    [EXTRA DATA]\n{indented_data}"
 
         # 3. Añade información de la excepción si existe
         if record.exc_info:
@@ -52,15 +61,29 @@ class PlainTextTraceFormatter(logging.Formatter):
         
         return log_message
 
+# --- HANDLER DE COLA (ESCRITURA EN SEGUNDO PLANO) ---
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler que solo resuelve el mensaje (los `args` podrían cambiar después) y conserva
+    `exc_info`, de modo que el formateo completo, incluida la excepción, lo hace el hilo del
+    QueueListener con el PlainTextTraceFormatter. La cola es en memoria: no hay que serializar.
+    """
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
 # --- CONFIGURACIÓN CENTRAL ---
-LOG_DIR = os.path.join(os.path.dirname(__file__), '..', '..', 'chimera_logs')
+# Ruta absoluta ya resuelta (sin componentes '..'), calculada una vez al importar el módulo.
+LOG_DIR = Path(__file__).resolve().parents[2] / 'chimera_logs'
 LOG_FILE = "chimera_trace.log"
-LOG_PATH = os.path.join(LOG_DIR, LOG_FILE)
+LOG_PATH = LOG_DIR / LOG_FILE
 
 # --- FUNCIÓN DE CONFIGURACIÓN DEL LOGGER ---
 def setup_logger():
-    if not os.path.exists(LOG_DIR):
-        os.makedirs(LOG_DIR)
+    # exist_ok evita la carrera entre comprobar y crear si varios procesos arrancan a la vez.
+    LOG_DIR.mkdir(parents=True, exist_ok=True)
 
     logger = logging.getLogger("ChimeraLogger")
     logger.setLevel(logging.DEBUG)
@@ -69,8 +92,6 @@ def setup_logger():
     if logger.hasHandlers():
         logger.handlers.clear()
 
-    logger.addFilter(TraceChangeFilter())
-
     fmt = '%(asctime)s - %(levelname)s - [%(module)s:%(funcName)s:%(lineno)d] - (Trace: %(trace_id)s) - %(message)s'
     formatter = PlainTextTraceFormatter(fmt=fmt)
 
@@ -78,9 +99,17 @@ def setup_logger():
         LOG_PATH, when="midnight", interval=1, backupCount=7, encoding='utf-8'
     )
     file_handler.setLevel(logging.DEBUG)
+    file_handler.addFilter(TraceChangeFilter())
     file_handler.setFormatter(formatter)
-    
-    logger.addHandler(file_handler)
+
+    # El fichero lo escribe un hilo aparte: quien llama al logger solo encola el registro y no
+    # espera la escritura a disco (ni la rotación de medianoche).
+    log_queue = queue.Queue(-1)
+    listener = logging.handlers.QueueListener(log_queue, file_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+
+    logger.addHandler(DeferredQueueHandler(log_queue))
 
     return logger
 
@@ -0,0 +1,48 @@
+# Worker de tareas en segundo plano (arq). Se ejecuta como un proceso aparte del servidor:
+#
+#     arq chimera_core.worker.WorkerSettings
+#
+# y se activa en el servidor con SUMMARY_BACKEND=arq.
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+import os
+import asyncio
+from arq.connections import RedisSettings
+
+from .memory.redis_manager import RedisManager
+from .memory.sqlite_manager import SQLiteManager
+from .memory.summarizer import summarize_session
+from .providers.api_manager import ApiManager
+from .utils.logger import logger
+
+REDIS_HOST = os.getenv("REDIS_HOST", "localhost")
+REDIS_PORT = int(os.getenv("REDIS_PORT", 6379))
+ARQ_REDIS_SETTINGS = RedisSettings(host=REDIS_HOST, port=REDIS_PORT)
+
+async def startup(ctx):
+    # El worker solo necesita las memorias que intervienen en el resumen, no el motor de contexto completo.
+    ctx["redis_manager"] = RedisManager()
+    ctx["sqlite_manager"] = SQLiteManager()
+    ctx["sqlite_manager"].check_connection()
+    ctx["api_manager"] = ApiManager()
+    logger.info("Worker de resúmenes listo.")
+
+async def shutdown(ctx):
+    ctx["sqlite_manager"].close()
+
+async def summarize_session_job(ctx, session_id: str, trace_id: str):
+    await asyncio.to_thread(
+        summarize_session, ctx["redis_manager"], ctx["sqlite_manager"], ctx["api_manager"], session_id, trace_id
+    )
+
+class WorkerSettings:
+    functions = [summarize_session_job]
+    on_startup = startup
+    on_shutdown = shutdown
+    redis_settings = ARQ_REDIS_SETTINGS
+    # Sin guardar resultados, el _job_id por sesión queda libre en cuanto termina el resumen
+    # y el siguiente umbral de la sesión puede volver a encolarlo.
+    keep_result = 0
@@ -1,93 +1,160 @@
 
 import requests
-from PySide6.QtCore import QObject, Signal, QThread
-from typing import Dict, Any
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import json
+import time
+import uuid
+import orjson
+from PySide6.QtCore import QObject, Signal, QRunnable, QThreadPool, QTimer
+from typing import Dict, Any, Set, Tuple, List, Callable, NamedTuple
 
 # --- Configuración del Cliente ---
 # La URL base del servidor FastAPI. En una aplicación real, esto podría
 # ser configurable.
 API_BASE_URL = "http://127.0.0.1:8000"
 
-class ApiWorker(QObject):
+# Sesión HTTP compartida por todos los trabajadores: urllib3 mantiene las conexiones
+# keep-alive con el backend en su pool, en lugar de abrir un socket nuevo por petición.
+# Los reintentos solo se aplican a métodos idempotentes (GET, DELETE...), nunca a los POST.
+_SESSION = requests.Session()
+_SESSION.mount("http://", HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=8,
+    max_retries=Retry(total=2, backoff_factor=0.2, status_forcelist=[502, 503, 504])
+))
+
+# requests ya anuncia por defecto las codificaciones que urllib3 sabe descomprimir (gzip, deflate y
+# br si está instalado brotli). El stream del chat pide `identity`: comprimido, el backend
+# acumularía los fragmentos en el buffer de gzip en lugar de enviarlos según se generan.
+_STREAM_HEADERS = {"Content-Type": "application/json", "Accept-Encoding": "identity"}
+
+# Los cuerpos JSON se codifican y decodifican con orjson en lugar del módulo json de la stdlib.
+_JSON_HEADERS = {"Content-Type": "application/json"}
+
+# Cada cuántos milisegundos se consultan las confirmaciones pendientes mientras se espera una respuesta.
+CONFIRMATION_POLL_MS = 1000
+
+# Caché en memoria de las lecturas que rara vez cambian: tipo de petición -> (segundos fresca,
+# segundos utilizable). Una entrada fresca se sirve sin red; una obsoleta pero utilizable se
+# sirve al instante y se refresca en segundo plano (stale-while-revalidate).
+CACHE_TTLS = {
+    "get_sessions": (30, 300),
+    "get_providers": (600, 3600),
+    "get_settings": (120, 600),
+    "get_settings_bootstrap": (120, 600),
+}
+# Respuestas que contienen las de otras lecturas cacheadas: al recibirlas se rellenan también
+# esas entradas (tipo de petición -> campo de la respuesta).
+CACHE_SEEDS = {
+    "get_settings_bootstrap": {"get_providers": "providers", "get_settings": "current_settings"},
+}
+
+def _json_body(payload: Dict, response: requests.Response) -> Any:
+    return orjson.loads(response.content)
+
+class _Endpoint(NamedTuple):
+    """Cómo se ejecuta un tipo de petición y qué señal de WorkerSignals lleva su resultado."""
+    method: str
+    path: str    # Puede usar campos del payload, p. ej. "{session_id}"
+    timeout: Any # Segundos, o (conexión, lectura)
+    signal: str
+    result: Callable[[Dict, requests.Response], Any] = _json_body # (payload, respuesta) -> dato emitido
+    streaming: bool = False
+
+# Tabla única de tipos de petición: la usan tanto ApiWorker.run como ApiClient._start_worker.
+_ENDPOINTS: Dict[str, _Endpoint] = {
+    "get_sessions": _Endpoint("GET", "/v1/sessions", 10, "sessions_received"),
+    "create_session": _Endpoint("POST", "/v1/sessions", 10, "session_created"),
+    "send_prompt": _Endpoint("POST", "/v1/chat/stream", (5, 120), "response_received", streaming=True),
+    # Se emite el ID de la sesión borrada
+    "delete_session": _Endpoint("DELETE", "/v1/sessions/{session_id}", 30, "session_deleted", lambda payload, response: payload.get("session_id")),
+    "get_providers": _Endpoint("GET", "/v1/providers", 10, "providers_received"),
+    "get_settings": _Endpoint("GET", "/v1/settings", 10, "settings_received"),
+    "get_settings_bootstrap": _Endpoint("GET", "/v1/settings/bootstrap", 10, "settings_bootstrap_received"),
+    "update_settings": _Endpoint("POST", "/v1/settings", 10, "settings_updated", lambda payload, response: orjson.loads(response.content).get("current_settings", {})),
+    "reset_chroma_db": _Endpoint("POST", "/v1/memory/reset", 30, "chroma_reset_completed"),
+    "get_confirmations": _Endpoint("GET", "/v1/confirmations?trace_id={trace_id}", 10, "confirmations_received"),
+    "resolve_confirmation": _Endpoint("POST", "/v1/confirmations/{confirmation_id}", 10, "confirmation_resolved"),
+}
+
+class WorkerSignals(QObject):
     """
-    El "trabajador" que se ejecuta en un hilo separado (QThread).
-    
-    Hereda de QObject para poder definir y emitir señales. Su única función
-    es realizar la llamada de red bloqueante sin congelar la GUI.
+    Señales de un ApiWorker. QRunnable no hereda de QObject y no puede definir señales,
+    así que el trabajador las emite a través de este objeto, creado en el hilo de la GUI.
     """
     # --- Señales ---
     # La señal `response_received` llevará un diccionario con la respuesta.
     # La señal `error_occurred` llevará un string con el mensaje de error.
     # La señal `finished` se emite cuando el trabajador ha completado su tarea.
     response_received = Signal(dict)
+    partial_received = Signal(str)   # Fragmento de la respuesta del LLM a medida que llega (streaming)
     sessions_received = Signal(list) # Nueva señal para la lista de sesiones
     session_created = Signal(dict)   # Nueva señal para la sesión creada
     session_deleted = Signal(str)    # Nueva señal para confirmar el borrado de una sesión
     providers_received = Signal(dict) # Nueva señal para la lista de proveedores y sus modelos
     settings_received = Signal(dict) # Nueva señal para la configuración de LLM recibida
+    settings_bootstrap_received = Signal(dict) # Proveedores, modelos y configuración actual en una sola respuesta
     settings_updated = Signal(dict)  # Nueva señal para la configuración de LLM actualizada
     chroma_reset_completed = Signal(dict) # Nueva señal para el reseteo de ChromaDB
+    confirmations_received = Signal(list) # Acciones de plugins pendientes de confirmación
+    confirmation_resolved = Signal(dict)  # Respuesta del backend a una confirmación
     error_occurred = Signal(str)
     finished = Signal()
 
+class ApiWorker(QRunnable):
+    """
+    El "trabajador" que se ejecuta en un hilo del QThreadPool del ApiClient.
+    
+    Su única función es realizar la llamada de red bloqueante sin congelar la GUI;
+    los resultados se comunican mediante las señales de `self.signals`.
+    """
+
     def __init__(self, request_type: str, payload: Dict = None):
         super().__init__()
         self.request_type = request_type
         self.payload = payload if payload is not None else {}
+        self.signals = WorkerSignals()
 
     def run(self):
         """
         El método principal que se ejecuta en el hilo de trabajo.
-        Realiza la petición HTTP al backend según el tipo de petición.
+        Realiza la petición HTTP al backend según el tipo de petición (ver `_ENDPOINTS`).
         """
         try:
-            if self.request_type == "get_sessions":
-                response = requests.get(f"{API_BASE_URL}/v1/sessions", timeout=10)
-                response.raise_for_status()
-                self.sessions_received.emit(response.json())
-
-            elif self.request_type == "create_session":
-                response = requests.post(f"{API_BASE_URL}/v1/sessions", json=self.payload, timeout=10)
-                response.raise_for_status()
-                self.session_created.emit(response.json())
-
-            elif self.request_type == "send_prompt":
-                response = requests.post(f"{API_BASE_URL}/v1/chat", json=self.payload, timeout=120)
-                response.raise_for_status()
-                self.response_received.emit(response.json())
-
-            elif self.request_type == "delete_session":
-                session_id = self.payload.get('session_id')
-                response = requests.delete(f"{API_BASE_URL}/v1/sessions/{session_id}", timeout=30)
-                response.raise_for_status()
-                self.session_deleted.emit(session_id) # Emitimos el ID de la sesión borrada
-
-            elif self.request_type == "get_providers":
-                response = requests.get(f"{API_BASE_URL}/v1/providers", timeout=10)
+            endpoint = _ENDPOINTS[self.request_type]
+            url = API_BASE_URL + endpoint.path.format(**self.payload)
+            if endpoint.streaming:
+                result = self._run_stream(url, endpoint)
+            else:
+                body = orjson.dumps(self.payload) if endpoint.method == "POST" else None
+                response = _SESSION.request(endpoint.method, url, data=body, headers=_JSON_HEADERS if body is not None else None, timeout=endpoint.timeout)
                 response.raise_for_status()
-                self.providers_received.emit(response.json())
-
-            elif self.request_type == "get_settings":
-                response = requests.get(f"{API_BASE_URL}/v1/settings", timeout=10)
-                response.raise_for_status()
-                self.settings_received.emit(response.json())
-
-            elif self.request_type == "update_settings":
-                response = requests.post(f"{API_BASE_URL}/v1/settings", json=self.payload, timeout=10)
-                response.raise_for_status()
-                self.settings_updated.emit(response.json().get("current_settings", {}))
-
-            elif self.request_type == "reset_chroma_db":
-                response = requests.post(f"{API_BASE_URL}/v1/memory/reset", json=self.payload, timeout=30)
-                response.raise_for_status()
-                self.chroma_reset_completed.emit(response.json())
+                result = endpoint.result(self.payload, response)
+            getattr(self.signals, endpoint.signal).emit(result)
 
         except requests.exceptions.RequestException as e:
-            self.error_occurred.emit(f"Error de conexión: {e}")
+            self.signals.error_occurred.emit(f"Error de conexión: {e}")
         except Exception as e:
-            self.error_occurred.emit(f"Error inesperado: {e}")
+            self.signals.error_occurred.emit(f"Error inesperado: {e}")
         finally:
-            self.finished.emit()
+            self.signals.finished.emit()
+
+    def _run_stream(self, url: str, endpoint: _Endpoint) -> Dict[str, Any]:
+        """
+        La respuesta llega en streaming: cada fragmento se emite en cuanto se recibe y, al
+        cerrarse el stream, se devuelve la respuesta completa con el mismo formato que /v1/chat.
+        """
+        response = _SESSION.post(url, data=orjson.dumps(self.payload), headers=_STREAM_HEADERS, stream=True, timeout=endpoint.timeout)
+        with response:
+            response.raise_for_status()
+            response.encoding = "utf-8"
+            chunks = []
+            for chunk in response.iter_content(chunk_size=None, decode_unicode=True):
+                if chunk:
+                    chunks.append(chunk)
+                    self.signals.partial_received.emit(chunk)
+        return {"session_id": self.payload.get("session_id"), "response_text": "".join(chunks)}
 
 class ApiClient(QObject):
     """
@@ -95,84 +162,209 @@ class ApiClient(QObject):
 
     Encapsula la complejidad de la ejecución en hilos. La interfaz de usuario
     solo necesita interactuar con esta clase, simplificando el código de la GUI.
-    Hereda de QObject para poder ser el padre de los hilos y trabajadores.
+    Las peticiones se ejecutan en un QThreadPool propio, que reutiliza sus hilos
+    en lugar de crear y destruir un QThread por cada llamada.
     """
+    MAX_THREADS = 4
+
     def __init__(self, parent=None):
         super().__init__(parent)
-        self.thread = None
-        self.worker = None
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(self.MAX_THREADS)
+        # Los hilos no caducan por inactividad (por defecto a los 30 s): se crean una vez y se
+        # reutilizan durante toda la vida de la aplicación.
+        self.pool.setExpiryTimeout(-1)
+        # Señales de las peticiones en curso. Se mantiene una referencia hasta que el trabajador
+        # termina para que no se destruyan antes de entregar su resultado en el hilo de la GUI.
+        self._inflight: Set[WorkerSignals] = set()
+        # Peticiones en curso que admiten coalescencia: (tipo, payload) -> [(on_success, on_error), ...].
+        self._pending: Dict[Tuple[str, str], List[Tuple[Callable, Callable]]] = {}
+        # Respuestas cacheadas: tipo de petición -> (fresca hasta, utilizable hasta, datos).
+        self._cache: Dict[str, Tuple[float, float, Any]] = {}
+
+    def send_prompt(self, session_id: str, prompt: str, llm_settings: Dict[str, Any], on_success, on_error, on_partial=None, on_confirmation=None):
+        """
+        Envía un prompt al backend de forma asíncrona. Si se indica `on_partial`, recibe cada
+        fragmento de la respuesta según llega; `on_success` recibe al final la respuesta completa.
+
+        Si se indica `on_confirmation`, mientras la petición está en curso se consultan las acciones
+        de los plugins que esperan confirmación del usuario (p. ej. enviar un correo) y se llama a
+        `on_confirmation(detalles)` una vez por cada una; la decisión se envía con `resolve_confirmation`.
+        """
+        # El trace_id lo fija el cliente para poder consultar las confirmaciones de esta petición.
+        trace_id = str(uuid.uuid4())
+        payload = {"session_id": session_id, "prompt": prompt, "llm_settings": llm_settings, "trace_id": trace_id}
+        if on_confirmation is not None:
+            stop_polling = self._poll_confirmations(trace_id, on_confirmation)
+            on_success = self._after(stop_polling, on_success)
+            on_error = self._after(stop_polling, on_error)
+        self._start_worker("send_prompt", payload, on_success, on_error, on_partial=on_partial)
+
+    def resolve_confirmation(self, confirmation_id: str, approved: bool, on_success, on_error):
+        """Acepta o rechaza una acción pendiente de confirmación."""
+        payload = {"confirmation_id": confirmation_id, "approved": approved}
+        self._start_worker("resolve_confirmation", payload, on_success, on_error)
+
+    def _poll_confirmations(self, trace_id: str, on_confirmation) -> Callable[[], None]:
+        """
+        Consulta cada CONFIRMATION_POLL_MS las confirmaciones pendientes de `trace_id` y entrega
+        cada una a `on_confirmation` una sola vez. Devuelve la función que detiene la consulta.
+        """
+        seen: Set[str] = set()
+        timer = QTimer(self)
+        timer.setInterval(CONFIRMATION_POLL_MS)
+
+        def on_pending(confirmations):
+            for confirmation in confirmations:
+                if confirmation["confirmation_id"] not in seen:
+                    seen.add(confirmation["confirmation_id"])
+                    on_confirmation(confirmation)
+
+        # Un fallo puntual de la consulta no interrumpe la petición: se reintenta en el siguiente tick.
+        timer.timeout.connect(lambda: self._start_worker("get_confirmations", {"trace_id": trace_id}, on_pending, lambda error_message: None))
+        timer.start()
+
+        def stop():
+            timer.stop()
+            timer.deleteLater()
+        return stop
 
-    def send_prompt(self, session_id: str, prompt: str, llm_settings: Dict[str, Any], on_success, on_error):
-        """Envía un prompt al backend de forma asíncrona."""
-        payload = {"session_id": session_id, "prompt": prompt, "llm_settings": llm_settings}
-        self._start_worker("send_prompt", payload, on_success, on_error)
+    @staticmethod
+    def _after(before: Callable[[], None], callback):
+        """Envuelve `callback` para ejecutar antes `before` (p. ej. detener una consulta periódica)."""
+        def wrapped(data):
+            before()
+            callback(data)
+        return wrapped
 
     def get_sessions(self, on_success, on_error):
         """Obtiene todas las sesiones del backend."""
-        self._start_worker("get_sessions", {}, on_success, on_error)
+        self._cached_get("get_sessions", on_success, on_error)
 
     def create_session(self, session_name: str, on_success, on_error):
         """Crea una nueva sesión en el backend."""
         payload = {"session_name": session_name}
-        self._start_worker("create_session", payload, on_success, on_error)
+        self._start_worker("create_session", payload, self._invalidating("get_sessions", on_success), on_error)
 
     def delete_session(self, session_id: str, on_success, on_error):
         """Elimina una sesión en el backend."""
         payload = {"session_id": session_id}
-        self._start_worker("delete_session", payload, on_success, on_error)
+        self._start_worker("delete_session", payload, self._invalidating("get_sessions", on_success), on_error)
 
     def get_providers(self, on_success, on_error):
         """Obtiene la lista de proveedores y sus modelos del backend."""
-        self._start_worker("get_providers", {}, on_success, on_error)
+        self._cached_get("get_providers", on_success, on_error)
 
     def get_settings(self, on_success, on_error):
         """
         Obtiene la configuración actual del LLM desde el backend.
         """
-        self._start_worker("get_settings", {}, on_success, on_error, settings_signal=self.worker.settings_received)
+        self._cached_get("get_settings", on_success, on_error)
+
+    def get_settings_bootstrap(self, on_success, on_error):
+        """
+        Obtiene en una sola petición los proveedores con sus modelos y la configuración actual
+        del LLM: {"providers": {...}, "current_settings": {...}}. También rellena las cachés de
+        `get_providers` y `get_settings`.
+        """
+        self._cached_get("get_settings_bootstrap", on_success, on_error)
 
     def update_settings(self, settings_data: Dict[str, Any], on_success, on_error):
         """
         Envía la nueva configuración del LLM al backend para que sea persistente.
         """
-        self._start_worker("update_settings", settings_data, on_success, on_error, settings_updated_signal=self.worker.settings_updated)
+        on_success = self._invalidating("get_settings_bootstrap", on_success)
+        self._start_worker("update_settings", settings_data, self._invalidating("get_settings", on_success), on_error)
 
     def reset_chroma_db(self, on_success, on_error):
         """Resetea la base de datos de ChromaDB."""
         payload = {"memory_type": "chroma"}
         self._start_worker("reset_chroma_db", payload, on_success, on_error)
 
-    def _start_worker(self, request_type: str, payload: Dict, on_success, on_error):
-        """Método genérico para crear, configurar y ejecutar un trabajador en un hilo."""
-        # Creamos el hilo y el trabajador con el ApiClient como su padre.
-        # Esto asegura que no sean eliminados por el recolector de basura prematuramente.
-        self.thread = QThread(self)
-        self.worker = ApiWorker(request_type, payload)
-        self.worker.moveToThread(self.thread)
+    def invalidate_cache(self, request_type: str = None):
+        """Descarta la respuesta cacheada de un tipo de petición (o todas si no se indica)."""
+        if request_type is None:
+            self._cache.clear()
+        else:
+            self._cache.pop(request_type, None)
+
+    def _invalidating(self, request_type: str, on_success):
+        """Envuelve `on_success` para invalidar antes la caché de `request_type` (tras una escritura)."""
+        def callback(data):
+            self.invalidate_cache(request_type)
+            on_success(data)
+        return callback
+
+    def _cached_get(self, request_type: str, on_success, on_error):
+        """Lectura con caché TTL y stale-while-revalidate (ver CACHE_TTLS)."""
+        def store(data):
+            self._store_cached(request_type, data)
+
+        entry = self._cache.get(request_type)
+        now = time.monotonic()
+        if entry is not None and now < entry[1]:
+            data = entry[2]
+            # Se entrega en la siguiente vuelta del bucle de eventos, como una respuesta de red.
+            QTimer.singleShot(0, lambda: on_success(data))
+            if now >= entry[0]:
+                # Obsoleta: se refresca solo la caché, sin volver a llamar a `on_success`.
+                self._start_worker(request_type, {}, store, lambda error_message: None)
+            return
+
+        def on_fetched(data):
+            store(data)
+            on_success(data)
+        self._start_worker(request_type, {}, on_fetched, on_error)
+
+    def _store_cached(self, request_type: str, data):
+        """Guarda una respuesta recibida de la red y las que contiene según CACHE_SEEDS."""
+        now = time.monotonic()
+        fresh_ttl, stale_ttl = CACHE_TTLS[request_type]
+        self._cache[request_type] = (now + fresh_ttl, now + stale_ttl, data)
+        for seeded_type, field in CACHE_SEEDS.get(request_type, {}).items():
+            if field in data:
+                fresh_ttl, stale_ttl = CACHE_TTLS[seeded_type]
+                self._cache[seeded_type] = (now + fresh_ttl, now + stale_ttl, data[field])
+
+    def _start_worker(self, request_type: str, payload: Dict, on_success, on_error, on_partial=None):
+        """Método genérico para crear, configurar y encolar un trabajador en el pool de hilos."""
+        # Coalescencia: si ya hay en curso una petición idéntica (mismo tipo y payload), el nuevo
+        # llamador espera su resultado en lugar de lanzar otra. Los prompts nunca se agrupan.
+        key = None
+        if request_type != "send_prompt":
+            key = (request_type, json.dumps(payload, sort_keys=True))
+            waiting = self._pending.get(key)
+            if waiting is not None:
+                waiting.append((on_success, on_error))
+                return
+            waiting = self._pending[key] = [(on_success, on_error)]
+
+            # Los callbacks se reparten en el hilo de la GUI, el mismo en el que se añaden, así
+            # que un llamador llega a tiempo para este resultado o inicia una petición nueva.
+            def dispatch_success(data, key=key, waiting=waiting):
+                for callback, _ in self._pending.pop(key, waiting):
+                    callback(data)
+
+            def dispatch_error(error_message, key=key, waiting=waiting):
+                for _, callback in self._pending.pop(key, waiting):
+                    callback(error_message)
+
+            on_success, on_error = dispatch_success, dispatch_error
+
+        worker = ApiWorker(request_type, payload)
+        signals = worker.signals
 
         # Conectar la señal de éxito apropiada según el tipo de petición
-        if request_type == "send_prompt":
-            self.worker.response_received.connect(on_success)
-        elif request_type == "get_sessions":
-            self.worker.sessions_received.connect(on_success)
-        elif request_type == "create_session":
-            self.worker.session_created.connect(on_success)
-        elif request_type == "delete_session":
-            self.worker.session_deleted.connect(on_success)
-        elif request_type == "get_providers":
-            self.worker.providers_received.connect(on_success)
-        elif request_type == "get_settings":
-            self.worker.settings_received.connect(on_success)
-        elif request_type == "update_settings":
-            self.worker.settings_updated.connect(on_success)
-        elif request_type == "reset_chroma_db":
-            self.worker.chroma_reset_completed.connect(on_success)
+        getattr(signals, _ENDPOINTS[request_type].signal).connect(on_success)
+
+        if on_partial is not None:
+            signals.partial_received.connect(on_partial)
         
         # Conectar las señales comunes
-        self.worker.error_occurred.connect(on_error)
-        self.worker.finished.connect(self.thread.quit)
-        self.worker.finished.connect(self.worker.deleteLater)
-        self.thread.finished.connect(self.thread.deleteLater)
-        self.thread.started.connect(self.worker.run)
+        signals.error_occurred.connect(on_error)
+        self._inflight.add(signals)
+        signals.finished.connect(lambda: self._inflight.discard(signals))
+        if key is not None:
+            signals.finished.connect(lambda: self._pending.pop(key, None))
         
-        self.thread.start()
+        self.pool.start(worker)
@@ -5,6 +5,12 @@ from PySide6.QtWidgets import QApplication
 # Importamos la ventana principal desde nuestro paquete de UI
 from .ui.main_window import MainWindow
 
+# Hoja de estilos global de la aplicación. Los botones de acciones destructivas usan el
+# objectName "destructive" y comparten esta regla en lugar de una hoja de estilos propia.
+APP_STYLESHEET = """
+QPushButton#destructive { background-color: #ffcccc; color: black; }
+"""
+
 def main():
     """
     Punto de entrada principal para la aplicación de escritorio Quimera.
@@ -12,6 +18,7 @@ def main():
     # 1. Crear la instancia de QApplication. `sys.argv` permite pasar argumentos
     #    de línea de comandos a la aplicación, si fuera necesario.
     app = QApplication(sys.argv)
+    app.setStyleSheet(APP_STYLESHEET)
 
     # 2. Crear una instancia de nuestra ventana principal.
     window = MainWindow()
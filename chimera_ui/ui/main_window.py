@@ -1,15 +1,75 @@
 
+import functools
 from PySide6.QtWidgets import QMainWindow, QWidget, QHBoxLayout, QListWidget, QTextEdit, QVBoxLayout, QPushButton, QInputDialog, QListWidgetItem, QMessageBox, QMenu
-from PySide6.QtCore import Qt, Signal
-from PySide6.QtGui import QTextCursor
-from markdown_it import MarkdownIt
-from pygments import highlight
-from pygments.lexers import get_lexer_by_name, guess_lexer
-from pygments.formatters import HtmlFormatter
-
-from .settings_dialog import SettingsDialog
+from PySide6.QtCore import Qt, Signal, QTimer
+from PySide6.QtGui import QTextCursor, QTextBlockFormat, QTextCharFormat
+
 from ..api_client import ApiClient
 
+# markdown_it, Pygments y el diálogo de configuración se importan la primera vez que se usan,
+# para no alargar el arranque de la aplicación.
+
+@functools.lru_cache(maxsize=None)
+def _get_formatter():
+    """
+    Formateador de HTML de Pygments compartido por todos los bloques de código. `noclasses=True`
+    incrusta los estilos directamente en los tags, lo que es más robusto para QTextEdit.
+    """
+    from pygments.formatters import HtmlFormatter
+    return HtmlFormatter(style='monokai', noclasses=True)
+
+# Lexers de Pygments por nombre de lenguaje (None si el nombre no corresponde a ningún lexer).
+_LEXER_CACHE = {}
+
+def _highlight_code(code, lang, attrs):
+    """
+    Función de resaltado que se pasa a MarkdownIt.
+    Usa Pygments para colorear el bloque de código.
+    """
+    from pygments import highlight
+    from pygments.lexers import get_lexer_by_name, guess_lexer
+
+    # Intenta obtener el lexer por el nombre del lenguaje (ej. 'python'). Los lexers se
+    # cachean por nombre, incluidos los que no existen (None), para no repetir la búsqueda.
+    if lang in _LEXER_CACHE:
+        lexer = _LEXER_CACHE[lang]
+    else:
+        try:
+            lexer = get_lexer_by_name(lang, stripall=True)
+        except:
+            lexer = None
+        _LEXER_CACHE[lang] = lexer
+
+    if lexer is None:
+        try:
+            # Si no se encuentra, intenta adivinar el lenguaje (depende del código: no se cachea)
+            lexer = guess_lexer(code)
+        except:
+            # Si todo falla, devuelve el código sin resaltar
+            return f'<pre><code>{code}</code></pre>'
+
+    return highlight(code, lexer, _get_formatter())
+
+@functools.lru_cache(maxsize=None)
+def _get_md():
+    """Parser de Markdown compartido por todo el proceso, creado la primera vez que se usa."""
+    from markdown_it import MarkdownIt
+    return MarkdownIt("gfm-like", options_update={'highlight': _highlight_code}).enable("table")
+
+# Respuestas renderizadas que se conservan en la caché de Markdown.
+RENDER_CACHE_SIZE = 256
+
+@functools.lru_cache(maxsize=RENDER_CACHE_SIZE)
+def _render_markdown(markdown_text: str) -> str:
+    """Renderiza Markdown a HTML. Las respuestas no cambian una vez recibidas, así que se cachean por texto."""
+    return _get_md().render(markdown_text)
+
+# Milisegundos que debe mantenerse una selección de sesión antes de aplicarla.
+SESSION_CHANGE_DEBOUNCE_MS = 150
+
+# Bloques máximos que conserva la vista de chat; los más antiguos se descartan al superarlo.
+MAX_CHAT_BLOCKS = 2000
+
 class PromptInputWidget(QTextEdit):
     prompt_submitted = Signal()
 
@@ -33,14 +93,23 @@ class MainWindow(QMainWindow):
         # Inicialización de componentes clave
         self.api_client = ApiClient(self)
         self.active_session_id = None
-        self.thinking_message_cursor = None # Para gestionar el mensaje "Pensando..."
+        self._thinking_range = None # (inicio, fin) del mensaje "Pensando..." en el documento
+        self.streaming_cursor = None # Cursor al final de la respuesta que se está recibiendo en streaming
+        self.streaming_start = None # Posición donde empieza esa respuesta en el documento
+        self._view_generation = 0 # Aumenta con cada cambio de sesión: invalida las respuestas en curso
         self.llm_settings = {
             "provider_name": "openai",
             "model_name": "gpt-4o-mini",
             "temperature": 0.7,
             "max_tokens": 1024
         }
-        self.md = MarkdownIt("gfm-like", options_update={'highlight': self.highlight_code}).enable("table")
+
+        # Al recorrer la lista de sesiones con el teclado solo se aplica la última selección.
+        self._pending_session = None
+        self._session_change_timer = QTimer(self)
+        self._session_change_timer.setSingleShot(True)
+        self._session_change_timer.setInterval(SESSION_CHANGE_DEBOUNCE_MS)
+        self._session_change_timer.timeout.connect(self._apply_session_change)
 
         # Configuración del widget central y el layout principal
         central_widget = QWidget()
@@ -57,6 +126,11 @@ class MainWindow(QMainWindow):
         # Carga inicial de datos
         self.load_sessions()
 
+        # Precarga de proveedores y configuración (en una sola petición) en la caché del cliente:
+        # cuando el usuario abra el diálogo de configuración, `get_providers` responderá sin red.
+        self._settings_dialog = None # Se construye al abrirlo por primera vez y se reutiliza
+        self.api_client.get_settings_bootstrap(lambda bootstrap_data: None, self._on_prefetch_error)
+
     def _create_session_panel(self) -> QWidget:
         panel = QWidget()
         panel.setMaximumWidth(280) # Ancho máximo reducido
@@ -85,6 +159,11 @@ class MainWindow(QMainWindow):
 
         self.chat_view = QTextEdit()
         self.chat_view.setReadOnly(True)
+        # Cursor propio para añadir mensajes al final del documento sin pasar por QTextEdit.append.
+        # El historial de deshacer no se usa (la vista es de solo lectura): sin él, el documento no
+        # acumula una copia de cada edición.
+        self.chat_view.setUndoRedoEnabled(False)
+        self._chat_cursor = QTextCursor(self.chat_view.document())
         self.chat_view.setPlaceholderText("Selecciona o crea una sesión para comenzar.")
         self.chat_view.setStyleSheet("""
             QTextEdit { font-family: sans-serif; font-size: 12pt; }
@@ -120,38 +199,44 @@ class MainWindow(QMainWindow):
         # Cargar las sesiones existentes al iniciar
         self.load_sessions()
 
-    def highlight_code(self, code, lang, attrs):
-        """
-        Función de resaltado que se pasa a MarkdownIt.
-        Usa Pygments para colorear el bloque de código.
-        """
-        try:
-            # Intenta obtener el lexer por el nombre del lenguaje (ej. 'python')
-            lexer = get_lexer_by_name(lang, stripall=True)
-        except:
-            try:
-                # Si no se encuentra, intenta adivinar el lenguaje
-                lexer = guess_lexer(code)
-            except:
-                # Si todo falla, devuelve el código sin resaltar
-                return f'<pre><code>{code}</code></pre>'
-        
-        # Usamos el formateador de HTML de Pygments. `noclasses=True` incrusta los estilos
-        # directamente en los tags, lo que es más robusto para QTextEdit.
-        formatter = HtmlFormatter(style='monokai', noclasses=True)
-        return highlight(code, lexer, formatter)
-
     def load_sessions(self):
         """Llama al API client para obtener y mostrar la lista de sesiones."""
-        self.sessions_list.clear()
         self.api_client.get_sessions(self.on_sessions_received, self.on_api_error)
 
     def on_sessions_received(self, sessions):
-        """Slot para manejar la lista de sesiones recibida del backend."""
-        for session in sessions:
-            item = QListWidgetItem(session['session_name'])
-            item.setData(Qt.UserRole, session['session_id']) # Guardar el ID en el item
-            self.sessions_list.addItem(item)
+        """
+        Slot para manejar la lista de sesiones recibida del backend. La lista se actualiza por
+        diferencias con los items existentes (por ID de sesión), conservando la selección actual.
+        """
+        existing = {}
+        for row in range(self.sessions_list.count()):
+            item = self.sessions_list.item(row)
+            existing[item.data(Qt.UserRole)] = item
+        incoming = {session['session_id']: session for session in sessions}
+
+        # Los cambios se aplican en bloque: sin repintar ni emitir señales por cada item.
+        previous_item = self.sessions_list.currentItem()
+        self.sessions_list.setUpdatesEnabled(False)
+        self.sessions_list.blockSignals(True)
+        try:
+            for session_id in existing.keys() - incoming.keys():
+                self.sessions_list.takeItem(self.sessions_list.row(existing[session_id]))
+            for session_id, session in incoming.items():
+                item = existing.get(session_id)
+                if item is None:
+                    item = QListWidgetItem(session['session_name'])
+                    item.setData(Qt.UserRole, session_id) # Guardar el ID en el item
+                    self.sessions_list.addItem(item)
+                elif item.text() != session['session_name']:
+                    item.setText(session['session_name'])
+        finally:
+            self.sessions_list.blockSignals(False)
+            self.sessions_list.setUpdatesEnabled(True)
+
+        # Si se eliminó la sesión seleccionada, se notifica una sola vez el cambio de selección.
+        current_item = self.sessions_list.currentItem()
+        if current_item is not previous_item:
+            self.handle_session_changed(current_item, previous_item)
 
         # Si la lista no está vacía, seleccionar el primer elemento por defecto.
         # Esto asegura que siempre haya una sesión activa si existe alguna.
@@ -175,11 +260,25 @@ class MainWindow(QMainWindow):
         self.sessions_list.setCurrentItem(item) # Seleccionar la nueva sesión
 
     def handle_session_changed(self, current, previous):
-        """Maneja el cambio de selección en la lista de sesiones."""
+        """
+        Maneja el cambio de selección en la lista de sesiones. El cambio se aplica cuando la
+        selección lleva SESSION_CHANGE_DEBOUNCE_MS sin moverse.
+        """
+        self._pending_session = current
+        self._session_change_timer.start()
+
+    def _apply_session_change(self):
+        """Activa la sesión seleccionada tras el debounce."""
+        current = self._pending_session
+        self._pending_session = None
         if current is not None:
             self.active_session_id = current.data(Qt.UserRole)
             print(f"Cambiando a la sesión: {self.active_session_id}")
+            # Las respuestas aún en curso pertenecen a la vista anterior: se dejan de mostrar.
+            self._view_generation += 1
+            self._finish_streaming(remove_text=False)
             self.chat_view.clear()
+            self._thinking_range = None
             # TODO: Aquí llamaríamos al backend para obtener el historial de esta sesión
             self.chat_view.setPlaceholderText(f"Historial de la sesión: {current.text()}")
         else:
@@ -217,22 +316,29 @@ class MainWindow(QMainWindow):
         print(f"Sesión {session_id} eliminada exitosamente.")
         self.load_sessions()
 
+    def _on_prefetch_error(self, error_message: str):
+        """La precarga es opcional: si falla, el diálogo de configuración pedirá los datos al abrirse."""
+        print(f"No se pudieron precargar los datos de configuración: {error_message}")
+
     def open_settings_dialog(self):
         """
-        Abre el diálogo de configuración de LLM.
+        Abre el diálogo de configuración de LLM. El diálogo se construye la primera vez y en las
+        siguientes solo se actualiza con la configuración actual.
         """
-        dialog = SettingsDialog(self.api_client, self.llm_settings, self)
-        dialog.settings_accepted.connect(self.on_settings_accepted)
-        dialog.exec()
+        if self._settings_dialog is None:
+            from .settings_dialog import SettingsDialog
+            self._settings_dialog = SettingsDialog(self.api_client, self.llm_settings, self)
+            self._settings_dialog.settings_accepted.connect(self.on_settings_accepted)
+        else:
+            self._settings_dialog.refresh(self.llm_settings)
+        self._settings_dialog.exec()
 
-    def on_settings_accepted(self, provider_name: str, model_name: str, temperature: float, max_tokens: int):
+    def on_settings_accepted(self, settings: dict):
         """
-        Slot para manejar la configuración aceptada desde el diálogo.
+        Slot para manejar la configuración aceptada desde el diálogo
+        (provider_name, model_name, temperature y max_tokens).
         """
-        self.llm_settings["provider_name"] = provider_name
-        self.llm_settings["model_name"] = model_name
-        self.llm_settings["temperature"] = temperature
-        self.llm_settings["max_tokens"] = max_tokens
+        self.llm_settings.update(settings)
         print(f"Configuración de LLM actualizada: {self.llm_settings}")
 
     def handle_send_prompt(self):
@@ -246,7 +352,7 @@ class MainWindow(QMainWindow):
         user_prompt = self.prompt_input.toPlainText().strip()
         if user_prompt:
             # Añadir el prompt del usuario a la vista de chat
-            self.chat_view.append(f"<b>Arkitekto:</b> {user_prompt}")
+            self._append_html(f"<b>Arkitekto:</b> {user_prompt}")
             self.prompt_input.clear()
 
             # Usar el ApiClient para enviar el prompt al backend de forma asíncrona
@@ -255,26 +361,80 @@ class MainWindow(QMainWindow):
                 session_id=self.active_session_id,
                 prompt=user_prompt,
                 llm_settings=self.llm_settings,
-                on_success=self.on_response_received,
-                on_error=self.on_api_error
+                on_success=self._for_current_view(self.on_response_received),
+                on_error=self._for_current_view(self.on_api_error),
+                on_partial=self._for_current_view(self.on_partial_response),
+                on_confirmation=self.on_confirmation_requested
             )
 
             # Mostrar un estado de "pensando" inmediatamente en la UI
-            self.add_bot_response("<i>Pensando...</i>")
-            self.thinking_message_cursor = self.chat_view.textCursor()
+            self._thinking_range = self.add_bot_response("<i>Pensando...</i>")
+
+    def _for_current_view(self, callback):
+        """Envuelve `callback` para descartar los resultados que lleguen tras un cambio de sesión."""
+        generation = self._view_generation
+        def wrapped(data):
+            if generation == self._view_generation:
+                callback(data)
+        return wrapped
+
+    def on_confirmation_requested(self, confirmation: dict):
+        """
+        Slot para las acciones de los plugins que esperan confirmación (p. ej. enviar un correo)
+        durante la petición en curso. Pregunta al usuario y envía su decisión al backend.
+        """
+        details = "\n".join(
+            f"{key}: {value}" for key, value in confirmation.items()
+            if key not in ("confirmation_id", "trace_id", "action")
+        )
+        reply = QMessageBox.question(self, "Confirmar Acción",
+                                     f"Quimera quiere ejecutar la acción '{confirmation.get('action')}':\n\n{details}\n\n¿Lo permites?",
+                                     QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
+        self.api_client.resolve_confirmation(
+            confirmation["confirmation_id"], reply == QMessageBox.Yes,
+            lambda response_data: None,
+            lambda error_message: print(f"No se pudo enviar la confirmación: {error_message}")
+        )
+
+    def on_partial_response(self, chunk: str):
+        """
+        Slot que recibe cada fragmento de la respuesta en streaming y lo añade como texto plano.
+        El Markdown se renderiza una sola vez, al recibir la respuesta completa.
+        """
+        if self.streaming_cursor is None:
+            # Primer fragmento: se sustituye "Pensando..." por la cabecera de la respuesta.
+            self._remove_thinking_message()
+            self._append_html("<b>Quimera:</b>")
+            self.streaming_cursor = QTextCursor(self.chat_view.document())
+            self.streaming_cursor.movePosition(QTextCursor.End)
+            self.streaming_start = self.streaming_cursor.block().position()
+            self.streaming_cursor.insertBlock(QTextBlockFormat(), QTextCharFormat())
+
+        self.streaming_cursor.insertText(chunk, QTextCharFormat())
+        self.chat_view.verticalScrollBar().setValue(self.chat_view.verticalScrollBar().maximum())
+
+    def _finish_streaming(self, remove_text: bool):
+        """Termina la respuesta en streaming; si `remove_text`, borra el texto plano ya mostrado."""
+        if remove_text and self.streaming_start is not None:
+            cursor = QTextCursor(self.chat_view.document())
+            # Desde el final del bloque anterior, para no dejar una línea vacía.
+            cursor.setPosition(max(self.streaming_start - 1, 0))
+            cursor.movePosition(QTextCursor.End, QTextCursor.KeepAnchor)
+            cursor.removeSelectedText()
+        self.streaming_cursor = None
+        self.streaming_start = None
 
     def on_response_received(self, response_data: dict):
         """
         Slot que se ejecuta cuando el ApiClient emite la señal `response_received`.
         Este método se ejecuta en el hilo principal de la GUI.
         """
+        # Si la respuesta llegó en streaming, su texto plano se sustituye por la versión renderizada.
+        if self.streaming_cursor is not None:
+            self._finish_streaming(remove_text=True)
+
         # Reemplazamos el mensaje "Pensando..." con la respuesta real.
-        # La forma más robusta es deshacer la adición del texto "Pensando..."
-        # y luego añadir la nueva respuesta.
-        if self.thinking_message_cursor:
-            self.thinking_message_cursor.select(QTextCursor.BlockUnderCursor)
-            self.thinking_message_cursor.removeSelectedText()
-            self.thinking_message_cursor = None # Resetear el cursor
+        self._remove_thinking_message()
 
         self.add_bot_response(response_data.get('response_text', 'Error: Respuesta sin texto.'))
         self.chat_view.verticalScrollBar().setValue(self.chat_view.verticalScrollBar().maximum())
@@ -284,17 +444,69 @@ class MainWindow(QMainWindow):
         Slot que se ejecuta cuando el ApiClient emite la señal `error_occurred`.
         Este método se ejecuta en el hilo principal de la GUI.
         """
-        self.chat_view.undo()
+        if self.streaming_cursor is not None:
+            # Se conserva lo que ya se había recibido de la respuesta y se añade el error debajo.
+            self._finish_streaming(remove_text=False)
+        else:
+            self._remove_thinking_message()
         self.add_bot_response(f"<font color='red'>Error: {error_message}</font>")
 
+    def _remove_thinking_message(self):
+        """Borra el mensaje "Pensando..." por su rango de posiciones, si sigue en la vista."""
+        if self._thinking_range is None:
+            return
+        start, end = self._thinking_range
+        self._thinking_range = None
+        document = self.chat_view.document()
+        end = min(end, document.characterCount() - 1)
+        if start < end:
+            cursor = QTextCursor(document)
+            cursor.setPosition(start)
+            cursor.setPosition(end, QTextCursor.KeepAnchor)
+            cursor.removeSelectedText()
+
     def add_bot_response(self, markdown_text: str):
         """
         Renderiza el texto Markdown a HTML y lo añade a la vista de chat.
+        Devuelve el rango (inicio, fin) que ocupa el mensaje en el documento.
         """
         # Reemplazar el texto plano de "pensando" por HTML para consistencia
         if markdown_text == "<i>Pensando...</i>":
             html_text = markdown_text
         else:
-            html_text = self.md.render(markdown_text)
+            html_text = _render_markdown(markdown_text)
         
-        self.chat_view.append(f"<b>Quimera:</b><br>{html_text}")
+        return self._append_html(f"<b>Quimera:</b><br>{html_text}")
+
+    def _append_html(self, html: str):
+        """
+        Añade un mensaje al final de la vista de chat insertándolo con el cursor en un bloque nuevo
+        y recorta los bloques más antiguos si el documento supera MAX_CHAT_BLOCKS.
+        Devuelve el rango (inicio, fin) del mensaje, incluido el salto de bloque que lo precede.
+        """
+        # El recorte va antes de la inserción, para que el rango devuelto siga siendo válido.
+        self._trim_chat_view()
+        cursor = self._chat_cursor
+        cursor.movePosition(QTextCursor.End)
+        start = cursor.position()
+        cursor.beginEditBlock()
+        if not self.chat_view.document().isEmpty():
+            cursor.insertBlock(QTextBlockFormat(), QTextCharFormat())
+        cursor.insertHtml(html)
+        cursor.endEditBlock()
+        return start, cursor.position()
+
+    def _trim_chat_view(self):
+        document = self.chat_view.document()
+        excess = document.blockCount() - MAX_CHAT_BLOCKS
+        if excess > 0:
+            cursor = QTextCursor(document)
+            cursor.movePosition(QTextCursor.Start)
+            cursor.movePosition(QTextCursor.NextBlock, QTextCursor.KeepAnchor, excess)
+            removed = cursor.selectionEnd()
+            cursor.removeSelectedText()
+            # Las posiciones guardadas se desplazan con el texto eliminado.
+            if self._thinking_range is not None:
+                self._thinking_range = tuple(max(position - removed, 0) for position in self._thinking_range)
+            if self.streaming_start is not None:
+                self.streaming_start = max(self.streaming_start - removed, 0)
@@ -1,9 +1,45 @@
-from PySide6.QtWidgets import QDialog, QVBoxLayout, QHBoxLayout, QComboBox, QLabel, QSlider, QSpinBox, QPushButton, QFormLayout, QMessageBox
-from PySide6.QtCore import Qt, Signal
-from typing import Dict, Any, List
+import os
+import json
+import time
+from pathlib import Path
+from PySide6.QtWidgets import QDialog, QVBoxLayout, QHBoxLayout, QComboBox, QDoubleSpinBox, QSpinBox, QPushButton, QFormLayout, QMessageBox, QProgressDialog
+from PySide6.QtCore import Qt, Signal, QTimer, QSignalBlocker
+from typing import Dict, Any, List, Optional
 
 from ..api_client import ApiClient
 
+# Caché en disco de proveedores y modelos: el diálogo se rellena al instante con ella y solo
+# se refresca desde el backend cuando la última sincronización tiene más de un día.
+PROVIDERS_CACHE_DIR = Path.home() / ".chimera" / "cache"
+PROVIDERS_CACHE_PATH = PROVIDERS_CACHE_DIR / "providers.json"
+PROVIDERS_SYNC_MARKER = PROVIDERS_CACHE_DIR / ".last_sync"
+PROVIDERS_SYNC_MAX_AGE = 24 * 60 * 60 # Segundos
+# Con esta variable activa nunca se piden los proveedores al backend (solo la caché en disco).
+DISABLE_REMOTE_PROVIDERS = os.getenv("CHIMERA_DISABLE_REMOTE_PROVIDERS", "false").lower() == "true"
+
+def _read_providers_cache() -> Optional[Dict[str, List[str]]]:
+    try:
+        return json.loads(PROVIDERS_CACHE_PATH.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+
+def _providers_cache_is_stale() -> bool:
+    try:
+        return time.time() - PROVIDERS_SYNC_MARKER.stat().st_mtime > PROVIDERS_SYNC_MAX_AGE
+    except OSError:
+        return True
+
+def _write_providers_cache(providers_data: Dict[str, List[str]]):
+    """Guarda la caché de forma atómica (fichero temporal + os.replace) y marca la sincronización."""
+    try:
+        PROVIDERS_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        tmp_path = PROVIDERS_CACHE_PATH.with_suffix(".json.tmp")
+        tmp_path.write_text(json.dumps(providers_data), encoding="utf-8")
+        os.replace(tmp_path, PROVIDERS_CACHE_PATH)
+        PROVIDERS_SYNC_MARKER.touch()
+    except OSError as e:
+        print(f"No se pudo guardar la caché de proveedores: {e}")
+
 class SettingsDialog(QDialog):
     """
     Diálogo de configuración para los parámetros del LLM y la selección del proveedor.
@@ -11,7 +47,11 @@ class SettingsDialog(QDialog):
     elegir entre los proveedores de LLM disponibles.
     """
     # Señal que se emite cuando la configuración es aceptada
-    settings_accepted = Signal(str, str, float, int) # provider_name, model_name, temperature, max_tokens
+    settings_accepted = Signal(dict) # {provider_name, model_name, temperature, max_tokens}
+
+    # Títulos de los mensajes de error
+    _TITLE_COMM_ERR = "Error de Comunicación"
+    _TITLE_RESET_ERR = "Error al Resetear"
 
     def __init__(self, api_client: ApiClient, current_settings: Dict[str, Any], parent=None):
         """
@@ -29,10 +69,30 @@ class SettingsDialog(QDialog):
 
         self.providers: List[str] = []
         self.models: Dict[str, List[str]] = {}
+        # Posición de cada proveedor, y de cada modelo dentro de su proveedor, en los selectores.
+        self._provider_index: Dict[str, int] = {}
+        self._model_index: Dict[str, Dict[str, int]] = {}
+        self._reset_progress: Optional[QProgressDialog] = None # Indicador del reseteo de ChromaDB en curso
+        self._error_box: Optional[QMessageBox] = None # Se crea con el primer error y se reutiliza
+        self._reset_confirm_box: Optional[QMessageBox] = None # Confirmación del reseteo, creada en el primer uso
 
         self._setup_ui()
         self._load_initial_settings()
-        self._load_providers_and_models()
+        # Los proveedores se cargan en la siguiente vuelta del bucle de eventos, cuando el diálogo
+        # ya se está mostrando; hasta entonces los selectores muestran "Cargando…".
+        QTimer.singleShot(0, self._load_providers_and_models)
+
+    def refresh(self, current_settings: Dict[str, Any]):
+        """
+        Prepara el diálogo ya construido para volver a mostrarse: carga la configuración actual y
+        vuelve a cargar los proveedores, que solo redibujan los selectores si han cambiado.
+        """
+        self.current_settings = current_settings
+        self._load_initial_settings()
+        if self.providers:
+            self._select_current_provider()
+        # También reintenta la carga si la anterior no llegó a completarse (p. ej. error de red).
+        QTimer.singleShot(0, self._load_providers_and_models)
 
     def _setup_ui(self):
         """
@@ -50,18 +110,12 @@ class SettingsDialog(QDialog):
         self.model_combo = QComboBox()
         form_layout.addRow("Modelo de LLM:", self.model_combo)
 
-        # --- Slider de Temperatura ---
-        self.temperature_slider = QSlider(Qt.Horizontal)
-        self.temperature_slider.setRange(0, 20) # 0.0 a 2.0 con un paso de 0.1
-        self.temperature_slider.setSingleStep(1)
-        self.temperature_slider.setTickInterval(1)
-        self.temperature_slider.setTickPosition(QSlider.TicksBelow)
-        self.temperature_label = QLabel("0.7")
-        temp_layout = QHBoxLayout()
-        temp_layout.addWidget(self.temperature_slider)
-        temp_layout.addWidget(self.temperature_label)
-        self.temperature_slider.valueChanged.connect(lambda value: self.temperature_label.setText(str(value / 10.0)))
-        form_layout.addRow("Temperatura:", temp_layout)
+        # --- Selector de Temperatura ---
+        self.temperature_spin = QDoubleSpinBox()
+        self.temperature_spin.setRange(0.0, 2.0)
+        self.temperature_spin.setSingleStep(0.1)
+        self.temperature_spin.setDecimals(1)
+        form_layout.addRow("Temperatura:", self.temperature_spin)
 
         # --- Selector de Max Output Tokens ---
         self.max_tokens_spinbox = QSpinBox()
@@ -83,9 +137,15 @@ class SettingsDialog(QDialog):
         self.ok_button.clicked.connect(self._on_accept)
         self.cancel_button.clicked.connect(self.reject)
 
+        # Hasta recibir los proveedores no hay nada que seleccionar ni aceptar.
+        self.provider_combo.addItem("Cargando…")
+        self.model_combo.addItem("Cargando…")
+        for widget in (self.provider_combo, self.model_combo, self.ok_button):
+            widget.setEnabled(False)
+
         # --- Botón de Resetear ChromaDB ---
         self.reset_chroma_button = QPushButton("Borrar Memoria Semántica (ChromaDB)")
-        self.reset_chroma_button.setStyleSheet("background-color: #ffcccc; color: black;") # Estilo para destacar acción destructiva
+        self.reset_chroma_button.setObjectName("destructive") # Estilo para destacar acción destructiva (ver APP_STYLESHEET)
         main_layout.addWidget(self.reset_chroma_button)
         self.reset_chroma_button.clicked.connect(self._on_reset_chroma_db)
 
@@ -93,66 +153,101 @@ class SettingsDialog(QDialog):
         """
         Carga la configuración actual en los controles de la UI.
         """
-        self.temperature_slider.setValue(int(self.current_settings.get("temperature", 0.7) * 10))
+        self.temperature_spin.setValue(self.current_settings.get("temperature", 0.7))
         self.max_tokens_spinbox.setValue(self.current_settings.get("max_tokens", 800))
 
     def _load_providers_and_models(self):
         """
-        Obtiene la lista de proveedores y modelos del backend de forma asíncrona.
+        Carga los proveedores y modelos de la caché en disco y los obtiene de forma asíncrona con
+        `api_client.get_providers` (que tiene su propia caché) si no hay caché o tiene más de un día.
         """
-        self.api_client.get_providers(self._on_providers_received, self._on_error)
+        cached = _read_providers_cache()
+        if cached:
+            self._on_providers_received(cached)
+        if DISABLE_REMOTE_PROVIDERS or (cached and not _providers_cache_is_stale()):
+            return
+        self.api_client.get_providers(self._on_providers_fetched, self._on_error)
+
+    def _on_providers_fetched(self, providers_data: Dict[str, List[str]]):
+        """Slot para los proveedores recibidos del backend: actualiza la caché en disco y los muestra."""
+        _write_providers_cache(providers_data)
+        self._on_providers_received(providers_data)
 
     def _on_providers_received(self, providers_data: Dict[str, List[str]]):
         """
         Slot para manejar la lista de proveedores y sus modelos recibida del backend.
         """
+        if self.providers and providers_data == self.models:
+            return # Sin cambios respecto a lo mostrado (p. ej. el refresco de la caché en disco)
         self.providers = list(providers_data.keys())
         self.models = providers_data
+        self._provider_index = {provider: i for i, provider in enumerate(self.providers)}
+        self._model_index = {provider: {model: i for i, model in enumerate(models)} for provider, models in providers_data.items()}
 
-        self.provider_combo.clear()
-        self.provider_combo.addItems(self.providers)
+        # Con las señales bloqueadas, clear/addItems/setCurrent* no disparan `_on_provider_changed`
+        # por cada paso; se llama una sola vez con el proveedor ya seleccionado.
+        # Sin repintados intermedios: el selector se dibuja una vez, ya relleno.
+        self.provider_combo.setUpdatesEnabled(False)
+        with QSignalBlocker(self.provider_combo):
+            self.provider_combo.clear()
+            self.provider_combo.addItems(self.providers)
+        self.provider_combo.setUpdatesEnabled(True)
+        for widget in (self.provider_combo, self.model_combo, self.ok_button):
+            widget.setEnabled(True)
+        self._select_current_provider()
 
-        # Seleccionar el proveedor actual
-        current_provider = self.current_settings.get("provider_name", "openai")
-        if current_provider in self.providers:
-            self.provider_combo.setCurrentText(current_provider)
-        else:
-            self.provider_combo.setCurrentIndex(0) # Seleccionar el primero por defecto
+    def _select_current_provider(self):
+        """Selecciona el proveedor de la configuración actual (o el primero) y rellena sus modelos."""
+        with QSignalBlocker(self.provider_combo):
+            current_provider = self.current_settings.get("provider_name", "openai")
+            # Si el proveedor actual no está disponible, se selecciona el primero por defecto
+            self.provider_combo.setCurrentIndex(self._provider_index.get(current_provider, 0))
+        self._select_model_for_provider(self.provider_combo.currentText())
 
     def _on_provider_changed(self, index: int):
         """
         Actualiza la lista de modelos cuando cambia el proveedor seleccionado.
         """
-        selected_provider = self.provider_combo.currentText()
-        self.model_combo.clear()
-        if selected_provider in self.models:
-            self.model_combo.addItems(self.models[selected_provider])
-            # Seleccionar el modelo actual si coincide con el proveedor
-            if self.current_settings.get("provider_name") == selected_provider:
-                current_model = self.current_settings.get("model_name")
-                if current_model in self.models[selected_provider]:
-                    self.model_combo.setCurrentText(current_model)
-                else:
-                    self.model_combo.setCurrentIndex(0) # Seleccionar el primero por defecto
-            else:
-                self.model_combo.setCurrentIndex(0) # Seleccionar el primero por defecto
+        self._select_model_for_provider(self.provider_combo.currentText())
+
+    def _select_model_for_provider(self, provider: str):
+        """Rellena el selector de modelos del proveedor y selecciona el actual (o el primero)."""
+        models = self.models.get(provider, [])
+        # El modelo actual solo aplica si pertenece al proveedor de la configuración actual
+        current_model = self.current_settings.get("model_name") if self.current_settings.get("provider_name") == provider else None
+        self.model_combo.setUpdatesEnabled(False)
+        with QSignalBlocker(self.model_combo):
+            self.model_combo.clear()
+            self.model_combo.addItems(models)
+            if models:
+                # Si el modelo actual no es de este proveedor, se selecciona el primero por defecto
+                self.model_combo.setCurrentIndex(self._model_index[provider].get(current_model, 0))
+        self.model_combo.setUpdatesEnabled(True)
 
     def _on_error(self, error_message: str):
         """
         Maneja los errores de comunicación con el backend.
         """
-        QMessageBox.critical(self, "Error de Comunicación", f"No se pudo conectar con el servidor: {error_message}")
+        self._show_error(self._TITLE_COMM_ERR, f"No se pudo conectar con el servidor: {error_message}")
+
+    def _show_error(self, title: str, text: str):
+        """
+        Muestra un error en un único QMessageBox reutilizado. Si ya está abierto (varios errores
+        seguidos), solo se actualiza su texto.
+        """
+        if self._error_box is None:
+            self._error_box = QMessageBox(QMessageBox.Critical, title, text, QMessageBox.Ok, self)
+        else:
+            self._error_box.setWindowTitle(title)
+            self._error_box.setText(text)
+        if not self._error_box.isVisible():
+            self._error_box.exec()
 
     def _on_accept(self):
         """
         Emite la señal settings_accepted con la configuración seleccionada y cierra el diálogo.
         """
-        provider_name = self.provider_combo.currentText()
-        model_name = self.model_combo.currentText()
-        temperature = self.temperature_slider.value() / 10.0
-        max_tokens = self.max_tokens_spinbox.value()
-        
-        self.settings_accepted.emit(provider_name, model_name, temperature, max_tokens)
+        self.settings_accepted.emit(self._snapshot())
         self.accept()
 
     def _on_reset_chroma_db(self):
@@ -160,32 +255,53 @@ class SettingsDialog(QDialog):
         Maneja el clic en el botón de resetear ChromaDB.
         Pide confirmación antes de proceder.
         """
-        reply = QMessageBox.question(self, "Confirmar Reseteo",
-                                       "¿Estás seguro de que quieres borrar PERMANENTEMENTE toda la memoria semántica (ChromaDB)? Esta acción no se puede deshacer.",
-                                       QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
+        if self._reset_confirm_box is None:
+            self._reset_confirm_box = QMessageBox(QMessageBox.Question, "Confirmar Reseteo",
+                                                  "¿Estás seguro de que quieres borrar PERMANENTEMENTE toda la memoria semántica (ChromaDB)? Esta acción no se puede deshacer.",
+                                                  QMessageBox.Yes | QMessageBox.No, self)
+            self._reset_confirm_box.setDefaultButton(QMessageBox.No)
 
-        if reply == QMessageBox.Yes:
+        if self._reset_confirm_box.exec() == QMessageBox.Yes:
+            # Mientras dura el borrado se muestra un indicador de progreso y el botón queda
+            # deshabilitado, para que no se lance otro reseteo.
+            self.reset_chroma_button.setEnabled(False)
+            self._reset_progress = QProgressDialog("Borrando memoria semántica…", None, 0, 0, self)
+            self._reset_progress.setWindowModality(Qt.ApplicationModal)
+            self._reset_progress.setMinimumDuration(0)
+            self._reset_progress.show()
             self.api_client.reset_chroma_db(self._on_chroma_reset_success, self._on_chroma_reset_error)
 
+    def _finish_chroma_reset(self):
+        if self._reset_progress is not None:
+            self._reset_progress.close()
+            self._reset_progress = None
+        self.reset_chroma_button.setEnabled(True)
+
     def _on_chroma_reset_success(self, response_data: Dict[str, Any]):
         """
         Maneja la respuesta exitosa del reseteo de ChromaDB.
         """
+        self._finish_chroma_reset()
         QMessageBox.information(self, "Reseteo Completado", response_data.get("message", "Memoria semántica borrada exitosamente."))
 
     def _on_chroma_reset_error(self, error_message: str):
         """
         Maneja el error durante el reseteo de ChromaDB.
         """
-        QMessageBox.critical(self, "Error al Resetear", f"Ocurrió un error al borrar la memoria semántica: {error_message}")
+        self._finish_chroma_reset()
+        self._show_error(self._TITLE_RESET_ERR, f"Ocurrió un error al borrar la memoria semántica: {error_message}")
 
     def get_settings(self) -> Dict[str, Any]:
         """
         Devuelve la configuración seleccionada por el usuario.
         """
+        return self._snapshot()
+
+    def _snapshot(self) -> Dict[str, Any]:
+        """Lee la configuración de los controles (la misma para la señal y para `get_settings`)."""
         return {
             "provider_name": self.provider_combo.currentText(),
             "model_name": self.model_combo.currentText(),
-            "temperature": self.temperature_slider.value() / 10.0,
+            "temperature": self.temperature_spin.value(),
             "max_tokens": self.max_tokens_spinbox.value()
         }
\ No newline at end of file
@@ -0,0 +1,148 @@
+import math
+
+import pytest
+
+from chimera_core.memory import response_cache
+from chimera_core.memory.response_cache import ResponseCache
+
+
+class FakePipeline:
+    """Pipeline mínimo: ejecuta los comandos contra el FakeRedis al llamar a `execute`."""
+
+    def __init__(self, client):
+        self.client = client
+        self.commands = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.commands = []
+        return False
+
+    def hset(self, *args):
+        self.commands.append(("hset", args))
+
+    def expire(self, *args):
+        self.commands.append(("expire", args))
+
+    def execute(self):
+        results = [getattr(self.client, name)(*args) for name, args in self.commands]
+        self.commands = []
+        return results
+
+
+class FakeRedis:
+    """Subconjunto de redis.Redis que usa ResponseCache, sobre diccionarios en memoria."""
+
+    def __init__(self):
+        self.hashes = {}
+        self.ttls = {}
+
+    def hget(self, key, field):
+        return self.hashes.get(key, {}).get(field)
+
+    def hvals(self, key):
+        return list(self.hashes.get(key, {}).values())
+
+    def hlen(self, key):
+        return len(self.hashes.get(key, {}))
+
+    def hset(self, key, field, value):
+        self.hashes.setdefault(key, {})[field] = value
+        return 1
+
+    def expire(self, key, seconds):
+        self.ttls[key] = seconds
+        return True
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+
+def _unit(*components):
+    norm = math.sqrt(sum(c * c for c in components))
+    return [c / norm for c in components]
+
+
+# Embeddings normalizados fijos: las dos preguntas sobre Redis son casi idénticas (similitud ~0.995)
+# y las de Neo4j y ChromaDB están lejos de ellas.
+EMBEDDINGS = {
+    "¿Qué es Redis?": _unit(1.0, 0.0, 0.0),
+    "Explícame qué es Redis": _unit(1.0, 0.1, 0.0),
+    "¿Qué es Neo4j?": _unit(0.0, 0.0, 1.0),
+    "¿Qué es ChromaDB?": _unit(0.0, 1.0, 0.0),
+}
+
+
+def fake_embedding_function(texts):
+    return [EMBEDDINGS[text] for text in texts]
+
+
+@pytest.fixture(autouse=True)
+def enable_cache(monkeypatch):
+    monkeypatch.setattr(response_cache, "RESPONSE_CACHE_ENABLED", True)
+
+
+@pytest.fixture
+def redis_client():
+    return FakeRedis()
+
+
+@pytest.fixture
+def cache(redis_client):
+    return ResponseCache(redis_client, fake_embedding_function)
+
+
+@pytest.fixture
+def scope():
+    return ResponseCache.make_scope("gpt-4o-mini", [{"role": "system", "content": "Eres Quimera."}])
+
+
+def test_exact_hit_ignores_case_and_whitespace(redis_client, scope):
+    cache = ResponseCache(redis_client)  # Sin embeddings: solo puede haber aciertos exactos
+    cache.store(scope, "¿Qué es Redis?", "Un almacén clave-valor.")
+
+    assert cache.lookup(scope, "  ¿qué   es REDIS?  ") == "Un almacén clave-valor."
+    assert cache.lookup(scope, "Explícame qué es Redis") is None
+
+
+def test_semantic_hit_above_threshold(cache, scope):
+    cache.store(scope, "¿Qué es Redis?", "Un almacén clave-valor.")
+
+    assert cache.lookup(scope, "Explícame qué es Redis") == "Un almacén clave-valor."
+
+
+def test_semantic_miss_below_threshold(cache, scope):
+    cache.store(scope, "¿Qué es Redis?", "Un almacén clave-valor.")
+
+    assert cache.lookup(scope, "¿Qué es Neo4j?") is None
+
+
+def test_scopes_are_isolated(cache, scope):
+    other_model_scope = ResponseCache.make_scope("gpt-4o", [{"role": "system", "content": "Eres Quimera."}])
+    other_history_scope = ResponseCache.make_scope("gpt-4o-mini", [{"role": "system", "content": "Eres otro asistente."}])
+    assert len({scope, other_model_scope, other_history_scope}) == 3
+
+    cache.store(scope, "¿Qué es Redis?", "Un almacén clave-valor.")
+
+    assert cache.lookup(other_model_scope, "¿Qué es Redis?") is None
+    assert cache.lookup(other_history_scope, "Explícame qué es Redis") is None
+
+
+def test_store_sets_ttl_on_scope(cache, redis_client, scope):
+    cache.store(scope, "¿Qué es Redis?", "Un almacén clave-valor.")
+
+    assert redis_client.ttls == {f"response_cache:{scope}": response_cache.RESPONSE_CACHE_TTL}
+
+
+def test_store_stops_at_max_entries(cache, redis_client, scope, monkeypatch):
+    monkeypatch.setattr(response_cache, "RESPONSE_CACHE_MAX_ENTRIES", 2)
+
+    cache.store(scope, "¿Qué es Redis?", "Un almacén clave-valor.")
+    cache.store(scope, "¿Qué es Neo4j?", "Una base de datos de grafos.")
+    cache.store(scope, "¿Qué es ChromaDB?", "Una base de datos vectorial.")
+
+    assert redis_client.hlen(f"response_cache:{scope}") == 2
+    assert cache.lookup(scope, "¿Qué es Neo4j?") == "Una base de datos de grafos."
+    assert cache.lookup(scope, "¿Qué es ChromaDB?") is None